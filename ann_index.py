@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Chỉ mục ANN kiểu IVF (inverted file) thuần NumPy cho gallery lớn
+    - Các vector được chia vào nlist cụm bằng k-means (cosine) trên vector đã chuẩn hóa L2
+    - Khi tìm kiếm chỉ quét nprobe cụm gần truy vấn nhất thay vì toàn bộ gallery
+    Index chỉ lưu chỉ số hàng (row id) trỏ vào ma trận của FaceGallery, không lưu bản sao vector
+    """
+    def __init__(self, nlist=0, nprobe=8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists = []
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-10)
+
+    def _assign(self, matrix, chunk_size=8192):
+        """Gán mỗi vector vào centroid gần nhất (chia chunk để giới hạn bộ nhớ)"""
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), chunk_size):
+            chunk = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignments
+
+    def train(self, matrix, n_iter=10, seed=0, max_train_points=256):
+        """
+        Huấn luyện centroids bằng k-means và gán toàn bộ vector vào các cụm
+        matrix: ma trận (N, D) đã chuẩn hóa L2 (FaceGallery.matrix)
+        """
+        n = len(matrix)
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+
+        # K-means chỉ cần một mẫu con, đủ ~max_train_points điểm cho mỗi cụm
+        sample_size = min(n, nlist * max_train_points)
+        sample_idx = np.sort(rng.choice(n, sample_size, replace=False))
+        sample = np.asarray(matrix[sample_idx], dtype=np.float32)
+
+        self.centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = self._assign(sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            order = np.argsort(assignments, kind='stable')
+            present = counts > 0
+            sums = np.zeros_like(self.centroids)
+            sums[present] = np.add.reduceat(sample[order], np.cumsum(counts)[present] - counts[present])
+
+            # Cụm rỗng: khởi tạo lại bằng một điểm ngẫu nhiên
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+            self.centroids = self._normalize(sums).astype(np.float32)
+
+        self.nlist = nlist
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self.n_rows = 0
+        self.add(matrix, start_id=0)
+        return self
+
+    def add(self, vectors, start_id):
+        """Thêm các vector mới (row id bắt đầu từ start_id) vào cụm gần nhất"""
+        if len(vectors) == 0:
+            return
+        assignments = self._assign(vectors)
+        ids = np.arange(start_id, start_id + len(vectors), dtype=np.int64)
+        for list_no in np.unique(assignments):
+            self.lists[list_no] = np.concatenate([self.lists[list_no], ids[assignments == list_no]])
+        self.n_rows = max(self.n_rows, start_id + len(vectors))
+
+    def remove(self, keep_mask):
+        """
+        Xóa các hàng có keep_mask=False và đánh lại row id cho các hàng còn lại
+        (giống như lọc list embeddings rồi dựng lại gallery)
+        """
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+        new_ids = np.cumsum(keep_mask) - 1
+        for list_no, ids in enumerate(self.lists):
+            ids = ids[keep_mask[ids]]
+            self.lists[list_no] = new_ids[ids]
+        self.n_rows = int(keep_mask.sum())
+
+    def search(self, matrix, queries, k=1, nprobe=None):
+        """
+        Tìm k hàng gần nhất cho mỗi truy vấn, chỉ quét nprobe cụm gần nhất
+        matrix: ma trận gallery (N, D) đã chuẩn hóa; queries: (Q, D) đã chuẩn hóa
+        Returns: (ids, similarities) kích thước (Q, k); thiếu ứng viên thì id = -1
+        """
+        queries = np.atleast_2d(queries)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for q, lists in enumerate(probe):
+            candidates = np.concatenate([self.lists[list_no] for list_no in lists])
+            if len(candidates) == 0:
+                continue
+
+            scores = matrix[candidates] @ queries[q]
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind='stable')]
+
+            ids[q, :top] = candidates[best]
+            similarities[q, :top] = scores[best]
+
+        return ids, similarities
+
+    def save(self, path):
+        """Lưu index ra file .npz (ghi file tạm rồi os.replace: tiến trình khác không đọc phải file ghi dở)"""
+        sizes = np.array([len(ids) for ids in self.lists], dtype=np.int64)
+        all_ids = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, sizes=sizes, ids=all_ids,
+                     n_rows=np.int64(self.n_rows), nprobe=np.int64(self.nprobe))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=None):
+        """Đọc index từ file .npz"""
+        with np.load(path) as data:
+            index = cls(nlist=len(data["centroids"]),
+                        nprobe=nprobe or int(data["nprobe"]))
+            index.centroids = data["centroids"].astype(np.float32)
+            index.lists = np.split(data["ids"], np.cumsum(data["sizes"])[:-1])
+            index.n_rows = int(data["n_rows"])
+        return index
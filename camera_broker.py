@@ -0,0 +1,353 @@
+import os
+import time
+import threading
+import cv2
+from video_pipeline import DropOldestQueue
+
+
+def parse_camera_source(source):
+    """CAMERA_SOURCES dạng chuỗi: số -> chỉ số thiết bị, còn lại (đường dẫn/URL) giữ nguyên"""
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+
+class CameraSubscription:
+    """
+    Một người nhận frame từ CameraBroker (preview chính, dialog thêm người...)
+    Mỗi subscription có mailbox 1 chỗ: chỉ giữ frame mới nhất, người nhận chậm không làm chậm camera
+    Frame được dùng chung giữa các subscription - không sửa tại chỗ, cần vẽ thì copy/resize trước
+    """
+    def __init__(self, broker):
+        self.broker = broker
+        self.mailbox = DropOldestQueue(1)
+        self.closed = False
+        # Tuổi frame (từ lúc camera trả về tới lúc người nhận lấy ra), trung bình trượt
+        self.age_ms = 0.0
+        self.frames_received = 0
+
+    def read(self, timeout=0.5):
+        """Chờ frame mới tiếp theo; None nếu hết timeout (camera chưa sẵn sàng/mất kết nối)"""
+        if self.closed:
+            return None
+        item = self.mailbox.get(timeout)
+        if item is None:
+            return None
+
+        captured_at, frame = item
+        age_ms = (time.time() - captured_at) * 1000
+        self.frames_received += 1
+        self.age_ms = age_ms if self.frames_received == 1 else 0.9 * self.age_ms + 0.1 * age_ms
+        return frame
+
+    def latest(self):
+        """Frame mới nhất camera đã đọc (không chờ, không lấy khỏi mailbox)"""
+        return self.broker.latest_frame
+
+    def is_opened(self):
+        return not self.closed and self.broker.is_opened()
+
+    def clear(self):
+        """Bỏ frame cũ đang chờ (ví dụ khi tiếp tục sau tạm dừng)"""
+        self.mailbox.clear()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+class CameraBroker:
+    """
+    Sở hữu duy nhất một cv2.VideoCapture cho mỗi nguồn và phát frame cho mọi subscriber
+    Một thread đọc camera liên tục; mở thiết bị khi có subscriber đầu tiên,
+    release khi subscriber cuối cùng rời đi. Chuyển màn hình chỉ là subscribe/unsubscribe,
+    không phải release rồi mở lại thiết bị
+    Với camera mạng (điện thoại, RTSP/HTTP):
+    - buffer của OpenCV giảm còn 1 frame và thread đọc liên tục nên người nhận chỉ thấy frame mới nhất
+    - đọc lỗi max_failures lần liên tiếp (mất kết nối) thì release và kết nối lại,
+      chờ tăng dần từ retry_delay tới max_backoff giây
+    Nguồn là file video được phát theo FPS của file (giả lập camera thật), hết file thì phát lại
+    (đếm ở file_loops, không tính vào read_failures/reconnects)
+    Dùng get_camera_broker(source) thay vì tạo trực tiếp để mọi nơi dùng chung một broker
+    """
+    def __init__(self, source=0, open_retries=3, retry_delay=0.5, max_backoff=10.0, max_failures=30):
+        self.source = parse_camera_source(source)
+        self.open_retries = open_retries
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+
+        self.cap = None
+        self.frame_interval = 0.0
+        self.latest_frame = None
+        self.frames_read = 0
+        self.read_failures = 0
+        self.reconnects = 0
+        self.file_loops = 0
+        # Trung bình trượt: FPS đọc được, thời gian grab (chờ/nhận dữ liệu) và decode (retrieve)
+        self.capture_fps = 0.0
+        self.grab_ms = 0.0
+        self.decode_ms = 0.0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = None
+
+    def is_opened(self):
+        cap = self.cap
+        return cap is not None and cap.isOpened()
+
+    def _open_once(self):
+        try:
+            cap = cv2.VideoCapture(self.source)
+            if cap.isOpened():
+                # Không giữ frame cũ trong buffer (backend không hỗ trợ thì bỏ qua)
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                if self.is_file:
+                    fps = cap.get(cv2.CAP_PROP_FPS)
+                    self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+                return cap
+            cap.release()
+        except Exception as e:
+            print(f"[LỖI] Không thể mở camera {self.source}: {e}")
+        return None
+
+    def _open(self):
+        for attempt in range(1, self.open_retries + 1):
+            cap = self._open_once()
+            if cap is not None:
+                print(f"[INFO] Đã mở camera {self.source}")
+                return cap
+            print(f"[CẢNH BÁO] Thử lại mở camera {self.source} lần {attempt}/{self.open_retries}")
+            time.sleep(self.retry_delay)
+        return None
+
+    def subscribe(self):
+        """Đăng ký nhận frame; mở camera nếu đây là subscriber đầu tiên"""
+        subscription = CameraSubscription(self)
+        with self._lock:
+            self._subscribers.append(subscription)
+            if self._thread is None:
+                if not self.is_opened():
+                    self.cap = self._open()
+                self._stop_event = threading.Event()
+                self._thread = threading.Thread(target=self._reader_loop, args=(self._stop_event,),
+                                                daemon=True, name=f"camera-{self.source}")
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Hủy đăng ký; subscriber cuối cùng rời đi thì dừng thread đọc và release camera"""
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+            if self._subscribers or self._thread is None:
+                return
+            thread = self._thread
+            self._thread = None
+            self._stop_event.set()
+
+        # Thread đọc tự release camera khi thoát (có thể đang kẹt trong cap.grab() của stream mạng);
+        # không release ở đây khi thread còn chạy
+        if thread is not threading.current_thread():
+            thread.join(1.0)
+
+    def _release(self):
+        if self.cap is not None:
+            try:
+                self.cap.release()
+                print(f"[INFO] Đã release camera {self.source}")
+            except Exception as e:
+                print(f"[LỖI] Lỗi khi release camera: {e}")
+            finally:
+                self.cap = None
+        self.latest_frame = None
+
+    def _reconnect(self, stop_event, backoff):
+        """Mở lại nguồn sau backoff giây. Returns: backoff cho lần thử sau"""
+        if stop_event.wait(backoff):
+            return backoff
+        cap = self._open_once()
+        if cap is None:
+            backoff = min(max(backoff * 2, self.retry_delay), self.max_backoff)
+            print(f"[CẢNH BÁO] Chưa kết nối lại được camera {self.source}, thử lại sau {backoff:.1f}s")
+            return backoff
+
+        with self._lock:
+            if stop_event.is_set():
+                cap.release()
+                return backoff
+            self.cap = cap
+        self.reconnects += 1
+        print(f"[INFO] Đã kết nối lại camera {self.source} (lần {self.reconnects})")
+        return self.retry_delay
+
+    def _restart_file(self, stop_event):
+        """Hết file video: mở lại từ đầu ngay. Returns: False nếu không mở lại được"""
+        self._drop_connection()
+        cap = self._open_once()
+        if cap is None:
+            return False
+        with self._lock:
+            if stop_event.is_set():
+                cap.release()
+                return True
+            self.cap = cap
+        self.file_loops += 1
+        return True
+
+    def _drop_connection(self):
+        """Release kết nối hỏng và bỏ frame cũ còn chờ để người nhận không xử lý frame của trước khi mất kết nối"""
+        with self._lock:
+            cap, self.cap = self.cap, None
+            for subscription in self._subscribers:
+                subscription.mailbox.clear()
+        if cap is not None:
+            try:
+                cap.release()
+            except Exception:
+                pass
+
+    def _reader_loop(self, stop_event):
+        try:
+            self._read_frames(stop_event)
+        finally:
+            with self._lock:
+                # Có subscriber mới trong lúc thread này dừng thì thread mới giữ camera
+                if self._thread is None:
+                    self._release()
+
+    def _read_frames(self, stop_event, alpha=0.1):
+        backoff = self.retry_delay
+        failures = 0
+        last_frame_time = 0.0
+        # frames_read lúc bắt đầu lượt phát file hiện tại: file không đọc được frame nào là lỗi thật
+        loop_start = self.frames_read
+        while not stop_event.is_set():
+            cap = self.cap
+            if cap is None or not cap.isOpened():
+                backoff = self._reconnect(stop_event, backoff)
+                continue
+
+            grab_start = time.time()
+            try:
+                ok = cap.grab()
+                decode_start = time.time()
+                frame = cap.retrieve()[1] if ok else None
+            except Exception as e:
+                print(f"[LỖI] Lỗi khi đọc frame: {e}")
+                ok, frame = False, None
+            end = time.time()
+
+            if not ok or frame is None:
+                # Hết file: phát lại từ đầu, không phải lỗi đọc hay mất kết nối
+                if self.is_file and self.frames_read > loop_start:
+                    loop_start = self.frames_read
+                    if self._restart_file(stop_event):
+                        continue
+
+                self.read_failures += 1
+                failures += 1
+                # Mất stream (hoặc file không đọc được): đóng rồi kết nối lại sau backoff
+                if self.is_file or failures >= self.max_failures:
+                    print(f"[CẢNH BÁO] Mất kết nối camera {self.source}, kết nối lại...")
+                    self._drop_connection()
+                    failures = 0
+                    backoff = self.retry_delay
+                else:
+                    stop_event.wait(0.05)
+                continue
+
+            failures = 0
+            self.frames_read += 1
+            grab_ms = (decode_start - grab_start) * 1000
+            decode_ms = (end - decode_start) * 1000
+            if self.frames_read == 1:
+                self.grab_ms, self.decode_ms = grab_ms, decode_ms
+            else:
+                self.grab_ms = (1 - alpha) * self.grab_ms + alpha * grab_ms
+                self.decode_ms = (1 - alpha) * self.decode_ms + alpha * decode_ms
+
+            # File video: chờ tới thời điểm của frame tiếp theo như camera thật
+            if self.frame_interval > 0 and last_frame_time > 0:
+                delay = self.frame_interval - (end - last_frame_time)
+                if delay > 0 and stop_event.wait(delay):
+                    break
+                end = time.time()
+            if last_frame_time > 0:
+                fps = 1.0 / max(end - last_frame_time, 1e-6)
+                self.capture_fps = fps if self.capture_fps == 0 else (1 - alpha) * self.capture_fps + alpha * fps
+            last_frame_time = end
+
+            self.latest_frame = frame
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription.mailbox.put((end, frame))
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            'frames_read': self.frames_read,
+            'read_failures': self.read_failures,
+            'reconnects': self.reconnects,
+            'file_loops': self.file_loops,
+            'capture_fps': self.capture_fps,
+            'grab_ms': self.grab_ms,
+            'decode_ms': self.decode_ms,
+            'frame_age_ms': max((s.age_ms for s in subscribers), default=0.0),
+            'subscribers': len(subscribers),
+            'dropped': sum(s.mailbox.dropped for s in subscribers)
+        }
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"camera {self.source}: {s['capture_fps']:.1f} FPS, grab {s['grab_ms']:.1f}ms, "
+                f"decode {s['decode_ms']:.1f}ms, tuổi frame {s['frame_age_ms']:.1f}ms, "
+                f"lỗi đọc {s['read_failures']}, kết nối lại {s['reconnects']}"
+                + (f", phát lại file {s['file_loops']}" if self.is_file else ""))
+
+    def close(self):
+        """Dừng hẳn broker, bỏ mọi subscriber (khi thoát ứng dụng)"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_camera_broker(source=0):
+    """Broker dùng chung cho mỗi nguồn camera trong tiến trình"""
+    source = parse_camera_source(source)
+    with _brokers_lock:
+        broker = _brokers.get(source)
+        if broker is None:
+            broker = CameraBroker(source)
+            _brokers[source] = broker
+        return broker
+
+
+if __name__ == "__main__":
+    # Kiểm tra nguồn camera: python camera_broker.py [chỉ số | file video | URL] [số giây]
+    # Ví dụ stream loopback: ffmpeg -re -i video.mp4 -f mpegts udp://127.0.0.1:1234
+    #                       python camera_broker.py udp://127.0.0.1:1234
+    import sys
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "0"
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+
+    broker = get_camera_broker(source)
+    subscription = broker.subscribe()
+    end_time = time.time() + duration
+    next_report = time.time() + 1.0
+    while time.time() < end_time:
+        subscription.read(timeout=0.5)
+        if time.time() >= next_report:
+            print(f"[INFO] {broker.format_stats()}")
+            next_report += 1.0
+    subscription.close()
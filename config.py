@@ -17,11 +17,49 @@ DB_CONFIG = {
 APP_CONFIG = {
     'dataset_folder': os.getenv('DATASET_FOLDER', 'dataset'),
     'embedding_file': os.getenv('EMBEDDING_FILE', 'embeddings.pkl'),
+    'embedding_cache_file': os.getenv('EMBEDDING_CACHE_FILE', 'embedding_cache.npz'),
+    'gallery_folder': os.getenv('GALLERY_FOLDER', 'gallery'),
+    'gallery_max_segments': int(os.getenv('GALLERY_MAX_SEGMENTS', '8')),
+    'gallery_max_tombstone_ratio': float(os.getenv('GALLERY_MAX_TOMBSTONE_RATIO', '0.2')),
+    # Chế độ gallery gọn cho máy ít RAM: float32 / float16 / int8 (re-rank float32 top ứng viên)
+    'gallery_dtype': os.getenv('GALLERY_DTYPE', 'float32'),
+    'rerank_candidates': int(os.getenv('RERANK_CANDIDATES', '16')),
+    'embedding_workers': int(os.getenv('EMBEDDING_WORKERS', '0')),  # 0 = số CPU
+    'embedding_batch_size': int(os.getenv('EMBEDDING_BATCH_SIZE', '32')),
     'model_name': os.getenv('MODEL_NAME', 'ArcFace'),
     'detector_backend': os.getenv('DETECTOR_BACKEND', 'retinaface'),
     'min_images_per_person': int(os.getenv('MIN_IMAGES', '5')),
     'confidence_threshold': float(os.getenv('CONFIDENCE_THRESHOLD', '0.55')),
-    'image_quality_threshold': float(os.getenv('QUALITY_THRESHOLD', '0.7'))
+    'image_quality_threshold': float(os.getenv('QUALITY_THRESHOLD', '0.7')),
+    # Chỉ mục ANN (IVF) cho gallery lớn: dưới ngưỡng số embedding thì quét chính xác
+    'ann_min_gallery_size': int(os.getenv('ANN_MIN_GALLERY_SIZE', '5000')),
+    'ann_nlist': int(os.getenv('ANN_NLIST', '0')),  # 0 = tự chọn ~sqrt(N)
+    'ann_nprobe': int(os.getenv('ANN_NPROBE', '8')),  # tăng để recall cao hơn, giảm để nhanh hơn
+    'pipeline_queue_size': int(os.getenv('PIPELINE_QUEUE_SIZE', '2')),
+    'pipeline_stats_interval': float(os.getenv('PIPELINE_STATS_INTERVAL', '0')),  # giây, 0 = không in thống kê
+    'track_iou_threshold': float(os.getenv('TRACK_IOU_THRESHOLD', '0.3')),
+    'track_max_missed': int(os.getenv('TRACK_MAX_MISSED', '10')),  # số frame mất dấu trước khi xóa track
+    'track_accept_confidence': float(os.getenv('TRACK_ACCEPT_CONFIDENCE', '0.6')),  # đủ tin cậy (và đủ phiếu) thì chốt, không nhận diện lại
+    'track_vote_window': int(os.getenv('TRACK_VOTE_WINDOW', '5')),  # số embedding gần nhất mỗi track dùng để bỏ phiếu
+    'track_min_votes': int(os.getenv('TRACK_MIN_VOTES', '2')),
+    'track_accept_margin': float(os.getenv('TRACK_ACCEPT_MARGIN', '0.1')),  # chênh lệch tối thiểu với người giống thứ hai
+    'track_early_accept': float(os.getenv('TRACK_EARLY_ACCEPT', '0.8')),  # confidence chốt ngay từ một frame
+    'track_retry_interval': float(os.getenv('TRACK_RETRY_INTERVAL', '1.0')),  # giây giữa các lần thử lại track chưa chắc chắn
+    'recognition_target_latency': float(os.getenv('RECOGNITION_TARGET_LATENCY', '0.3')),  # giây tới khi nhận diện khuôn mặt mới
+    'recognition_cpu_budget': float(os.getenv('RECOGNITION_CPU_BUDGET', '0.5')),  # tỉ lệ thời gian dành cho nhận diện
+    'recognition_max_interval': float(os.getenv('RECOGNITION_MAX_INTERVAL', '2.0')),
+    # Lọc crop camera trước ArcFace (cùng tiêu chí với check_image_quality khi thêm người)
+    'quality_min_face_size': int(os.getenv('QUALITY_MIN_FACE_SIZE', '40')),
+    'quality_min_blur': float(os.getenv('QUALITY_MIN_BLUR', '50')),  # phương sai Laplacian trên crop 160x160
+    'quality_min_brightness': float(os.getenv('QUALITY_MIN_BRIGHTNESS', '40')),
+    'quality_max_brightness': float(os.getenv('QUALITY_MAX_BRIGHTNESS', '220')),
+    'quality_max_yaw': float(os.getenv('QUALITY_MAX_YAW', '0.2')),  # cần vị trí mắt từ detector, 0 = tắt
+    'detection_scale': float(os.getenv('DETECTION_SCALE', '1.0')),  # ví dụ 0.5 cho camera 1080p
+    'detection_mode': os.getenv('DETECTION_MODE', 'full'),  # full | cascade
+    'detection_roi_padding': float(os.getenv('DETECTION_ROI_PADDING', '0.5')),
+    'ui_refresh_ms': int(os.getenv('UI_REFRESH_MS', '15')),  # chu kỳ main thread lấy frame/cập nhật giao diện
+    # Chỉ số thiết bị hoặc đường dẫn/URL video, nhiều lối vào cách nhau bằng dấu phẩy (nguồn đầu tiên hiện trên preview)
+    'camera_sources': [source.strip() for source in os.getenv('CAMERA_SOURCES', '0').split(',') if source.strip()] or ['0']
 }
 
 # Tạo thư mục dataset nếu chưa tồn tại
@@ -14,9 +14,9 @@ class DatabaseHelper:
         return cls._instance
     
     def _initialize_pool(self):
-        """Khởi tạo connection pool"""
+        """Khởi tạo connection pool (an toàn khi nhiều thread dùng chung: camera, dialog, dịch vụ nền)"""
         try:
-            self._connection_pool = psycopg2.pool.SimpleConnectionPool(
+            self._connection_pool = psycopg2.pool.ThreadedConnectionPool(
                 1, 10,  # min và max connections
                 **DB_CONFIG
             )
@@ -135,17 +135,20 @@ class DatabaseHelper:
     
     # ==================== PERSON IMAGES ====================
     
-    def add_person_image(self, person_id, image_path, image_quality):
-        """Thêm ảnh cho người"""
+    def add_person_image(self, person_id, image_path, image_quality, is_aligned=False):
+        """
+        Thêm ảnh cho người
+        is_aligned: ảnh đã là khuôn mặt crop sẵn (chụp từ camera), không cần chạy detector khi embed
+        """
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
             query = """
-                INSERT INTO person_images (person_id, image_path, image_quality)
-                VALUES (%s, %s, %s)
+                INSERT INTO person_images (person_id, image_path, image_quality, is_aligned)
+                VALUES (%s, %s, %s, %s)
                 RETURNING id
             """
-            cursor.execute(query, (person_id, image_path, image_quality))
+            cursor.execute(query, (person_id, image_path, image_quality, is_aligned))
             image_id = cursor.fetchone()[0]
             conn.commit()
             cursor.close()
@@ -176,18 +179,33 @@ class DatabaseHelper:
         finally:
             self.return_connection(conn)
     
+    def get_aligned_image_paths(self):
+        """Lấy đường dẫn các ảnh đã là khuôn mặt crop sẵn (is_aligned)"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT image_path FROM person_images WHERE is_aligned = TRUE")
+            results = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            return results
+        except Exception as e:
+            print(f"[LỖI] get_aligned_image_paths: {e}")
+            return []
+        finally:
+            self.return_connection(conn)
+    
     # ==================== RECOGNITION LOGS ====================
     
-    def add_recognition_log(self, person_id, identified_name, confidence, image_snapshot=None):
-        """Thêm log nhận diện"""
+    def add_recognition_log(self, person_id, identified_name, confidence, image_snapshot=None, recognition_time=None):
+        """Thêm log nhận diện (recognition_time: thời điểm gốc, ví dụ khi xử lý video ghi hình; None = hiện tại)"""
         conn = self.get_connection()
         try:
             cursor = conn.cursor()
             query = """
-                INSERT INTO recognition_logs (person_id, identified_name, confidence, image_snapshot)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO recognition_logs (person_id, identified_name, confidence, image_snapshot, recognition_time)
+                VALUES (%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
             """
-            cursor.execute(query, (person_id, identified_name, confidence, image_snapshot))
+            cursor.execute(query, (person_id, identified_name, confidence, image_snapshot, recognition_time))
             conn.commit()
             cursor.close()
         except Exception as e:
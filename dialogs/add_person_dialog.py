@@ -5,6 +5,7 @@ import cv2
 import os
 import threading
 from config import APP_CONFIG
+from camera_broker import get_camera_broker
 
 # Import ScrollableFrame helper
 from scrollable_dialog_helper import ScrollableFrame, create_custom_scrollbar_style
@@ -30,14 +31,15 @@ class AddPersonDialog:
         # Tạo custom scrollbar style
         create_custom_scrollbar_style()
         
-        self.cap = None
+        # Subscription vào camera dùng chung với màn hình chính (không mở lại thiết bị)
+        self.camera = None
         self.is_capturing = False
         self.captured_images = []
         self.temp_folder = "temp_captures"
         os.makedirs(self.temp_folder, exist_ok=True)
         
         self.setup_ui()
-        self.dialog.after(500, self.start_camera)
+        self.dialog.after(0, self.start_camera)
     
     def on_close(self):
         """Xử lý khi đóng dialog"""
@@ -163,28 +165,10 @@ class AddPersonDialog:
     
     def start_camera(self):
         self.is_capturing = True
-        max_retries = 3
-        retry_count = 0
-        while retry_count < max_retries and self.cap is None:
-            try:
-                self.cap = cv2.VideoCapture(0)
-                if self.cap.isOpened():
-                    print("[INFO] Camera dialog đã sẵn sàng")
-                    break
-                else:
-                    self.cap.release()
-                    self.cap = None
-                    retry_count += 1
-                    print(f"[CẢNH BÁO] Thử lại mở camera lần {retry_count}/{max_retries}")
-                    import time
-                    time.sleep(0.5)
-            except Exception as e:
-                print(f"[LỖI] Không thể mở camera: {e}")
-                retry_count += 1
-                import time
-                time.sleep(0.5)
+        if self.camera is None:
+            self.camera = get_camera_broker(APP_CONFIG['camera_sources'][0]).subscribe()
     
-        if self.cap is None or not self.cap.isOpened():
+        if not self.camera.is_opened():
             messagebox.showerror("Lỗi", 
                 "Không thể mở camera!\nVui lòng kiểm tra:\n"
                 "1. Camera đang được sử dụng bởi ứng dụng khác\n"
@@ -192,11 +176,13 @@ class AddPersonDialog:
                 parent=self.dialog)
             return
     
+        print("[INFO] Camera dialog đã sẵn sàng")
         threading.Thread(target=self.camera_loop, daemon=True).start()
     
     def camera_loop(self):
         while self.is_capturing:
-            if self.cap is None:
+            camera = self.camera
+            if camera is None:
                 break
             
             try:
@@ -207,10 +193,9 @@ class AddPersonDialog:
             except:
                 break
             
-            ret, frame = self.cap.read()
-            if not ret:
-                import time
-                time.sleep(0.1)
+            # Chờ frame mới từ broker; None khi camera tạm thời không có frame
+            frame = camera.read(timeout=0.5)
+            if frame is None:
                 continue
             
             try:
@@ -233,16 +218,13 @@ class AddPersonDialog:
                     self.dialog.update_idletasks()
             except:
                 break
-            
-            import time
-            time.sleep(0.03)
     
     def capture_image(self):
-        if self.cap is None or not self.cap.isOpened():
+        if self.camera is None or not self.camera.is_opened():
             return
         
-        ret, frame = self.cap.read()
-        if ret:
+        frame = self.camera.latest()
+        if frame is not None:
             try:
                 gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
                 faces = self.face_service.face_cascade.detectMultiScale(gray, 1.3, 5)
@@ -333,8 +315,9 @@ class AddPersonDialog:
         
         def run():
             try:
+                # Ảnh chụp đã được crop khuôn mặt (Haar) trong capture_image
                 success, message, person_id = self.face_service.add_person(
-                    person_info, self.captured_images)
+                    person_info, self.captured_images, aligned=True)
                 
                 if success:
                     import time
@@ -369,20 +352,12 @@ class AddPersonDialog:
             "Đang thêm người mới vào hệ thống...", parent=self.dialog)
     
     def cleanup(self):
-        """Dọn dẹp camera và dialog"""
-        print("[INFO] Bắt đầu cleanup camera dialog...")
+        """Hủy đăng ký camera; broker vẫn giữ thiết bị cho màn hình chính"""
         self.is_capturing = False
-        import time
-        time.sleep(0.2)
-        if self.cap:
-            try:
-                self.cap.release()
-                print("[INFO] Đã release camera dialog")
-            except Exception as e:
-                print(f"[LỖI] Lỗi khi release camera: {e}")
-            finally:
-                self.cap = None
-        time.sleep(0.3)
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+            print("[INFO] Camera dialog đã hủy đăng ký")
     
     def __del__(self):
         self.cleanup()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import os
+import time
+import multiprocessing
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Trạng thái riêng của mỗi tiến trình worker (model chỉ load một lần trong initializer)
+_worker_config = {}
+
+
+def list_dataset_images(dataset_folder, skip_labels=()):
+    """
+    Liệt kê ảnh trong dataset theo thứ tự cố định (label, tên file)
+    Returns: list (label, img_path)
+    """
+    items = []
+    for label in sorted(os.listdir(dataset_folder)):
+        person_folder = os.path.join(dataset_folder, label)
+        if not os.path.isdir(person_folder) or label in skip_labels:
+            continue
+
+        for file in sorted(os.listdir(person_folder)):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                items.append((label, os.path.join(person_folder, file)))
+    return items
+
+
+def _init_worker(model_name, detector_backend, enforce_detection, batch_size, threads_per_worker):
+    """Khởi tạo worker: giới hạn số thread TensorFlow và build model một lần"""
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception:
+        pass
+
+    from face_embedder import FaceEmbedder
+    embedder = FaceEmbedder(model_name, detector_backend, batch_size=batch_size)
+    embedder.get_model()
+
+    _worker_config.update({
+        'embedder': embedder,
+        'enforce_detection': enforce_detection
+    })
+
+
+def _embed_chunk(task):
+    """
+    Tính embeddings cho một nhóm ảnh trong worker (một lần forward theo batch)
+    task: (chunk, detector_backend) - 'skip' với ảnh khuôn mặt đã crop sẵn
+    Returns: list (label, img_path, embedding|None, lỗi|None)
+    """
+    chunk, detector_backend = task
+    try:
+        embeddings, errors = _worker_config['embedder'].represent(
+            [img_path for _, img_path in chunk],
+            detector_backend=detector_backend,
+            enforce_detection=_worker_config['enforce_detection']
+        )
+    except Exception as e:
+        # Báo lỗi cho các ảnh của nhóm này thay vì dừng cả lần build
+        embeddings = [None] * len(chunk)
+        errors = [str(e)] * len(chunk)
+    return [(label, img_path, embedding, error)
+            for (label, img_path), embedding, error in zip(chunk, embeddings, errors)]
+
+
+def _make_tasks(items, detector_backend, batch_size, aligned_paths):
+    """Chia items thành các nhóm tối đa batch_size ảnh liên tiếp có cùng detector (giữ nguyên thứ tự)"""
+    tasks = []
+    for label, img_path in items:
+        detector = "skip" if img_path in aligned_paths else detector_backend
+        if not tasks or tasks[-1][1] != detector or len(tasks[-1][0]) == batch_size:
+            tasks.append(([], detector))
+        tasks[-1][0].append((label, img_path))
+    return tasks
+
+
+def build_embeddings_parallel(items, model_name, detector_backend, workers=0,
+                              enforce_detection=False, batch_size=32, aligned_paths=(), report_every=50):
+    """
+    Tính embeddings cho danh sách ảnh bằng nhiều tiến trình, mỗi worker build model một lần
+    và forward theo batch batch_size ảnh
+    items: list (label, img_path) (ví dụ từ list_dataset_images)
+    workers: số tiến trình (0 = số CPU); 1 = chạy ngay trong tiến trình hiện tại
+    aligned_paths: các ảnh đã là khuôn mặt crop sẵn, embed với detector 'skip' (không chạy detector)
+    Yield: (label, img_path, embedding|None, lỗi|None) theo đúng thứ tự của items
+    """
+    if not items:
+        return
+
+    cpu_count = os.cpu_count() or 1
+    tasks = _make_tasks(items, detector_backend, batch_size, set(aligned_paths))
+    workers = min(workers or cpu_count, len(tasks))
+    threads_per_worker = max(1, cpu_count // workers)
+    init_args = (model_name, detector_backend, enforce_detection, batch_size, threads_per_worker)
+
+    print(f"[INFO] Tạo embeddings cho {len(items)} ảnh với {workers} worker, batch {batch_size}")
+    start_time = time.time()
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker, initargs=init_args)
+        results = pool.imap(_embed_chunk, tasks)
+    else:
+        _init_worker(*init_args)
+        results = map(_embed_chunk, tasks)
+
+    try:
+        # imap trả kết quả theo thứ tự đầu vào nên gallery cuối cùng luôn giống nhau
+        done = 0
+        last_report = 0
+        for chunk_results in results:
+            yield from chunk_results
+
+            done += len(chunk_results)
+            if done - last_report >= report_every or done == len(items):
+                last_report = done
+                elapsed = time.time() - start_time
+                print(f"[INFO] Đã xử lý {done}/{len(items)} ảnh - {done / max(elapsed, 1e-6):.2f} ảnh/giây")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Cache embedding theo từng ảnh, khóa = hash nội dung ảnh + model + detector
+    - Đổi tên thư mục/ảnh không làm mất cache (khóa không phụ thuộc đường dẫn)
+    - Đổi model hoặc detector thì khóa khác -> tự động embed lại
+    Ngoài ra lưu manifest của lần build gần nhất (label -> danh sách khóa theo thứ tự ảnh)
+    để biết người nào có ảnh thêm/bớt/thay đổi
+    Toàn bộ nằm trong một file .npz, ghi ra file tạm rồi os.replace
+    """
+    def __init__(self, path, model_name, detector_backend):
+        self.path = path
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+
+        self.vectors = {}
+        self.failed = {}
+        self.manifest = {}
+        # Đường dẫn -> [size, mtime_ns, sha1]: ảnh không đổi thì không cần đọc lại để hash
+        self.file_hashes = {}
+
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                keys = data["keys"]
+                vectors = data["vectors"]
+                meta = json.loads(str(data["meta"]))
+        except Exception as e:
+            print(f"[CẢNH BÁO] Không đọc được cache embeddings {self.path}, tạo mới: {e}")
+            return
+
+        self.vectors = {str(key): vector for key, vector in zip(keys, vectors)}
+        self.failed = meta.get("failed", {})
+        self.manifest = meta.get("manifest", {})
+        self.file_hashes = meta.get("file_hashes", {})
+
+    def save(self):
+        keys = sorted(self.vectors)
+        if keys:
+            vectors = np.stack([np.asarray(self.vectors[key], dtype=np.float32) for key in keys])
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        meta = {"failed": self.failed, "manifest": self.manifest, "file_hashes": self.file_hashes}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys, dtype=str), vectors=vectors,
+                     meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp_path, self.path)
+
+    def content_hash(self, img_path):
+        """SHA-1 nội dung ảnh; dùng lại hash cũ nếu kích thước và mtime không đổi"""
+        stat = os.stat(img_path)
+        cached = self.file_hashes.get(img_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        sha1 = hashlib.sha1()
+        with open(img_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        self.file_hashes[img_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key_for(self, img_path, detector_backend=None):
+        detector_backend = detector_backend or self.detector_backend
+        return f"{self.model_name}|{detector_backend}|{self.content_hash(img_path)}"
+
+    def __contains__(self, key):
+        return key in self.vectors or key in self.failed
+
+    def get(self, key):
+        return self.vectors.get(key)
+
+    def put(self, key, embedding, error=None):
+        """Lưu embedding (hoặc lỗi, để lần sau không thử lại ảnh không có khuôn mặt)"""
+        if embedding is None:
+            self.failed[key] = error
+        else:
+            self.vectors[key] = np.asarray(embedding, dtype=np.float32)
+
+    def prune(self, paths, keys):
+        """Bỏ các mục của ảnh không còn trong dataset"""
+        keys = set(keys)
+        self.vectors = {key: vector for key, vector in self.vectors.items() if key in keys}
+        self.failed = {key: error for key, error in self.failed.items() if key in keys}
+        paths = set(paths)
+        self.file_hashes = {path: value for path, value in self.file_hashes.items() if path in paths}
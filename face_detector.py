@@ -0,0 +1,194 @@
+import time
+import threading
+import cv2
+from deepface import DeepFace
+
+
+class FaceDetector:
+    """
+    Phát hiện khuôn mặt bằng DeepFace (RetinaFace...) trên bản thu nhỏ của frame
+    Box được phóng lại về kích thước gốc và khuôn mặt được crop từ frame độ phân giải đầy đủ
+    để embedding không mất chi tiết. Độ trễ phát hiện được thống kê theo từng scale
+    mode:
+    - 'full': chạy detector trên toàn frame
+    - 'cascade': Haar cascade (rẻ) quyết định có khuôn mặt hay không; nếu có, detector chỉ chạy
+      trên vùng quanh các box Haar (nới rộng roi_padding lần kích thước box). Frame trống gần như không tốn gì
+    """
+    def __init__(self, detector_backend, scale=1.0, mode='full', cascade=None, roi_padding=0.5):
+        self.detector_backend = detector_backend
+        self.scale = scale
+        self.mode = mode
+        self.cascade = cascade
+        self.roi_padding = roi_padding
+        # "x{scale}" / "roi x{scale}" / "cascade trống" -> {'count', 'latency_ms' (trung bình trượt), 'max_latency_ms', 'faces'}
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, key, latency, faces, alpha=0.1):
+        with self._stats_lock:
+            stats = self.stats.setdefault(key, {'count': 0, 'latency_ms': 0.0, 'max_latency_ms': 0.0, 'faces': 0})
+            latency_ms = latency * 1000
+            stats['count'] += 1
+            stats['latency_ms'] = latency_ms if stats['count'] == 1 else \
+                (1 - alpha) * stats['latency_ms'] + alpha * latency_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+            stats['faces'] = faces
+
+    def cascade_boxes(self, frame):
+        """Box Haar cascade trên frame (cùng tham số với vòng lặp camera)"""
+        if self.cascade is None:
+            self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return self.cascade.detectMultiScale(gray, 1.3, 5)
+
+    def roi_regions(self, boxes, frame_shape):
+        """Các vùng (x1, y1, x2, y2) nới rộng quanh box, vùng chồng lên nhau được gộp lại"""
+        frame_h, frame_w = frame_shape[:2]
+        regions = []
+        for x, y, w, h in boxes:
+            pad_w, pad_h = int(w * self.roi_padding), int(h * self.roi_padding)
+            regions.append([max(0, x - pad_w), max(0, y - pad_h),
+                            min(frame_w, x + w + pad_w), min(frame_h, y + h + pad_h)])
+
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def _detect_region(self, frame, region, scale):
+        """
+        Chạy detector trên một vùng của frame (thu nhỏ theo scale)
+        Returns: list (box, mắt) - box theo tọa độ frame gốc, mắt là dict {'left_eye', 'right_eye'}
+                 theo tọa độ frame gốc nếu detector trả về (RetinaFace ở bản DeepFace mới), None nếu không
+        """
+        x1, y1, x2, y2 = region
+        image = frame[y1:y2, x1:x2]
+        if scale != 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        results = DeepFace.extract_faces(image, detector_backend=self.detector_backend, enforce_detection=False)
+
+        boxes = []
+        for r in results:
+            # Không tìm thấy khuôn mặt thì DeepFace trả về cả vùng (ROI hoặc cả frame) với confidence 0
+            if not r.get("confidence"):
+                continue
+            fa = r["facial_area"]
+            x = max(x1, x1 + int(round(fa["x"] / scale)))
+            y = max(y1, y1 + int(round(fa["y"] / scale)))
+            w = min(x2 - x, int(round(fa["w"] / scale)))
+            h = min(y2 - y, int(round(fa["h"] / scale)))
+            eyes = None
+            if fa.get("left_eye") is not None and fa.get("right_eye") is not None:
+                eyes = {name: (x1 + fa[name][0] / scale, y1 + fa[name][1] / scale)
+                        for name in ("left_eye", "right_eye")}
+            boxes.append(((x, y, w, h), eyes))
+        return boxes
+
+    def detect(self, frame, scale=None, hint_boxes=None, return_landmarks=False):
+        """
+        Phát hiện khuôn mặt trong frame BGR
+        scale: tỉ lệ thu nhỏ khi chạy detector (None = self.scale, 1.0 = không thu nhỏ)
+        hint_boxes: box Haar đã có sẵn (chế độ cascade); None thì tự chạy Haar
+        Returns: (boxes, face_imgs) - box (x, y, w, h) theo frame gốc, ảnh crop từ frame gốc
+                 return_landmarks=True: (boxes, face_imgs, landmarks) - vị trí hai mắt theo tọa độ crop hoặc None
+        """
+        scale = self.scale if scale is None else scale
+        start = time.time()
+        frame_h, frame_w = frame.shape[:2]
+
+        if self.mode == 'cascade':
+            if hint_boxes is None:
+                hint_boxes = self.cascade_boxes(frame)
+            if len(hint_boxes) == 0:
+                self._record("cascade trống", time.time() - start, 0)
+                return ([], [], []) if return_landmarks else ([], [])
+
+            raw_boxes = []
+            for region in self.roi_regions(hint_boxes, frame.shape):
+                for box, eyes in self._detect_region(frame, region, scale):
+                    # Bỏ box trùng (cùng khuôn mặt thấy ở hai vùng)
+                    if not any(self._overlap(box, other) > 0.5 for other, _ in raw_boxes):
+                        raw_boxes.append((box, eyes))
+            key = f"roi x{scale}"
+        else:
+            raw_boxes = self._detect_region(frame, (0, 0, frame_w, frame_h), scale)
+            key = f"x{scale}"
+
+        boxes = []
+        face_imgs = []
+        landmarks = []
+        for (x, y, w, h), eyes in raw_boxes:
+            face_img = frame[y:y+h, x:x+w]
+            if face_img.size > 0:
+                boxes.append((x, y, w, h))
+                face_imgs.append(face_img)
+                landmarks.append({name: (px - x, py - y) for name, (px, py) in eyes.items()} if eyes else None)
+
+        self._record(key, time.time() - start, len(boxes))
+        if return_landmarks:
+            return boxes, face_imgs, landmarks
+        return boxes, face_imgs
+
+    @staticmethod
+    def _overlap(a, b):
+        """IoU của hai box (x, y, w, h)"""
+        x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+        x2, y2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+        inter = max(0, x2 - x1) * max(0, y2 - y1)
+        union = a[2] * a[3] + b[2] * b[3] - inter
+        return inter / union if union > 0 else 0.0
+
+    def benchmark(self, frame, scales=(1.0, 0.75, 0.5, 0.33), repeats=3):
+        """
+        Đo độ trễ phát hiện ở nhiều scale trên cùng một frame để chọn DETECTION_SCALE
+        Returns: dict scale -> {'latency_ms', 'faces'}
+        """
+        report = {}
+        for scale in scales:
+            latencies = []
+            for _ in range(repeats):
+                start = time.time()
+                boxes, _ = self.detect(frame, scale)
+                latencies.append(time.time() - start)
+            report[scale] = {'latency_ms': min(latencies) * 1000, 'faces': len(boxes)}
+            print(f"[INFO] Detect scale {scale}: {report[scale]['latency_ms']:.1f}ms, {len(boxes)} khuôn mặt")
+        return report
+
+    def format_stats(self):
+        with self._stats_lock:
+            return " | ".join(f"detect {key}: {s['latency_ms']:.1f}ms ({s['count']} lần)"
+                              for key, s in sorted(self.stats.items()))
+
+
+if __name__ == "__main__":
+    # Đo độ trễ phát hiện theo scale để chọn DETECTION_SCALE: python face_detector.py [ảnh | chỉ số camera]
+    import sys
+    from config import APP_CONFIG
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "0"
+    if source.isdigit():
+        cap = cv2.VideoCapture(int(source))
+        ret, frame = cap.read()
+        cap.release()
+        if not ret:
+            print("[LỖI] Không đọc được frame từ camera")
+            sys.exit(1)
+    else:
+        frame = cv2.imread(source)
+        if frame is None:
+            print(f"[LỖI] Không đọc được ảnh: {source}")
+            sys.exit(1)
+
+    print(f"[INFO] Frame {frame.shape[1]}x{frame.shape[0]}, detector {APP_CONFIG['detector_backend']}")
+    FaceDetector(APP_CONFIG['detector_backend'], mode=APP_CONFIG['detection_mode']).benchmark(frame)
@@ -0,0 +1,124 @@
+import cv2
+import threading
+import numpy as np
+from deepface import DeepFace
+
+
+class FaceEmbedder:
+    """
+    Tính embeddings trực tiếp bằng model (DeepFace.build_model, build một lần),
+    tiền xử lý vào một batch tensor NumPy cấp phát sẵn và forward theo batch_size.
+    Không phụ thuộc database nên dùng được cả trong worker process
+    """
+    def __init__(self, model_name, detector_backend, batch_size=32):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.batch_size = batch_size
+        
+        self._model = None
+        self._batch = None
+        self._lock = threading.Lock()
+    
+    def get_model(self):
+        """Build model embedding (ArcFace...) một lần duy nhất"""
+        if self._model is None:
+            print(f"[INFO] Đang load model {self.model_name}...")
+            self._model = DeepFace.build_model(self.model_name)
+        return self._model
+    
+    @property
+    def target_size(self):
+        return tuple(self.get_model().input_shape[1:3])
+    
+    def _get_batch_buffer(self):
+        """Batch tensor (batch_size, H, W, 3) cấp phát một lần, dùng lại cho mọi lần forward"""
+        if self._batch is None:
+            target_h, target_w = self.target_size
+            self._batch = np.zeros((self.batch_size, target_h, target_w, 3), dtype=np.float32)
+        return self._batch
+    
+    def preprocess_face(self, face_img, out):
+        """
+        Tiền xử lý ảnh khuôn mặt đã crop (BGR) giống DeepFace (detector_backend='skip'):
+        resize giữ tỉ lệ, pad về kích thước của out, chia 255 - ghi thẳng vào out
+        """
+        target_h, target_w = out.shape[:2]
+        factor = min(target_h / face_img.shape[0], target_w / face_img.shape[1])
+        dsize = (max(1, int(face_img.shape[1] * factor)), max(1, int(face_img.shape[0] * factor)))
+        img = cv2.resize(face_img, dsize)
+        
+        diff_0 = target_h - img.shape[0]
+        diff_1 = target_w - img.shape[1]
+        if diff_0 < 0 or diff_1 < 0:
+            img = cv2.resize(img, (target_w, target_h))
+            diff_0 = diff_1 = 0
+        
+        out.fill(0)
+        top, left = diff_0 // 2, diff_1 // 2
+        np.multiply(img, 1.0 / 255, out=out[top:top + img.shape[0], left:left + img.shape[1]],
+                    casting='unsafe')
+    
+    def align_face(self, img, out, detector_backend, enforce_detection=False):
+        """Phát hiện + căn chỉnh khuôn mặt đầu tiên trong ảnh gốc bằng detector, ghi vào out"""
+        face = DeepFace.extract_faces(
+            img_path=img,
+            target_size=out.shape[:2],
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=True
+        )[0]["face"]
+        # extract_faces trả về RGB, model được huấn luyện với thứ tự kênh BGR như DeepFace.represent
+        out[...] = face[:, :, ::-1]
+    
+    def represent(self, images, detector_backend="skip", enforce_detection=False):
+        """
+        Tính embeddings cho nhiều ảnh, forward theo từng batch batch_size
+        images: list ảnh BGR (numpy) hoặc đường dẫn ảnh
+        detector_backend: 'skip' nếu ảnh đã là khuôn mặt crop sẵn, ngược lại phát hiện + căn chỉnh
+        Returns: (embeddings, errors) - hai list song song với images, ảnh lỗi có embedding None
+        """
+        embeddings = [None] * len(images)
+        errors = [None] * len(images)
+        
+        with self._lock:
+            model = self.get_model()
+            batch = self._get_batch_buffer()
+            slots = []
+            
+            for i, img in enumerate(images):
+                try:
+                    if detector_backend == "skip":
+                        if isinstance(img, str):
+                            img = cv2.imread(img)
+                            if img is None:
+                                raise ValueError("Không đọc được ảnh")
+                        self.preprocess_face(img, batch[len(slots)])
+                    else:
+                        self.align_face(img, batch[len(slots)], detector_backend, enforce_detection)
+                    slots.append(i)
+                except Exception as e:
+                    errors[i] = str(e)
+                
+                if len(slots) == self.batch_size or (i == len(images) - 1 and slots):
+                    # Batch lỗi (ví dụ hết bộ nhớ) chỉ làm hỏng các ảnh trong batch đó, batch sau vẫn chạy tiếp
+                    try:
+                        outputs = np.asarray(model.predict_on_batch(batch[:len(slots)]), dtype=np.float32)
+                        for slot, output in zip(slots, outputs):
+                            embeddings[slot] = output
+                    except Exception as e:
+                        for slot in slots:
+                            errors[slot] = f"Lỗi forward batch: {e}"
+                    slots = []
+        
+        return embeddings, errors
+    
+    def represent_batch(self, face_imgs):
+        """Embeddings cho các khuôn mặt đã crop (BGR). Returns: ma trận (F, D) float32"""
+        if len(face_imgs) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        embeddings, errors = self.represent(face_imgs)
+        
+        # Crop lỗi nhận vector 0 -> similarity 0 -> "Unknown", không làm hỏng cả frame
+        dim = self.get_model().output_shape[-1]
+        return np.stack([e if e is not None else np.zeros(dim, dtype=np.float32) for e in embeddings])
@@ -0,0 +1,430 @@
+import copy
+import mmap
+import numpy as np
+
+
+def resident_bytes(matrix):
+    """Số byte của ma trận thật sự nằm trong RAM (phần mmap từ file gallery không tính)"""
+    if isinstance(matrix, SegmentedRows):
+        return sum(resident_bytes(block) for block in matrix.blocks)
+
+    base = matrix
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return 0
+        base = getattr(base, 'base', None)
+    return matrix.nbytes
+
+
+class SegmentedRows:
+    """
+    Ma trận (N, D) chỉ đọc ghép từ nhiều khối (mmap của từng segment gallery) mà không copy vào RAM
+    rows[i]: chỉ số các hàng còn giữ của khối i (bỏ hàng đã bị tombstone), None = giữ tất cả
+    Chỉ hỗ trợ lấy hàng theo slice / mảng chỉ số (re-rank, chỉ mục ANN, đo recall);
+    np.asarray() mới ghép thành một ma trận trong RAM
+    """
+    def __init__(self, blocks, rows=None):
+        self.blocks = list(blocks)
+        self.rows = list(rows) if rows is not None else [None] * len(self.blocks)
+        sizes = [len(block) if rows is None else len(rows) for block, rows in zip(self.blocks, self.rows)]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+        self.shape = (int(self.offsets[-1]), self.blocks[0].shape[1] if self.blocks else 0)
+        self.dtype = np.dtype(np.float32)
+        self.ndim = 2
+
+    @classmethod
+    def join(cls, *matrices):
+        """Nối các ma trận / SegmentedRows theo hàng, không copy dữ liệu"""
+        blocks, rows = [], []
+        for matrix in matrices:
+            if isinstance(matrix, SegmentedRows):
+                blocks.extend(matrix.blocks)
+                rows.extend(matrix.rows)
+            elif len(matrix):
+                blocks.append(matrix)
+                rows.append(None)
+        return cls(blocks, rows)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(len(self)))
+        ids = np.asarray(key, dtype=np.int64)
+        flat = ids.ravel()
+
+        out = np.empty((len(flat), self.shape[1]), dtype=np.float32)
+        # Khối rỗng có cùng offset với khối sau nó: side='right' luôn chọn khối có hàng
+        block_of = np.searchsorted(self.offsets, flat, side='right') - 1
+        for block_no in np.unique(block_of):
+            selected = block_of == block_no
+            local = flat[selected] - self.offsets[block_no]
+            if self.rows[block_no] is not None:
+                local = self.rows[block_no][local]
+            out[selected] = self.blocks[block_no][local]
+        return out.reshape(ids.shape + (self.shape[1],))
+
+    def __array__(self, dtype=None, copy=None):
+        parts = [np.asarray(block if rows is None else block[rows], dtype=np.float32)
+                 for block, rows in zip(self.blocks, self.rows)]
+        matrix = np.concatenate(parts) if parts else np.zeros(self.shape, dtype=np.float32)
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+class FaceGallery:
+    """
+    Gallery embeddings dạng ma trận float32 liên tục, đã chuẩn hóa L2 sẵn
+    Mỗi truy vấn chỉ cần một phép nhân ma trận-vector + argmin
+    """
+    def __init__(self, matrix=None, identities=None, normalized=False, person_ids=None):
+        self._groups = None
+        self._person_lookup = None
+        # Chỉ mục ANN (IVFIndex) tùy chọn cho gallery lớn; None = quét toàn bộ (chính xác)
+        self.index = None
+        # Bản nén (float16/int8) dùng để quét; None = quét trực tiếp ma trận float32
+        self.storage_dtype = 'float32'
+        self.scan_matrix = None
+        self.scan_scales = None
+        self.rerank_candidates = 16
+
+        if matrix is None or len(matrix) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.identities = np.array([], dtype=object)
+            self.person_ids = np.zeros(0, dtype=np.int64)
+            return
+
+        if isinstance(matrix, SegmentedRows) and normalized:
+            # Chế độ ít RAM: các segment vẫn là mmap trên đĩa, chỉ đọc hàng khi re-rank
+            self.matrix = matrix
+        else:
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            if not normalized:
+                matrix = self.l2_normalize(matrix)
+            self.matrix = matrix
+        self.identities = np.asarray(identities, dtype=object)
+        # person_id trong database cho từng hàng (-1 = chưa biết)
+        if person_ids is None:
+            person_ids = np.full(len(self.identities), -1, dtype=np.int64)
+        self.person_ids = np.asarray(person_ids, dtype=np.int64)
+
+    @classmethod
+    def from_embeddings(cls, embeddings):
+        """Tạo gallery từ list dict {"identity", "embedding"} (định dạng embeddings.pkl)"""
+        if not embeddings:
+            return cls()
+
+        matrix = np.stack([np.asarray(e["embedding"], dtype=np.float32) for e in embeddings])
+        identities = [e["identity"] for e in embeddings]
+        return cls(matrix, identities)
+
+    def extended(self, matrix, identities, person_ids=None):
+        """
+        Gallery mới = gallery hiện tại + các hàng mới; gallery cũ không bị sửa
+        nên thread đang nhận diện vẫn đọc an toàn cho tới khi đổi sang gallery mới
+        Bản nén và chỉ mục ANN chỉ xử lý thêm các hàng mới
+        """
+        added = FaceGallery(matrix, identities, person_ids=person_ids)
+        if len(self) == 0:
+            return added.compress(self.storage_dtype, self.rerank_candidates)
+        if len(added) == 0:
+            return self
+
+        if self.scan_matrix is not None or isinstance(self.matrix, SegmentedRows):
+            # Chế độ ít RAM: giữ nguyên các khối mmap, chỉ thêm khối mới thay vì ghép thành ma trận trong RAM
+            matrix = SegmentedRows.join(self.matrix, added.matrix)
+        else:
+            matrix = np.concatenate([self.matrix, added.matrix])
+
+        gallery = FaceGallery(matrix,
+                              np.concatenate([self.identities, added.identities]),
+                              normalized=True,
+                              person_ids=np.concatenate([self.person_ids, added.person_ids]))
+        gallery.storage_dtype = self.storage_dtype
+        gallery.rerank_candidates = self.rerank_candidates
+
+        if self.scan_matrix is not None:
+            added.compress(self.storage_dtype, self.rerank_candidates)
+            gallery.scan_matrix = np.concatenate([self.scan_matrix, added.scan_matrix])
+            if self.scan_scales is not None:
+                gallery.scan_scales = np.concatenate([self.scan_scales, added.scan_scales])
+
+        if self.index is not None:
+            index = copy.copy(self.index)
+            index.lists = list(self.index.lists)
+            index.add(added.matrix, start_id=len(self))
+            gallery.index = index
+
+        return gallery
+
+    @staticmethod
+    def l2_normalize(vectors):
+        """Chuẩn hóa L2 theo hàng, tránh chia cho 0"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-10)
+
+    def __len__(self):
+        return len(self.identities)
+
+    def find_best_match(self, face_emb, threshold):
+        """
+        Tìm người khớp nhất
+        Returns: (identity, confidence) - giống FaceRecognitionService.find_best_match
+        """
+        if len(self) == 0:
+            return "Unknown", 0.0
+
+        query = self.l2_normalize(face_emb)
+        if self.index is not None or self.scan_matrix is not None:
+            ids, similarities = self._top_rows(query[None], k=1)
+            best = int(ids[0, 0])
+            if best < 0:
+                return "Unknown", 0.0
+            min_dist = 1.0 - float(similarities[0, 0])
+        else:
+            similarities = np.asarray(self.matrix) @ query
+
+            # Khoảng cách cosine = 1 - similarity nên argmin khoảng cách = argmax similarity
+            best = int(np.argmax(similarities))
+            min_dist = 1.0 - float(similarities[best])
+
+        identity = self.identities[best]
+        confidence = max(0, 1 - min_dist)
+
+        if min_dist > threshold:
+            identity = "Unknown"
+
+        return identity, confidence
+
+    def person_id(self, identity):
+        """person_id trong database của identity theo cột person_ids (-1 nếu các hàng của identity chưa có)"""
+        if self._person_lookup is None:
+            lookup = {}
+            for row_identity, person_id in zip(self.identities, self.person_ids):
+                if person_id >= 0:
+                    lookup.setdefault(row_identity, int(person_id))
+            self._person_lookup = lookup
+        return self._person_lookup.get(identity, -1)
+
+    def _identity_groups(self):
+        """Thứ tự hàng gom theo identity + vị trí bắt đầu mỗi nhóm (tính một lần, cache lại)"""
+        if self._groups is None:
+            labels, codes = np.unique(self.identities.astype(str), return_inverse=True)
+            order = np.argsort(codes, kind='stable')
+            starts = np.searchsorted(codes[order], np.arange(len(labels)))
+            self._groups = (labels, order, starts)
+        return self._groups
+
+    def find_best_matches(self, face_embs, threshold, top_k=1):
+        """
+        So khớp nhiều khuôn mặt cùng lúc bằng một phép nhân ma trận (GEMM)
+        face_embs: ma trận (F, D) embeddings của các khuôn mặt trong frame
+        Returns: list F phần tử, mỗi phần tử là list tối đa top_k (identity, confidence)
+                 của các người khác nhau, giảm dần theo confidence.
+                 Phần tử đầu tiên luôn giống kết quả find_best_match
+        """
+        queries = np.atleast_2d(np.asarray(face_embs, dtype=np.float32))
+        if len(queries) == 0:
+            return []
+        if len(self) == 0:
+            return [[("Unknown", 0.0)] for _ in range(len(queries))]
+
+        queries = self.l2_normalize(queries)
+        if self.index is not None or self.scan_matrix is not None:
+            ranked = self._rank_persons_candidates(queries, top_k)
+        else:
+            ranked = self._rank_persons_exact(queries, top_k)
+
+        results = []
+        for persons in ranked:
+            matches = [(identity, max(0, score)) for identity, score in persons
+                       if 1.0 - score <= threshold]
+            if not matches:
+                matches = [("Unknown", max(0, persons[0][1]) if persons else 0.0)]
+            results.append(matches)
+
+        return results
+
+    def _rank_persons_exact(self, queries, top_k):
+        """Quét toàn bộ gallery bằng một GEMM, trả về top_k người (identity, score) mỗi truy vấn"""
+        similarities = queries @ np.asarray(self.matrix).T
+
+        # Điểm của mỗi người = similarity lớn nhất trong các ảnh của người đó
+        labels, order, starts = self._identity_groups()
+        person_scores = np.maximum.reduceat(similarities[:, order], starts, axis=1)
+
+        top_k = max(1, min(top_k, len(labels)))
+        if top_k < len(labels):
+            top_idx = np.argpartition(-person_scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            top_idx = np.broadcast_to(np.arange(len(labels)), person_scores.shape)
+        top_scores = np.take_along_axis(person_scores, top_idx, axis=1)
+        rank = np.argsort(-top_scores, axis=1, kind='stable')
+        top_idx = np.take_along_axis(top_idx, rank, axis=1)
+        top_scores = np.take_along_axis(top_scores, rank, axis=1)
+
+        return [[(str(labels[i]), float(s)) for i, s in zip(idx_row, score_row)]
+                for idx_row, score_row in zip(top_idx, top_scores)]
+
+    def _rank_persons_candidates(self, queries, top_k, rows_per_person=8):
+        """Lấy các hàng ứng viên (ANN hoặc quét bản nén) rồi gom theo người, trả về top_k người mỗi truy vấn"""
+        ids, similarities = self._top_rows(queries, k=max(32, top_k * rows_per_person))
+
+        ranked = []
+        for id_row, score_row in zip(ids, similarities):
+            persons = []
+            seen = set()
+            for row, score in zip(id_row, score_row):
+                if row < 0:
+                    break
+                identity = self.identities[row]
+                if identity in seen:
+                    continue
+                seen.add(identity)
+                persons.append((identity, float(score)))
+                if len(persons) == top_k:
+                    break
+            ranked.append(persons)
+
+        return ranked
+
+    def _top_rows(self, queries, k):
+        """
+        k hàng gần nhất cho mỗi truy vấn (đã chuẩn hóa), similarity float32 chính xác, giảm dần
+        Returns: (ids, similarities) kích thước (Q, k); thiếu ứng viên thì id = -1
+        """
+        if self.index is not None:
+            return self.index.search(self.matrix, queries, k=k)
+
+        # Quét nhanh trên bản nén rồi re-rank chính xác các ứng viên tốt nhất bằng float32
+        approx = self._approx_similarities(queries)
+        n_candidates = min(len(self), max(k, self.rerank_candidates))
+        candidates = np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates]
+        exact = np.einsum('qrd,qd->qr', self.matrix[candidates.ravel()].reshape(
+            len(queries), n_candidates, -1), queries)
+
+        order = np.argsort(-exact, axis=1, kind='stable')[:, :k]
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids[:, :order.shape[1]] = np.take_along_axis(candidates, order, axis=1)
+        similarities[:, :order.shape[1]] = np.take_along_axis(exact, order, axis=1)
+        return ids, similarities
+
+    def compress(self, dtype='float32', rerank_candidates=16, chunk_size=16384):
+        """
+        Tạo bản nén để quét gallery với ít RAM hơn:
+        - 'float16': một nửa bộ nhớ
+        - 'int8': một phần tư bộ nhớ, mỗi vector có một hệ số scale riêng
+        Ma trận float32 (mmap) chỉ còn được đọc ở các hàng ứng viên khi re-rank
+        Nén theo chunk nên không bao giờ đọc toàn bộ ma trận float32 vào RAM
+        """
+        self.storage_dtype = dtype
+        self.rerank_candidates = rerank_candidates
+        self.scan_matrix = None
+        self.scan_scales = None
+        if dtype == 'float32' or len(self) == 0:
+            return self
+
+        if dtype == 'float16':
+            self.scan_matrix = np.empty(self.matrix.shape, dtype=np.float16)
+        elif dtype == 'int8':
+            self.scan_matrix = np.empty(self.matrix.shape, dtype=np.int8)
+            self.scan_scales = np.empty(len(self), dtype=np.float32)
+        else:
+            raise ValueError(f"Kiểu lưu gallery không hỗ trợ: {dtype}")
+
+        for start in range(0, len(self), chunk_size):
+            chunk = np.asarray(self.matrix[start:start + chunk_size], dtype=np.float32)
+            if self.scan_scales is None:
+                self.scan_matrix[start:start + chunk_size] = chunk
+            else:
+                scales = np.maximum(np.abs(chunk).max(axis=1), 1e-10) / 127
+                self.scan_matrix[start:start + chunk_size] = np.clip(
+                    np.rint(chunk / scales[:, None]), -127, 127).astype(np.int8)
+                self.scan_scales[start:start + chunk_size] = scales
+
+        return self
+
+    def _approx_similarities(self, queries, chunk_size=16384):
+        """Similarity gần đúng với toàn bộ gallery, quét bản nén theo chunk (giới hạn bộ nhớ tạm)"""
+        similarities = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            chunk = self.scan_matrix[start:start + chunk_size].astype(np.float32)
+            similarities[:, start:start + chunk_size] = queries @ chunk.T
+
+        if self.scan_scales is not None:
+            similarities *= self.scan_scales
+        return similarities
+
+    def memory_footprint(self):
+        """
+        Số byte dùng cho việc quét gallery so với float32
+        resident_float32_bytes: phần ma trận float32 thật sự nằm trong RAM (segment mmap không tính)
+        """
+        float32_bytes = len(self) * (self.matrix.shape[1] if len(self) else 0) * 4
+        if self.scan_matrix is None:
+            scan_bytes = float32_bytes
+        else:
+            scan_bytes = self.scan_matrix.nbytes + (self.scan_scales.nbytes if self.scan_scales is not None else 0)
+        return {'dtype': self.storage_dtype, 'scan_bytes': scan_bytes, 'float32_bytes': float32_bytes,
+                'resident_float32_bytes': resident_bytes(self.matrix) if len(self) else 0}
+
+    def measure_recall(self, queries=None, sample_size=200, noise=0.05, seed=0, chunk_size=16384):
+        """
+        Recall@1 (theo hàng) của đường tìm kiếm đang dùng (chỉ mục ANN nếu có, nếu không thì bản nén)
+        so với quét float32 chính xác. Quét toàn bộ ma trận nên chỉ dùng để chẩn đoán, không gọi khi load
+        queries: nếu None thì lấy ngẫu nhiên các vector trong gallery cộng nhiễu nhỏ
+        """
+        if len(self) == 0 or (self.index is None and self.scan_matrix is None):
+            return 1.0
+
+        if queries is None:
+            rng = np.random.default_rng(seed)
+            rows = rng.choice(len(self), min(sample_size, len(self)), replace=False)
+            queries = np.asarray(self.matrix[np.sort(rows)], dtype=np.float32)
+            queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+        queries = self.l2_normalize(np.atleast_2d(queries))
+
+        # Quét chính xác theo chunk để không tạo ma trận similarity (Q, N) cho cả gallery
+        baseline = np.zeros(len(queries), dtype=np.int64)
+        best = np.full(len(queries), -np.inf, dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            similarities = queries @ np.asarray(self.matrix[start:start + chunk_size], dtype=np.float32).T
+            rows = np.argmax(similarities, axis=1)
+            scores = similarities[np.arange(len(queries)), rows]
+            better = scores > best
+            baseline[better] = rows[better] + start
+            best[better] = scores[better]
+
+        ids, _ = self._top_rows(queries, k=1)
+        return float(np.mean(ids[:, 0] == baseline))
+
+
+if __name__ == "__main__":
+    # Đo recall@1 của đường tìm kiếm ứng dụng đang dùng (chỉ mục ANN hoặc bản nén GALLERY_DTYPE)
+    # so với quét float32 chính xác: python face_gallery.py [số truy vấn]
+    import os
+    import sys
+    from config import APP_CONFIG
+    from gallery_store import GalleryStore
+    from ann_index import IVFIndex
+
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    gallery = GalleryStore(APP_CONFIG['gallery_folder']).load_gallery(segmented=True)
+    ann_index_file = os.path.splitext(APP_CONFIG['embedding_file'])[0] + '.ivf.npz'
+
+    if len(gallery) >= APP_CONFIG['ann_min_gallery_size'] and os.path.exists(ann_index_file):
+        gallery.index = IVFIndex.load(ann_index_file, nprobe=APP_CONFIG['ann_nprobe'])
+        if len(gallery.index) != len(gallery):
+            print("[CẢNH BÁO] Chỉ mục ANN không khớp với gallery, ứng dụng sẽ build lại khi load")
+        mode = f"ANN ({gallery.index.nlist} cụm, nprobe {gallery.index.nprobe})"
+    else:
+        gallery.compress(APP_CONFIG['gallery_dtype'], APP_CONFIG['rerank_candidates'])
+        mode = f"quét {gallery.storage_dtype}"
+
+    footprint = gallery.memory_footprint()
+    print(f"[INFO] Gallery {len(gallery)} embedding(s), {mode}, "
+          f"quét {footprint['scan_bytes'] / 1e6:.1f} MB (float32: {footprint['float32_bytes'] / 1e6:.1f} MB, "
+          f"trong RAM: {footprint['resident_float32_bytes'] / 1e6:.1f} MB)")
+    print(f"[INFO] Recall@1 so với float32: {gallery.measure_recall(sample_size=sample_size) * 100:.1f}%")
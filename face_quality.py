@@ -0,0 +1,85 @@
+import threading
+import cv2
+import numpy as np
+
+
+class FaceQualityGate:
+    """
+    Lọc nhanh các khuôn mặt crop từ camera trước khi chạy ArcFace (cùng tiêu chí với check_image_quality khi thêm người)
+    - size: cạnh nhỏ nhất của crop < min_size pixel
+    - blur: phương sai Laplacian (crop đưa về 160x160 như ảnh enrol) < min_blur
+    - brightness: độ sáng trung bình ngoài khoảng [min_brightness, max_brightness]
+    - pose: nếu detector có vị trí hai mắt, trung điểm hai mắt lệch khỏi tâm box quá max_yaw
+      (tỉ lệ theo chiều rộng box, khuôn mặt nghiêng/quay ngang); max_yaw = 0 để tắt
+    Blur và độ sáng được tính cho cả batch bằng numpy trên mảng (N, 160, 160)
+    """
+    WORK_SIZE = 160
+
+    def __init__(self, min_size=40, min_blur=50.0, min_brightness=40.0, max_brightness=220.0, max_yaw=0.2):
+        self.min_size = min_size
+        self.min_blur = min_blur
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_yaw = max_yaw
+
+        # Lý do -> số crop bị loại; 'passed' là số crop qua được
+        self.counters = {'passed': 0, 'size': 0, 'blur': 0, 'brightness': 0, 'pose': 0}
+        self._lock = threading.Lock()
+
+    def evaluate(self, face_imgs, landmarks=None):
+        """
+        Returns: list (mỗi crop) lý do bị loại ('size', 'blur', 'brightness', 'pose') hoặc None nếu đạt
+        landmarks: list dict {'left_eye', 'right_eye'} theo tọa độ crop (hoặc None) từ FaceDetector
+        """
+        reasons = [None] * len(face_imgs)
+        candidates = []
+        for i, face_img in enumerate(face_imgs):
+            if min(face_img.shape[:2]) < self.min_size:
+                reasons[i] = 'size'
+            elif self.max_yaw > 0 and landmarks is not None and self._yaw(face_img, landmarks[i]) > self.max_yaw:
+                reasons[i] = 'pose'
+            else:
+                candidates.append(i)
+
+        if candidates:
+            gray = np.stack([
+                cv2.resize(cv2.cvtColor(face_imgs[i], cv2.COLOR_BGR2GRAY), (self.WORK_SIZE, self.WORK_SIZE),
+                           interpolation=cv2.INTER_AREA)
+                for i in candidates
+            ]).astype(np.float32)
+
+            brightness = gray.mean(axis=(1, 2))
+            # Laplacian 3x3 (giống cv2.Laplacian mặc định) trên cả batch, bỏ viền
+            laplacian = (gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1] + gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:]
+                         - 4 * gray[:, 1:-1, 1:-1])
+            blur = laplacian.var(axis=(1, 2))
+
+            for i, sharpness, level in zip(candidates, blur, brightness):
+                if level < self.min_brightness or level > self.max_brightness:
+                    reasons[i] = 'brightness'
+                elif sharpness < self.min_blur:
+                    reasons[i] = 'blur'
+
+        with self._lock:
+            for reason in reasons:
+                self.counters[reason or 'passed'] += 1
+        return reasons
+
+    @staticmethod
+    def _yaw(face_img, points):
+        """Độ lệch ngang của trung điểm hai mắt so với tâm crop, theo tỉ lệ chiều rộng (0 = nhìn thẳng)"""
+        if not points or points.get('left_eye') is None or points.get('right_eye') is None:
+            return 0.0
+        width = face_img.shape[1]
+        mid_x = (points['left_eye'][0] + points['right_eye'][0]) / 2
+        return abs(mid_x - width / 2) / max(width, 1)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def format_stats(self):
+        stats = self.stats()
+        rejected = sum(count for reason, count in stats.items() if reason != 'passed')
+        return (f"chất lượng: {stats['passed']} đạt, {rejected} loại "
+                f"(nhỏ {stats['size']}, mờ {stats['blur']}, sáng/tối {stats['brightness']}, nghiêng {stats['pose']})")
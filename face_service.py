@@ -1,26 +1,61 @@
 import os
 import cv2
 import numpy as np
-import pickle
 import shutil
+import threading
 import unicodedata
-from deepface import DeepFace
 from numpy.linalg import norm
 from config import APP_CONFIG
 from database_helper import DatabaseHelper
+from face_gallery import FaceGallery
+from ann_index import IVFIndex
+from gallery_store import GalleryStore
+from face_embedder import FaceEmbedder
+from face_detector import FaceDetector
+from embedding_cache import EmbeddingCache
+from embedding_builder import list_dataset_images, build_embeddings_parallel
 
 class FaceRecognitionService:
     def __init__(self):
         self.dataset_folder = APP_CONFIG['dataset_folder']
         self.embedding_file = APP_CONFIG['embedding_file']
+        self.ann_index_file = os.path.splitext(self.embedding_file)[0] + '.ivf.npz'
+        self.embedding_cache_file = APP_CONFIG['embedding_cache_file']
+        self.gallery_store = GalleryStore(
+            APP_CONFIG['gallery_folder'],
+            max_segments=APP_CONFIG['gallery_max_segments'],
+            max_tombstone_ratio=APP_CONFIG['gallery_max_tombstone_ratio']
+        )
         self.model_name = APP_CONFIG['model_name']
         self.detector_backend = APP_CONFIG['detector_backend']
         self.confidence_threshold = APP_CONFIG['confidence_threshold']
         self.db = DatabaseHelper()
         
+        # Model embedding được build một lần, dùng chung cho mọi batch
+        self.embedder = FaceEmbedder(self.model_name, self.detector_backend,
+                                     batch_size=APP_CONFIG['embedding_batch_size'])
+        
+        # Gallery đang dùng để nhận diện (load_gallery), add_person thêm trực tiếp vào đây
+        self.gallery = None
+        # Tránh add_person và generate_embeddings cùng ghi cache embeddings
+        self._embedding_lock = threading.Lock()
+        
+        # Chuyển embeddings.pkl cũ sang định dạng gallery mới (chỉ chạy một lần)
+        self.gallery_store.migrate_from_pickle(self.embedding_file)
+        
         # Load OpenCV face cascade for quick detection
         cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
         self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        
+        # Detector chạy trên frame thu nhỏ, crop khuôn mặt từ frame gốc;
+        # chế độ cascade chỉ chạy detector quanh các box Haar
+        self.detector = FaceDetector(
+            self.detector_backend,
+            scale=APP_CONFIG['detection_scale'],
+            mode=APP_CONFIG['detection_mode'],
+            cascade=self.face_cascade,
+            roi_padding=APP_CONFIG['detection_roi_padding']
+        )
     
     def normalize_folder_name(self, name):
         """
@@ -74,11 +109,12 @@ class FaceRecognitionService:
             traceback.print_exc()
             return False, 0.0, f"Lỗi kiểm tra ảnh: {str(e)}"
     
-    def add_person(self, person_info, image_paths):
+    def add_person(self, person_info, image_paths, aligned=False):
         """
         Thêm người mới vào hệ thống
         person_info: dict chứa thông tin người
         image_paths: list đường dẫn ảnh
+        aligned: True nếu ảnh đã là khuôn mặt crop sẵn (chụp từ camera) -> embed không cần detector
         Returns: (success, message, person_id)
         """
         try:
@@ -147,6 +183,7 @@ class FaceRecognitionService:
             
             # Copy ảnh vào dataset và lưu vào DB
             saved_count = 0
+            saved_images = []
             for i, (img_path, quality) in enumerate(valid_images):
                 # Tạo tên file an toàn
                 safe_filename = f"{normalized_name}_{i+1}.jpg"
@@ -177,9 +214,10 @@ class FaceRecognitionService:
                 
                 # Lưu vào database
                 try:
-                    image_id = self.db.add_person_image(person_id, dest_path, quality)
+                    image_id = self.db.add_person_image(person_id, dest_path, quality, is_aligned=aligned)
                     print(f"[INFO] Đã lưu vào database với image_id: {image_id}")
                     saved_count += 1
+                    saved_images.append((dest_path, img))
                 except Exception as e:
                     print(f"[LỖI] Không lưu được vào database: {e}")
                     import traceback
@@ -190,6 +228,19 @@ class FaceRecognitionService:
             if saved_count == 0:
                 return False, "Không thể lưu bất kỳ ảnh nào vào dataset", None
             
+            # Tính embeddings ngay từ ảnh đã decode, thêm thẳng vào gallery (không quét lại dataset)
+            try:
+                enrolled = self.enroll_embeddings(normalized_name, person_id, saved_images, aligned)
+            except Exception as e:
+                print(f"[LỖI] Không tạo được embeddings khi thêm người: {e}")
+                import traceback
+                traceback.print_exc()
+                enrolled = 0
+            
+            if enrolled == 0:
+                return True, (f"Đã thêm thành công {saved_count} ảnh, nhưng chưa tạo được embeddings. "
+                              f"Vui lòng chạy Tạo Embeddings"), person_id
+            
             return True, f"Đã thêm thành công {saved_count} ảnh", person_id
             
         except Exception as e:
@@ -198,100 +249,274 @@ class FaceRecognitionService:
             traceback.print_exc()
             return False, f"Lỗi: {str(e)}", None
     
+    def enroll_embeddings(self, label, person_id, saved_images, aligned=False):
+        """
+        Tính embeddings cho ảnh của một người (ảnh đã decode trong bộ nhớ) trong một batch,
+        ghi thêm một segment vào gallery, cập nhật cache embeddings và gallery đang dùng
+        saved_images: list (đường dẫn trong dataset, ảnh BGR)
+        Returns: số embeddings đã thêm
+        """
+        detector_backend = "skip" if aligned else self.detector_backend
+        embeddings, errors = self.embedder.represent(
+            [img for _, img in saved_images], detector_backend=detector_backend)
+        
+        vectors = []
+        with self._embedding_lock:
+            cache = EmbeddingCache(self.embedding_cache_file, self.model_name, self.detector_backend)
+            keys = []
+            for (img_path, _), embedding, error in zip(saved_images, embeddings, errors):
+                key = cache.key_for(img_path, detector_backend)
+                cache.put(key, embedding, error)
+                keys.append((img_path, key))
+                if embedding is None:
+                    print(f"[CẢNH BÁO] Không trích xuất được embedding cho {img_path}: {error}")
+                else:
+                    vectors.append(embedding)
+            
+            # Manifest theo thứ tự như list_dataset_images để lần Tạo Embeddings sau không embed lại
+            cache.manifest[label] = [key for _, key in sorted(keys)]
+            
+            if vectors:
+                matrix = FaceGallery.l2_normalize(np.stack(vectors))
+                identities = [label] * len(vectors)
+                person_ids = [person_id] * len(vectors)
+                with self.gallery_store.write_lock():
+                    start_id = self.gallery_store.append(matrix, identities, person_ids)
+                    self.update_ann_index(new_vectors=matrix, start_id=start_id)
+                
+                gallery = self.gallery
+                if gallery is not None and len(gallery) == start_id:
+                    self.gallery = gallery.extended(matrix, identities, person_ids)
+                elif gallery is not None:
+                    self.load_gallery()
+            
+            cache.save()
+        
+        print(f"[INFO] Đã thêm {len(vectors)} embedding(s) cho {label} vào gallery")
+        return len(vectors)
+    
     def generate_embeddings(self):
-        """Tạo embeddings cho toàn bộ dataset"""
-        embeddings = []
+        """
+        Tạo embeddings cho toàn bộ dataset
+        Chỉ embed ảnh chưa có trong cache (theo hash nội dung + model + detector),
+        chỉ cập nhật gallery cho những người có ảnh thêm/bớt/thay đổi
+        """
+        with self._embedding_lock:
+            return self._generate_embeddings()
+    
+    def _generate_embeddings(self):
+        cache = EmbeddingCache(self.embedding_cache_file, self.model_name, self.detector_backend)
+        all_items = list_dataset_images(self.dataset_folder)
         
-        if os.path.exists(self.embedding_file):
-            with open(self.embedding_file, "rb") as f:
-                embeddings = pickle.load(f)
+        # Ảnh chụp từ camera đã là khuôn mặt crop sẵn -> embed với detector 'skip'
+        aligned_paths = self.get_aligned_paths(all_items)
+        keyed_items = [(label, img_path, cache.key_for(
+            img_path, "skip" if img_path in aligned_paths else self.detector_backend))
+            for label, img_path in all_items]
         
-        existing_identities = set(e["identity"] for e in embeddings)
-        print(f"[INFO] Đã có {len(existing_identities)} nhãn trong embeddings")
+        # Ảnh trùng nội dung chỉ cần embed một lần
+        missing = {}
+        for label, img_path, key in keyed_items:
+            if key not in cache and key not in missing:
+                missing[key] = (label, img_path)
+        print(f"[INFO] {len(all_items) - len(missing)}/{len(all_items)} ảnh đã có trong cache, "
+              f"cần embed {len(missing)} ảnh ({len(aligned_paths)} ảnh crop sẵn bỏ qua detector)")
         
-        # Đếm số ảnh cần xử lý
-        total_images = 0
-        processed_images = 0
+        # Chia ảnh cho nhiều tiến trình, kết quả trả về theo đúng thứ tự
+        for key, (label, img_path, embedding, error) in zip(missing, build_embeddings_parallel(
+                list(missing.values()), self.model_name, self.detector_backend,
+                workers=APP_CONFIG['embedding_workers'],
+                batch_size=APP_CONFIG['embedding_batch_size'],
+                aligned_paths=aligned_paths)):
+            if embedding is None:
+                print(f"[CẢNH BÁO] Không trích xuất được embedding cho {img_path}: {error}")
+            cache.put(key, embedding, error)
         
-        for root, dirs, files in os.walk(self.dataset_folder):
-            label = os.path.basename(root)
-            
-            # Bỏ qua thư mục gốc
-            if label == os.path.basename(self.dataset_folder) or not label:
-                continue
-            
-            # Lấy tất cả ảnh của người này
-            image_files = [f for f in files if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            total_images += len(image_files)
-            
-            # Nếu người này đã có embeddings, bỏ qua
-            if label in existing_identities:
-                print(f"[INFO] Bỏ qua {label} (đã có embeddings)")
-                continue
-            
-            # Xử lý tất cả ảnh của người này
-            for file in image_files:
-                img_path = os.path.join(root, file)
-                
-                # Kiểm tra file tồn tại
-                if not os.path.exists(img_path):
-                    print(f"[CẢNH BÁO] File không tồn tại: {img_path}")
-                    continue
-                
-                try:
-                    embedding = DeepFace.represent(
-                        img_path=img_path,
-                        model_name=self.model_name,
-                        detector_backend=self.detector_backend,
-                        enforce_detection=False
-                    )[0]["embedding"]
-                    
-                    embeddings.append({
-                        "identity": label,
-                        "embedding": np.array(embedding, dtype=np.float32)
-                    })
-                    
-                    processed_images += 1
-                    print(f"[INFO] Đã thêm embedding cho {label} ({file}) [{processed_images}/{total_images}]")
-                    
-                except Exception as e:
-                    print(f"[CẢNH BÁO] Không trích xuất được embedding cho {img_path}: {e}")
+        manifest = {}
+        for label, _, key in keyed_items:
+            manifest.setdefault(label, []).append(key)
+        
+        # Người có danh sách ảnh thay đổi so với lần build trước (hoặc chưa có trong gallery)
+        gallery = self.gallery_store.load_gallery(segmented=True)
+        existing_identities = set(gallery.identities)
+        changed = sorted(label for label in set(manifest) | set(cache.manifest)
+                         if manifest.get(label) != cache.manifest.get(label)
+                         or (label in manifest and label not in existing_identities))
         
-        # Lưu embeddings với encoding UTF-8
-        with open(self.embedding_file, "wb") as f:
-            pickle.dump(embeddings, f)
+        removed = [label for label in changed if label in existing_identities]
+        existing_count = len(gallery)
         
-        print(f"[INFO] Hoàn tất: {len(embeddings)} embedding(s) từ {processed_images}/{total_images} ảnh")
+        # person_id của người được thay: giữ từ các hàng cũ, người mới thì tra database theo tên thư mục
+        label_person_ids = {label: gallery.person_id(label) for label in changed if label in manifest}
+        if any(person_id < 0 for person_id in label_person_ids.values()):
+            by_name = {}
+            for p in self.db.get_all_persons():
+                by_name.setdefault(p['full_name'], p['id'])
+                by_name.setdefault(self.normalize_folder_name(p['full_name']), p['id'])
+            for label, person_id in label_person_ids.items():
+                if person_id < 0:
+                    label_person_ids[label] = by_name.get(label, -1)
+        
+        new_identities = []
+        new_vectors = []
+        new_person_ids = []
+        for label in changed:
+            for key in manifest.get(label, []):
+                embedding = cache.get(key)
+                if embedding is not None:
+                    new_identities.append(label)
+                    new_vectors.append(embedding)
+                    new_person_ids.append(label_person_ids[label])
+        
+        if removed or new_vectors:
+            # Tombstone người thay đổi + một segment mới trong cùng một lần ghi header
+            # (không ghi lại toàn bộ gallery, người đọc không thấy lúc người đó bị thiếu)
+            new_matrix = FaceGallery.l2_normalize(np.stack(new_vectors)) if new_vectors else None
+            with self.gallery_store.write_lock():
+                keep_mask, start_id = self.gallery_store.replace(removed, new_matrix, new_identities,
+                                                                  new_person_ids)
+                self.update_ann_index(new_vectors=new_matrix, start_id=start_id,
+                                      keep_mask=keep_mask if removed else None)
+            existing_count = int(keep_mask.sum())
+        
+        cache.manifest = manifest
+        cache.prune([img_path for _, img_path, _ in keyed_items], [key for _, _, key in keyed_items])
+        cache.save()
+        
+        print(f"[INFO] Hoàn tất: cập nhật {len(changed)} người, "
+              f"{existing_count + len(new_vectors)} embedding(s) từ {len(all_items)} ảnh")
         return True
     
+    def get_aligned_paths(self, items):
+        """Các ảnh trong items được đánh dấu is_aligned trong person_images"""
+        aligned = {os.path.normcase(os.path.abspath(path)) for path in self.db.get_aligned_image_paths()}
+        return {img_path for _, img_path in items
+                if os.path.normcase(os.path.abspath(img_path)) in aligned}
+    
+    def find_person(self, identity, gallery=None):
+        """
+        Người trong database ứng với một identity của gallery
+        Tra theo cột person_ids của gallery (không phụ thuộc tên, kể cả khi đã sửa họ tên);
+        embeddings cũ chưa có person_id thì tra theo full_name / tên thư mục đã chuẩn hóa
+        Returns: dict person hoặc None
+        """
+        gallery = self.gallery if gallery is None else gallery
+        person_id = gallery.person_id(identity) if isinstance(gallery, FaceGallery) else -1
+        if person_id >= 0:
+            person = self.db.get_person_by_id(person_id)
+            if person is not None:
+                return person
+        
+        return next((p for p in self.db.get_all_persons()
+                     if identity in (p['full_name'], self.normalize_folder_name(p['full_name']))), None)
+    
     def cosine_distance(self, a, b):
         """Tính khoảng cách cosine"""
         return 1 - np.dot(a, b) / (norm(a) * norm(b))
     
     def find_best_match(self, face_emb, embeddings):
-        """Tìm người khớp nhất"""
-        min_dist = float("inf")
-        identity = "Unknown"
+        """
+        Tìm người khớp nhất
+        embeddings: FaceGallery (khuyến nghị) hoặc list dict {"identity", "embedding"}
+        """
+        if not isinstance(embeddings, FaceGallery):
+            embeddings = FaceGallery.from_embeddings(embeddings)
         
-        for e in embeddings:
-            dist = self.cosine_distance(face_emb, e["embedding"])
-            if dist < min_dist:
-                min_dist = dist
-                identity = e["identity"]
+        return embeddings.find_best_match(face_emb, self.confidence_threshold)
+    
+    def represent_batch(self, face_imgs):
+        """
+        Tính embeddings cho nhiều khuôn mặt đã crop (BGR) bằng các lần forward theo batch
+        Returns: ma trận (F, D) float32
+        """
+        return self.embedder.represent_batch(face_imgs)
+    
+    def match_embeddings(self, face_embs, gallery, top_k=1):
+        """So khớp các embedding đã có (ví dụ trung bình nhiều frame của một track) với gallery"""
+        if len(face_embs) == 0:
+            return []
         
-        confidence = max(0, 1 - min_dist)
+        if not isinstance(gallery, FaceGallery):
+            gallery = FaceGallery.from_embeddings(gallery)
         
-        if min_dist > self.confidence_threshold:
-            identity = "Unknown"
+        return gallery.find_best_matches(face_embs, self.confidence_threshold, top_k)
+    
+    def load_gallery(self):
+        """
+        Load gallery (ma trận mmap đã chuẩn hóa, không copy) để so khớp nhanh
+        Gallery này trở thành gallery đang dùng (self.gallery), add_person sẽ thêm trực tiếp vào đó
+        """
+        # Chế độ ít RAM: các segment giữ dạng mmap, chỉ bản nén nằm trong RAM
+        low_memory = APP_CONFIG['gallery_dtype'] != 'float32'
+        gallery = self.attach_ann_index(self.gallery_store.load_gallery(segmented=low_memory))
         
-        return identity, confidence
+        # Có chỉ mục ANN thì tìm kiếm đi qua chỉ mục, bản nén sẽ không bao giờ được quét
+        # Đo recall của đường tìm kiếm đang dùng: python face_gallery.py
+        if gallery.index is None and low_memory and len(gallery) > 0:
+            gallery.compress(APP_CONFIG['gallery_dtype'], APP_CONFIG['rerank_candidates'])
+            footprint = gallery.memory_footprint()
+            print(f"[INFO] Gallery {footprint['dtype']}: {footprint['scan_bytes'] / 1e6:.1f} MB "
+                  f"(float32: {footprint['float32_bytes'] / 1e6:.1f} MB, "
+                  f"trong RAM: {footprint['resident_float32_bytes'] / 1e6:.1f} MB)")
+        
+        self.gallery = gallery
+        return self.gallery
     
-    def load_embeddings(self):
-        """Load embeddings từ file"""
-        if os.path.exists(self.embedding_file):
-            with open(self.embedding_file, "rb") as f:
-                return pickle.load(f)
-        return []
+    def attach_ann_index(self, gallery):
+        """
+        Gắn chỉ mục ANN (IVF) cho gallery lớn, load từ file nếu còn khớp, nếu không thì build lại
+        Gallery nhỏ hơn ann_min_gallery_size vẫn dùng quét chính xác
+        """
+        if len(gallery) < APP_CONFIG['ann_min_gallery_size']:
+            return gallery
+        
+        index = None
+        if os.path.exists(self.ann_index_file):
+            try:
+                index = IVFIndex.load(self.ann_index_file, nprobe=APP_CONFIG['ann_nprobe'])
+                if len(index) != len(gallery):
+                    print("[INFO] Chỉ mục ANN không khớp với embeddings, build lại...")
+                    index = None
+            except Exception as e:
+                print(f"[CẢNH BÁO] Không đọc được chỉ mục ANN: {e}")
+                index = None
+        
+        if index is None:
+            print(f"[INFO] Đang build chỉ mục ANN cho {len(gallery)} embedding(s)...")
+            index = IVFIndex(nlist=APP_CONFIG['ann_nlist'], nprobe=APP_CONFIG['ann_nprobe'])
+            index.train(gallery.matrix)
+            with self.gallery_store.write_lock():
+                # Tiến trình khác đã thêm/xóa người trong lúc build: không ghi đè chỉ mục của họ
+                if self.gallery_store.exists() and self.gallery_store.read_header()["count"] == len(gallery):
+                    index.save(self.ann_index_file)
+                    print(f"[INFO] Đã lưu chỉ mục ANN ({index.nlist} cụm): {self.ann_index_file}")
+        
+        gallery.index = index
+        return gallery
+    
+    def update_ann_index(self, new_vectors=None, start_id=0, keep_mask=None):
+        """
+        Cập nhật chỉ mục ANN đã lưu (thêm/xóa embeddings) thay vì train lại từ đầu
+        Gọi trong gallery_store.write_lock() cùng với thay đổi gallery tương ứng, để tiến trình khác
+        không chen thay đổi của họ vào giữa (keep_mask/start_id tính trên snapshot lúc đó)
+        """
+        if not os.path.exists(self.ann_index_file):
+            return
+        
+        try:
+            index = IVFIndex.load(self.ann_index_file)
+            if keep_mask is not None:
+                index.remove(keep_mask)
+            if new_vectors is not None:
+                index.add(new_vectors, start_id)
+            index.save(self.ann_index_file)
+        except Exception as e:
+            # Index hỏng/lệch sẽ được build lại ở lần load_gallery tiếp theo
+            print(f"[CẢNH BÁO] Không cập nhật được chỉ mục ANN, sẽ build lại: {e}")
+            try:
+                os.remove(self.ann_index_file)
+            except OSError:
+                pass
     
     def delete_person_data(self, person_name):
         """Xóa dữ liệu người (thư mục ảnh và embeddings)"""
@@ -306,14 +531,12 @@ class FaceRecognitionService:
                 print(f"[INFO] Đã xóa thư mục: {person_folder}")
             
             # Xóa embeddings của người này
-            if os.path.exists(self.embedding_file):
-                embeddings = self.load_embeddings()
+            if self.gallery_store.exists():
                 # Xóa tất cả embeddings có identity trùng với tên (cả tên gốc và tên chuẩn hóa)
-                embeddings = [e for e in embeddings 
-                            if e["identity"] not in [person_name, normalized_name]]
-                
-                with open(self.embedding_file, "wb") as f:
-                    pickle.dump(embeddings, f)
+                # bằng tombstone, không ghi lại toàn bộ gallery
+                with self.gallery_store.write_lock():
+                    keep_mask = self.gallery_store.delete([person_name, normalized_name])
+                    self.update_ann_index(keep_mask=keep_mask)
                 
                 print(f"[INFO] Đã xóa embeddings của: {person_name}")
             
@@ -0,0 +1,231 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """IoU giữa hai tập box (x, y, w, h). Returns: ma trận (len(a), len(b))"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = (a[:, None, 2] * a[:, None, 3]) + (b[None, :, 2] * b[None, :, 3]) - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class Track:
+    """Một khuôn mặt được theo dõi qua nhiều frame, mang theo danh tính đã nhận diện"""
+    def __init__(self, track_id, box, vote_window=5):
+        self.id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.identity = None
+        self.confidence = 0.0
+        self.hits = 1
+        self.missed = 0
+        self.last_attempt = 0.0
+        # K embedding gần nhất (đã chuẩn hóa) để bỏ phiếu danh tính qua nhiều frame
+        self.embeddings = deque(maxlen=vote_window)
+        # Đã chốt danh tính: không nhận diện lại track này nữa
+        self.committed = False
+
+    def as_dict(self):
+        return {'id': self.id, 'box': self.box, 'identity': self.identity,
+                'confidence': self.confidence, 'missed': self.missed,
+                'new': self.last_attempt == 0, 'committed': self.committed}
+
+
+class FaceTracker:
+    """
+    Tracker nhiều khuôn mặt nhẹ: ghép box mới với track cũ theo IoU (tham lam, IoU lớn nhất trước),
+    không ghép được thì thử theo khoảng cách tâm (khuôn mặt di chuyển nhanh)
+    Danh tính được giữ theo track nên chỉ cần nhận diện track mới hoặc track chưa chốt danh tính
+    Bỏ phiếu nhiều frame: mỗi track giữ vote_window embedding gần nhất, so khớp embedding trung bình
+    và chốt danh tính khi đủ chắc chắn (xem vote), sau đó không nhận diện lại track đó
+    keep_expired: giữ trạng thái bỏ phiếu của track chưa chốt đã rời khung hình tới khi clear_expired()
+    (xử lý video gom crop thành batch, embedding có thể tới sau khi track đã bị xóa)
+    """
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_missed=10,
+                 vote_window=5, min_votes=2, accept_confidence=0.6, accept_margin=0.1, early_accept=0.8,
+                 keep_expired=False):
+        self.iou_threshold = iou_threshold
+        # Khoảng cách tâm tối đa, tính theo tỉ lệ kích thước box
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+        self.vote_window = vote_window
+        self.min_votes = min_votes
+        self.accept_confidence = accept_confidence
+        # Chênh lệch tối thiểu giữa người giống nhất và người thứ hai
+        self.accept_margin = accept_margin
+        # Confidence đủ cao để chốt ngay từ một quan sát
+        self.early_accept = early_accept
+        self.keep_expired = keep_expired
+
+        self.tracks = []
+        # track id -> Track đã rời khung hình nhưng chưa chốt (chỉ khi keep_expired)
+        self.expired = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _associate(self, boxes):
+        """Ghép boxes với self.tracks. Returns: dict chỉ số box -> Track"""
+        if not self.tracks or len(boxes) == 0:
+            return {}
+
+        track_boxes = [t.box for t in self.tracks]
+        scores = box_iou(boxes, track_boxes)
+        valid = scores >= self.iou_threshold
+
+        # Fallback theo khoảng cách tâm cho cặp không đủ IoU
+        a = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        b = np.asarray(track_boxes, dtype=np.float32)
+        centers_a = a[:, :2] + a[:, 2:] / 2
+        centers_b = b[:, :2] + b[:, 2:] / 2
+        distance = np.linalg.norm(centers_a[:, None] - centers_b[None], axis=2)
+        scale = np.maximum(a[:, None, 2:].max(axis=2), b[None, :, 2:].max(axis=2))
+        near = distance / np.maximum(scale, 1e-6) <= self.max_centroid_distance
+        fallback = ~valid & near
+        # Cặp fallback xếp sau mọi cặp ghép theo IoU
+        scores = np.where(valid, scores + 1.0, np.where(fallback, 1.0 - distance / np.maximum(scale, 1e-6), -1.0))
+
+        matches = {}
+        used_tracks = set()
+        for flat in np.argsort(-scores, axis=None):
+            box_idx, track_idx = np.unravel_index(flat, scores.shape)
+            if scores[box_idx, track_idx] < 0:
+                break
+            if box_idx in matches or track_idx in used_tracks:
+                continue
+            matches[int(box_idx)] = self.tracks[track_idx]
+            used_tracks.add(track_idx)
+        return matches
+
+    def update(self, boxes):
+        """
+        Cập nhật tracker với các box phát hiện trong frame mới
+        Returns: list dict trạng thái các track còn sống
+        """
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        with self._lock:
+            matches = self._associate(boxes)
+            matched_ids = set()
+            for box_idx, track in matches.items():
+                track.box = boxes[box_idx]
+                track.hits += 1
+                track.missed = 0
+                matched_ids.add(track.id)
+
+            alive = []
+            for track in self.tracks:
+                if track.id not in matched_ids:
+                    track.missed += 1
+                if track.missed <= self.max_missed:
+                    alive.append(track)
+                elif self.keep_expired and not track.committed:
+                    self.expired[track.id] = track
+            self.tracks = alive
+
+            for box_idx, box in enumerate(boxes):
+                if box_idx not in matches:
+                    self.tracks.append(Track(self._next_id, box, self.vote_window))
+                    self._next_id += 1
+
+            return [t.as_dict() for t in self.tracks]
+
+    def match(self, boxes):
+        """Ghép các box (ví dụ từ RetinaFace) với track hiện có. Returns: list track id hoặc None"""
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        with self._lock:
+            matches = self._associate(boxes)
+            return [matches[i].id if i in matches else None for i in range(len(boxes))]
+
+    def pending(self, retry_interval=1.0, now=None):
+        """
+        Các track cần nhận diện: track mới, hoặc chưa chốt danh tính
+        (thử lại sau ít nhất retry_interval giây). Đánh dấu thời điểm thử cho các track trả về
+        now: thời điểm hiện tại (mặc định time.time(); xử lý video ghi hình dùng thời gian trong video)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            result = []
+            for track in self.tracks:
+                if track.missed > 0 or track.committed:
+                    continue
+                if track.last_attempt == 0 or now - track.last_attempt >= retry_interval:
+                    track.last_attempt = now
+                    result.append(track.id)
+            return result
+
+    def _find(self, track_id):
+        track = next((t for t in self.tracks if t.id == track_id), None)
+        return track if track is not None else self.expired.get(track_id)
+
+    def observe(self, track_id, embedding):
+        """
+        Thêm embedding mới của track vào cửa sổ bỏ phiếu
+        Returns: (embedding trung bình của cửa sổ, số quan sát) hoặc (None, 0) nếu track không còn
+        hay embedding rỗng (crop lỗi)
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        with self._lock:
+            track = self._find(track_id)
+            if track is None:
+                return None, 0
+            if norm > 0:
+                track.embeddings.append(embedding / norm)
+            if not track.embeddings:
+                return None, 0
+            return np.mean(track.embeddings, axis=0), len(track.embeddings)
+
+    def vote(self, track_id, matches, votes):
+        """
+        Cập nhật danh tính của track từ kết quả so khớp embedding trung bình
+        matches: top (identity, confidence) của embedding trung bình (nên lấy top_k=2 để tính margin)
+        Chốt danh tính khi người giống nhất không phải Unknown, hơn người thứ hai ít nhất accept_margin và
+        - confidence >= early_accept (chốt sớm, kể cả chỉ có một quan sát), hoặc
+        - đủ min_votes quan sát và confidence >= accept_confidence
+        Returns: True nếu track vừa được chốt ở lần này
+        """
+        identity, confidence = matches[0]
+        runner_up = matches[1][1] if len(matches) > 1 else 0.0
+        decisive = (identity != "Unknown" and confidence - runner_up >= self.accept_margin
+                    and (confidence >= self.early_accept
+                         or (votes >= self.min_votes and confidence >= self.accept_confidence)))
+
+        with self._lock:
+            track = self._find(track_id)
+            if track is None or track.committed:
+                return False
+            track.identity = identity
+            track.confidence = confidence
+            if decisive:
+                track.committed = True
+                # Không cần giữ embedding nữa
+                track.embeddings.clear()
+            return decisive
+
+    def add(self, box, identity=None, confidence=0.0, now=None):
+        """Tạo track mới từ một box (khuôn mặt detector chính thấy nhưng Haar bỏ sót)"""
+        with self._lock:
+            track = Track(self._next_id, box, self.vote_window)
+            track.identity = identity
+            track.confidence = confidence
+            track.last_attempt = time.time() if now is None else now
+            self._next_id += 1
+            self.tracks.append(track)
+            return track.id
+
+    def clear_expired(self):
+        """Bỏ trạng thái các track đã rời khung hình (sau khi mọi embedding của chúng đã được bỏ phiếu)"""
+        with self._lock:
+            self.expired = {}
+
+    def reset(self):
+        with self._lock:
+            self.tracks = []
+            self.expired = {}
@@ -0,0 +1,445 @@
+import os
+import re
+import json
+import uuid
+import pickle
+import threading
+from contextlib import contextmanager
+import numpy as np
+from face_gallery import FaceGallery, SegmentedRows
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FORMAT_NAME = "face-gallery"
+FORMAT_VERSION = 2
+
+
+class GalleryStore:
+    """
+    Lưu gallery embeddings dạng cột trên đĩa, thay cho embeddings.pkl:
+    - header.json: header nhỏ có version, danh sách segment và tombstone log hiện tại
+    - seg-<seq>-g<gen>.npy: ma trận float32 đã chuẩn hóa L2 của một segment, mở bằng np.load(mmap_mode='r')
+    - seg-<seq>-g<gen>.json: bảng identity / person_id song song với các hàng của segment
+    - tombstones-g<gen>.log: log xóa chỉ ghi nối (mỗi dòng JSON {"identity", "seq"})
+
+    Segment không bao giờ bị sửa: thêm người = ghi thêm một segment nhỏ, xóa người = ghi một
+    tombstone (xóa các hàng của identity đó trong segment có seq <= tombstone.seq).
+    Compaction chạy nền gộp các segment khi quá nhiều segment hoặc quá nhiều hàng đã xóa.
+    Header chỉ được thay bằng os.replace nên người đọc luôn thấy một snapshot nhất quán
+    Mọi thao tác ghi (append, delete, write, compaction) giữ khóa file gallery.lock nên nhiều tiến trình
+    (gui_app, headless_service, process_videos) dùng chung một thư mục gallery không mất dữ liệu của nhau
+    """
+    def __init__(self, folder, max_segments=8, max_tombstone_ratio=0.2):
+        self.folder = folder
+        self.header_path = os.path.join(folder, "header.json")
+        self.lock_path = os.path.join(folder, "gallery.lock")
+        self.max_segments = max_segments
+        self.max_tombstone_ratio = max_tombstone_ratio
+
+        self._lock = threading.RLock()
+        # File gallery.lock đang giữ khóa (khóa ghi lồng nhau trong cùng thread không khóa lại)
+        self._lock_file = None
+        self._compaction_thread = None
+
+    def exists(self):
+        return os.path.exists(self.header_path)
+
+    @contextmanager
+    def write_lock(self):
+        """Khóa ghi: RLock giữa các thread trong tiến trình + khóa file gallery.lock giữa các tiến trình"""
+        with self._lock:
+            if self._lock_file is not None:
+                yield
+                return
+
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.lock_path, "a+b") as f:
+                f.seek(0)
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    # LK_LOCK chỉ thử trong ~10 giây rồi báo lỗi: thử lại tới khi được
+                    while True:
+                        try:
+                            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            pass
+                self._lock_file = f
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                    else:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def read_header(self):
+        with open(self.header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(f"Không phải thư mục gallery: {self.folder}")
+        if header.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"Gallery version {header['version']} mới hơn phiên bản hỗ trợ ({FORMAT_VERSION})")
+
+        if header["version"] == 1:
+            header = self._upgrade_v1_header(header)
+
+        return header
+
+    def _upgrade_v1_header(self, old):
+        """Version 1: một file vectors + một file table, chưa có segment/tombstone"""
+        header = self._empty_header(old["generation"])
+        if old["count"] > 0:
+            header["segments"] = [{"seq": 1, "vectors": old["vectors"], "table": old["table"],
+                                   "rows": old["count"]}]
+            header["next_seq"] = 2
+        header["count"] = old["count"]
+        header["dim"] = old["dim"]
+        return header
+
+    def _empty_header(self, generation):
+        return {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "generation": generation,
+            "count": 0,
+            "dim": 0,
+            "dtype": "float32",
+            "normalized": True,
+            "segments": [],
+            "next_seq": 1,
+            "tombstones": f"tombstones-g{generation:06d}.log",
+            "tombstone_bytes": 0,
+            "deleted": 0
+        }
+
+    def _write_header(self, header):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.header_path)
+
+    def _read_tombstones(self, header):
+        """Đọc tombstone trong tombstone_bytes đầu tiên của log -> dict identity: seq lớn nhất"""
+        tombstones = {}
+        if header["tombstone_bytes"] == 0:
+            return tombstones
+
+        with open(os.path.join(self.folder, header["tombstones"]), "rb") as f:
+            data = f.read(header["tombstone_bytes"])
+
+        for line in data.decode("utf-8").splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                tombstones[entry["identity"]] = max(tombstones.get(entry["identity"], 0), entry["seq"])
+        return tombstones
+
+    def _read_segment(self, segment):
+        matrix = np.load(os.path.join(self.folder, segment["vectors"]), mmap_mode='r')
+        with open(os.path.join(self.folder, segment["table"]), "r", encoding="utf-8") as f:
+            table = json.load(f)
+        return matrix, table
+
+    def _write_segment(self, seq, generation, matrix, identities, person_ids, tag=None):
+        """tag: hậu tố riêng cho segment ghi ngoài khóa (compaction) để không trùng tên với segment khác"""
+        name = f"seg-{seq:06d}-g{generation:06d}" + (f"-{tag}" if tag else "")
+        with open(os.path.join(self.folder, name + ".npy"), "wb") as f:
+            np.save(f, matrix)
+        with open(os.path.join(self.folder, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "identities": [str(i) for i in identities],
+                "person_ids": [int(p) for p in person_ids]
+            }, f, ensure_ascii=False)
+        return {"seq": seq, "vectors": name + ".npy", "table": name + ".json", "rows": len(identities)}
+
+    def _load_snapshot(self, header, segmented=False):
+        """
+        Ghép các segment (bỏ hàng đã bị tombstone) của một header thành (matrix, identities, person_ids)
+        segmented: trả về SegmentedRows trên mmap của từng segment thay vì ghép thành ma trận trong RAM
+        """
+        tombstones = self._read_tombstones(header)
+
+        matrices, rows, identities, person_ids = [], [], [], []
+        for segment in header["segments"]:
+            matrix, table = self._read_segment(segment)
+            if tombstones:
+                keep = np.array([tombstones.get(identity, 0) < segment["seq"]
+                                 for identity in table["identities"]], dtype=bool)
+            else:
+                keep = np.ones(len(table["identities"]), dtype=bool)
+
+            seg_person_ids = np.asarray(table["person_ids"], dtype=np.int64)
+            if keep.all():
+                matrices.append(matrix)
+                rows.append(None)
+                identities.extend(table["identities"])
+                person_ids.append(seg_person_ids)
+            elif keep.any():
+                matrices.append(matrix if segmented else matrix[keep])
+                rows.append(np.flatnonzero(keep))
+                identities.extend(i for i, k in zip(table["identities"], keep) if k)
+                person_ids.append(seg_person_ids[keep])
+
+        if not matrices:
+            return np.zeros((0, 0), dtype=np.float32), [], np.zeros(0, dtype=np.int64)
+        if len(matrices) == 1 and rows[0] is None:
+            # Một segment, không có hàng bị xóa: trả thẳng mmap (zero-copy)
+            return matrices[0], identities, person_ids[0]
+        if segmented:
+            return SegmentedRows(matrices, rows), identities, np.concatenate(person_ids)
+        return np.concatenate(matrices), identities, np.concatenate(person_ids)
+
+    def load(self, segmented=False):
+        """
+        Đọc snapshot nhất quán của gallery
+        segmented: giữ các segment dạng mmap (SegmentedRows) thay vì ghép vào RAM, cho chế độ quét bản nén
+        Returns: (matrix, identities, person_ids)
+        """
+        for attempt in range(3):
+            with self._lock:
+                if not self.exists():
+                    return np.zeros((0, 0), dtype=np.float32), [], np.zeros(0, dtype=np.int64)
+                try:
+                    return self._load_snapshot(self.read_header(), segmented)
+                except FileNotFoundError:
+                    # Tiến trình khác vừa compaction xong và xóa file cũ: đọc lại header mới
+                    if attempt == 2:
+                        raise
+
+    def load_gallery(self, segmented=False):
+        """Đọc gallery thành FaceGallery (zero-copy khi chỉ có một segment hoặc khi segmented)"""
+        matrix, identities, person_ids = self.load(segmented)
+        return FaceGallery(matrix, identities, normalized=True, person_ids=person_ids)
+
+    def append(self, matrix, identities, person_ids=None):
+        """
+        Thêm embeddings mới bằng một segment nhỏ (không ghi lại dữ liệu cũ)
+        Returns: vị trí hàng đầu tiên của các embeddings mới trong snapshot
+        """
+        _, start_id = self.replace([], matrix, identities, person_ids)
+        return start_id
+
+    def delete(self, identities):
+        """
+        Xóa tất cả embeddings của các identity bằng tombstone
+        Returns: keep_mask trên snapshot trước khi xóa (để cập nhật chỉ mục ANN)
+        """
+        keep_mask, _ = self.replace(identities)
+        return keep_mask
+
+    def replace(self, remove_identities, matrix=None, identities=(), person_ids=None):
+        """
+        Xóa mọi embeddings của remove_identities (tombstone) và thêm các hàng mới (một segment)
+        trong cùng một lần ghi header: người đọc không bao giờ thấy người đã bị xóa mà chưa được thêm lại
+        Returns: (keep_mask trên snapshot trước khi ghi, vị trí hàng đầu tiên của các hàng mới hoặc None)
+        """
+        remove_identities = list(dict.fromkeys(remove_identities))
+        identities = list(identities)
+        if identities:
+            if person_ids is None:
+                person_ids = [-1] * len(identities)
+            matrix = FaceGallery.l2_normalize(matrix)
+
+        with self.write_lock():
+            if self.exists():
+                header = self.read_header()
+            elif identities:
+                header = self._empty_header(1)
+            else:
+                return np.zeros(0, dtype=bool), None
+
+            keep_mask = np.ones(header["count"], dtype=bool)
+            if remove_identities and header["count"]:
+                _, snapshot_identities, _ = self._load_snapshot(header, segmented=True)
+                removed = set(remove_identities)
+                keep_mask = np.array([i not in removed for i in snapshot_identities], dtype=bool)
+            deleted = int((~keep_mask).sum())
+            if deleted == 0 and not identities:
+                return keep_mask, None
+
+            if deleted:
+                # Tombstone áp dụng cho các segment đã có (seq <= next_seq - 1), không cho segment mới bên dưới
+                seq = header["next_seq"] - 1
+                lines = "".join(json.dumps({"identity": i, "seq": seq}, ensure_ascii=False) + "\n"
+                                for i in remove_identities)
+                tombstone_path = os.path.join(self.folder, header["tombstones"])
+                with open(tombstone_path, "ab") as f:
+                    # Cắt phần ghi dở (nếu có) của lần trước bị gián đoạn
+                    f.truncate(header["tombstone_bytes"])
+                    f.write(lines.encode("utf-8"))
+                    header["tombstone_bytes"] = f.tell()
+                header["count"] -= deleted
+                header["deleted"] += deleted
+
+            start_id = None
+            if identities:
+                segment = self._write_segment(header["next_seq"], header["generation"],
+                                              matrix, identities, person_ids)
+                header["segments"].append(segment)
+                header["next_seq"] += 1
+                start_id = header["count"]
+                header["count"] += len(identities)
+                header["dim"] = int(matrix.shape[1])
+            self._write_header(header)
+
+        self.maybe_compact()
+        return keep_mask, start_id
+
+    def write(self, matrix, identities, person_ids=None):
+        """Ghi đè toàn bộ gallery bằng một segment duy nhất"""
+        if person_ids is None:
+            person_ids = [-1] * len(identities)
+
+        with self.write_lock():
+            old_header = self.read_header() if self.exists() else None
+            generation = old_header["generation"] + 1 if old_header else 1
+            header = self._empty_header(generation)
+
+            if len(identities):
+                matrix = FaceGallery.l2_normalize(matrix)
+                header["segments"] = [self._write_segment(1, generation, matrix, identities, person_ids)]
+                header["next_seq"] = 2
+                header["count"] = len(identities)
+                header["dim"] = int(matrix.shape[1])
+            self._write_header(header)
+
+            if old_header:
+                self._remove_unreferenced(header)
+
+    def needs_compaction(self, header):
+        if len(header["segments"]) > self.max_segments:
+            return True
+        total_rows = header["count"] + header["deleted"]
+        return total_rows > 0 and header["deleted"] / total_rows > self.max_tombstone_ratio
+
+    def maybe_compact(self):
+        """Khởi động compaction nền nếu vượt ngưỡng số segment hoặc tỉ lệ tombstone"""
+        with self._lock:
+            if not self.exists() or not self.needs_compaction(self.read_header()):
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self):
+        """
+        Gộp toàn bộ segment hiện có (đã áp dụng tombstone) thành một segment
+        Phần gộp chạy ngoài khóa; segment/tombstone được ghi thêm trong lúc đó vẫn được giữ lại.
+        Segment gộp mang tag riêng nên không bao giờ trùng tên (và bị xóa nhầm) với segment do write()
+        hay compaction của tiến trình khác tạo ra cùng generation
+        """
+        try:
+            with self._lock:
+                base = self.read_header()
+            if not base["segments"]:
+                return
+
+            matrix, identities, person_ids = self._load_snapshot(base)
+            merged_seq = base["segments"][-1]["seq"]
+            generation = base["generation"] + 1
+            merged = None
+            if identities:
+                merged = self._write_segment(merged_seq, generation, np.asarray(matrix),
+                                             identities, person_ids, tag=uuid.uuid4().hex[:8])
+
+            with self.write_lock():
+                current = self.read_header()
+                if current["generation"] != base["generation"]:
+                    # Gallery đã bị ghi đè trong lúc gộp: bỏ kết quả này
+                    if merged:
+                        self._remove_files(merged["vectors"], merged["table"])
+                    return
+
+                header = self._empty_header(generation)
+                header["segments"] = ([merged] if merged else []) + \
+                    [s for s in current["segments"] if s["seq"] > merged_seq]
+                header["next_seq"] = current["next_seq"]
+                header["count"] = current["count"]
+                header["dim"] = current["dim"]
+
+                # Tombstone ghi sau thời điểm snapshot vẫn phải áp dụng lên segment đã gộp
+                with open(os.path.join(self.folder, header["tombstones"]), "wb") as f:
+                    if current["tombstone_bytes"] > base["tombstone_bytes"]:
+                        with open(os.path.join(self.folder, current["tombstones"]), "rb") as src:
+                            src.seek(base["tombstone_bytes"])
+                            f.write(src.read(current["tombstone_bytes"] - base["tombstone_bytes"]))
+                    header["tombstone_bytes"] = f.tell()
+                header["deleted"] = current["deleted"] - base["deleted"]
+
+                self._write_header(header)
+                self._remove_unreferenced(header)
+
+            print(f"[INFO] Compaction gallery: {len(base['segments'])} segment -> {len(header['segments'])} segment, "
+                  f"{header['count']} embedding(s)")
+        except Exception as e:
+            print(f"[LỖI] compact gallery: {e}")
+            import traceback
+            traceback.print_exc()
+
+    def _remove_unreferenced(self, header):
+        """
+        Xóa file segment/tombstone không còn được header tham chiếu
+        File có generation mới hơn header là segment gộp của compaction (tiến trình khác) đang chạy
+        ngoài khóa, chưa kịp ghi header: giữ lại, compaction đó tự dọn nếu bị hủy
+        """
+        referenced = {header["tombstones"]}
+        for segment in header["segments"]:
+            referenced.update((segment["vectors"], segment["table"]))
+
+        stale = []
+        for name in os.listdir(self.folder):
+            if not name.startswith(("seg-", "tombstones-", "vectors-", "table-")) or name in referenced:
+                continue
+            match = re.search(r"-g(\d+)", name)
+            if match and int(match.group(1)) > header["generation"]:
+                continue
+            stale.append(name)
+        self._remove_files(*stale)
+
+    def _remove_files(self, *names):
+        """Xóa file cũ; nếu còn tiến trình đang mmap (Windows) thì bỏ qua, lần compaction sau xóa tiếp"""
+        for name in names:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def migrate_from_pickle(self, pickle_path):
+        """
+        Chuyển embeddings.pkl (list dict {"identity", "embedding"}) sang định dạng mới một lần
+        Returns: True nếu đã chuyển đổi
+        """
+        if self.exists() or not os.path.exists(pickle_path):
+            return False
+
+        with open(pickle_path, "rb") as f:
+            embeddings = pickle.load(f)
+
+        identities = [e["identity"] for e in embeddings]
+        if embeddings:
+            matrix = np.stack([np.asarray(e["embedding"], dtype=np.float32) for e in embeddings])
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        self.write(matrix, identities)
+        print(f"[INFO] Đã chuyển {len(identities)} embedding(s) từ {pickle_path} sang {self.folder}")
+        return True
+
+
+if __name__ == "__main__":
+    from config import APP_CONFIG
+
+    embedding_file = APP_CONFIG['embedding_file']
+    store = GalleryStore(APP_CONFIG['gallery_folder'])
+    if not store.migrate_from_pickle(embedding_file):
+        print(f"[INFO] Không cần chuyển đổi ({store.folder} đã tồn tại hoặc không có {embedding_file})")
@@ -1,12 +1,17 @@
 import tkinter as tk
 from tkinter import messagebox, ttk
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import cv2
 import numpy as np
 import threading
+import queue
+import time
 from datetime import datetime
+from config import APP_CONFIG
 from database_helper import DatabaseHelper
 from face_service import FaceRecognitionService
+from video_pipeline import DropOldestQueue
+from multi_camera import MultiCameraRecognizer
 from dialogs.login_dialog import LoginDialog
 from dialogs.add_person_dialog import AddPersonDialog
 from dialogs.manage_persons_dialog import ManagePersonsDialog
@@ -22,7 +27,6 @@ class AttendanceRecognitionUI:
         self.db = DatabaseHelper()
         self.face_service = FaceRecognitionService()
         
-        self.cap = None
         self.is_camera_running = False
         self.current_person = None
         self.last_recognition_time = None
@@ -31,8 +35,28 @@ class AttendanceRecognitionUI:
         self.embeddings = []
         self.is_camera_paused = False
         self.recognized_person = None
+        # Mọi camera (CAMERA_SOURCES) dùng chung model/gallery; camera đầu tiên hiển thị trên preview
+        self.cameras = None
+        self.primary_camera = None
+        # Kết quả từ nhiều camera cập nhật cùng một thẻ thông tin
+        self.recognition_lock = threading.Lock()
+        self.fps = 0.0
+        self.fps_count = 0
+        self.fps_start_time = time.time()
+        # Buffer/PhotoImage của preview được cấp phát một lần và dùng lại mỗi frame
+        self.render_buffer = None
+        self.photo = None
+        self.canvas_image_id = None
+        self.render_cpu = 0.0
+        self.canvas_size = (0, 0)
+        # Worker chỉ ghi vào mailbox/hàng đợi, main thread lấy ra bằng root.after
+        self.frame_mailbox = DropOldestQueue(1)
+        self.ui_queue = queue.Queue()
+        self.widget_state = {}
         
         self.setup_ui()
+        self.canvas_camera.bind('<Configure>', self.on_canvas_resize)
+        self.schedule_ui_update()
         self.start_recognition()
     
     def setup_ui(self):
@@ -240,21 +264,17 @@ class AttendanceRecognitionUI:
         self.pause_camera()
         
         def on_success():
-            self.need_reload_embeddings = True
+            # add_person đã thêm embeddings vào gallery của face_service, chỉ cần đổi sang gallery mới
+            if self.face_service.gallery is not None:
+                self.embeddings = self.face_service.gallery
+            else:
+                self.need_reload_embeddings = True
         
         dialog = AddPersonDialog(self.root, self.face_service, self.db, on_success)
-        
-        original_on_close = dialog.on_close
-        def enhanced_on_close():
-            print("[INFO] Dialog đang đóng...")
-            original_on_close()
-            self.root.after(500, self.resume_camera)
-        
-        dialog.on_close = enhanced_on_close
         dialog.dialog.wait_window()
         
-        print("[INFO] Dialog đã đóng, chuẩn bị khôi phục camera...")
-        self.root.after(500, self.resume_camera)
+        # Dialog chỉ hủy đăng ký khỏi broker, camera không bị đóng nên tiếp tục ngay
+        self.resume_camera()
     
     def manage_persons_action(self):
         """Mở dialog quản lý đối tượng"""
@@ -277,245 +297,228 @@ class AttendanceRecognitionUI:
         threading.Thread(target=self.recognition_loop, daemon=True).start()
     
     def pause_camera(self):
-        """Tạm dừng camera"""
-        print("[INFO] Yêu cầu tạm dừng camera...")
+        """Tạm dừng preview; camera vẫn mở trong broker nên dialog dùng được ngay"""
+        print("[INFO] Tạm dừng camera màn hình chính")
         self.is_camera_paused = True
-        
-        import time
-        time.sleep(0.2)
-        
-        if self.cap:
-            try:
-                self.cap.release()
-                print("[INFO] Đã release camera màn hình chính")
-            except Exception as e:
-                print(f"[LỖI] Lỗi khi release camera: {e}")
-            finally:
-                self.cap = None
-        
-        time.sleep(0.3)
-        print("[INFO] Camera màn hình chính đã tạm dừng hoàn toàn")
+        if self.primary_camera is not None:
+            self.primary_camera.pause()
     
     def resume_camera(self):
-        """Tiếp tục camera"""
-        print("[INFO] Yêu cầu khôi phục camera...")
-        
-        max_retries = 5
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                self.cap = cv2.VideoCapture(0)
-                if self.cap.isOpened():
-                    print("[INFO] Đã mở lại camera thành công")
-                    break
-                else:
-                    self.cap.release()
-                    self.cap = None
-                    retry_count += 1
-                    print(f"[CẢNH BÁO] Thử lại mở camera lần {retry_count}/{max_retries}")
-                    import time
-                    time.sleep(0.5)
-            except Exception as e:
-                print(f"[LỖI] Không thể mở camera: {e}")
-                retry_count += 1
-                import time
-                time.sleep(0.5)
-        
-        if self.cap is None or not self.cap.isOpened():
-            print("[LỖI] Không thể khôi phục camera sau nhiều lần thử")
-            messagebox.showerror("Lỗi", 
-                "Không thể khôi phục camera!\n"
-                "Vui lòng khởi động lại ứng dụng.")
-            return
+        """Tiếp tục preview, bỏ frame cũ còn trong mailbox"""
+        camera = self.primary_camera
+        if camera is not None:
+            if camera.camera is not None and not camera.camera.is_opened():
+                print("[LỖI] Camera không khả dụng")
+                messagebox.showerror("Lỗi", 
+                    "Không thể khôi phục camera!\n"
+                    "Vui lòng khởi động lại ứng dụng.")
+                return
+            camera.resume()
         
         self.is_camera_paused = False
         print("[INFO] Camera màn hình chính đã hoạt động trở lại")
     
     def recognition_loop(self):
-        """Vòng lặp nhận diện"""
-        if self.cap is None or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        
-        self.embeddings = self.face_service.load_embeddings()
-        frame_count = 0
-        last_results = []
-        
-        while self.is_camera_running:
-            if self.is_camera_paused:
-                import time
-                time.sleep(0.1)
-                frame_count = 0
-                last_results = []
-                continue
-            
-            if self.need_reload_embeddings:
-                print("[INFO] Phát hiện cần reload embeddings...")
-                self.need_reload_embeddings = False
-                
-                def reload_embeddings_thread():
-                    try:
-                        print("[INFO] Bắt đầu generate embeddings...")
-                        self.face_service.generate_embeddings()
-                        new_embeddings = self.face_service.load_embeddings()
-                        self.embeddings = new_embeddings
-                        print(f"[INFO] Đã reload embeddings: {len(self.embeddings)} người")
-                    except Exception as e:
-                        print(f"[LỖI] Không thể reload embeddings: {e}")
-                        import traceback
-                        traceback.print_exc()
-                
-                threading.Thread(target=reload_embeddings_thread, daemon=True).start()
-            
-            if self.cap is None or not self.cap.isOpened():
-                print("[CẢNH BÁO] Camera không khả dụng, chờ...")
-                import time
-                time.sleep(0.5)
-                continue
-            
+        """Load gallery rồi chạy pipeline capture -> detect -> recognize/render cho từng camera"""
+        self.embeddings = self.face_service.load_gallery()
+        
+        self.cameras = MultiCameraRecognizer(
+            self.face_service,
+            APP_CONFIG['camera_sources'],
+            get_gallery=self.get_gallery,
+            on_match=self.on_face_recognized,
+            renders={0: self.render_frame},
+            stats_interval=APP_CONFIG['pipeline_stats_interval'],
+            extra_stats=self.format_extra_stats
+        )
+        self.primary_camera = self.cameras.workers[0]
+        if self.is_camera_paused:
+            self.primary_camera.pause()
+        self.cameras.start()
+    
+    def get_gallery(self):
+        """Gallery đang dùng cho mọi camera (reload nếu vừa tạo lại embeddings)"""
+        self.check_reload_embeddings()
+        return self.embeddings
+    
+    def check_reload_embeddings(self):
+        with self.recognition_lock:
+            if not self.need_reload_embeddings:
+                return
+            self.need_reload_embeddings = False
+        
+        print("[INFO] Phát hiện cần reload embeddings...")
+        
+        def reload_embeddings_thread():
             try:
-                ret, frame = self.cap.read()
-                if not ret:
-                    print("[CẢNH BÁO] Không đọc được frame")
-                    import time
-                    time.sleep(0.1)
-                    continue
+                print("[INFO] Bắt đầu generate embeddings...")
+                self.face_service.generate_embeddings()
+                new_embeddings = self.face_service.load_gallery()
+                self.embeddings = new_embeddings
+                print(f"[INFO] Đã reload embeddings: {len(self.embeddings)} người")
             except Exception as e:
-                print(f"[LỖI] Lỗi khi đọc frame: {e}")
-                import time
-                time.sleep(0.1)
-                continue
+                print(f"[LỖI] Không thể reload embeddings: {e}")
+                import traceback
+                traceback.print_exc()
+        
+        threading.Thread(target=reload_embeddings_thread, daemon=True).start()
+    
+    def on_face_recognized(self, camera, identity, confidence, face_img, track_id):
+        """Kết quả nhận diện của một khuôn mặt từ bất kỳ camera nào: cập nhật thẻ thông tin và ghi log"""
+        if identity == "Unknown" or confidence <= 0.6:
+            return
+        
+        with self.recognition_lock:
+            current_time = datetime.now()
             
-            try:
-                frame_count += 1
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_service.face_cascade.detectMultiScale(gray, 1.3, 5)
-                
-                if len(faces) == 0 and self.recognized_person is not None:
-                    current_time = datetime.now()
-                    if self.last_recognition_time and \
-                       (current_time - self.last_recognition_time).total_seconds() > self.recognition_cooldown:
-                        self.reset_to_waiting_state()
-                
-                if frame_count % 10 == 0 and len(self.embeddings) > 0:
-                    last_results = []
-                    try:
-                        from deepface import DeepFace
-                        results = DeepFace.extract_faces(frame, 
-                                                        detector_backend=self.face_service.detector_backend,
-                                                        enforce_detection=False)
-                        
-                        for r in results:
-                            fa = r["facial_area"]
-                            x, y, w, h = fa["x"], fa["y"], fa["w"], fa["h"]
-                            
-                            face_img = frame[y:y+h, x:x+w]
-                            if face_img.size > 0:
-                                emb = DeepFace.represent(
-                                    face_img,
-                                    model_name=self.face_service.model_name,
-                                    detector_backend="skip",
-                                    enforce_detection=False
-                                )[0]["embedding"]
-                                
-                                emb_array = np.array(emb, dtype=np.float32)
-                                identity, confidence = self.face_service.find_best_match(
-                                    emb_array, self.embeddings)
-                                
-                                last_results.append((x, y, w, h, identity, confidence))
-                                
-                                if identity != "Unknown" and confidence > 0.6:
-                                    current_time = datetime.now()
-                                    
-                                    if self.recognized_person is not None:
-                                        if identity == self.recognized_person['name']:
-                                            self.update_recognized_status()
-                                        else:
-                                            if (self.last_recognition_time is None or 
-                                                (current_time - self.last_recognition_time).total_seconds() > self.recognition_cooldown):
-                                                self.update_student_info(identity, confidence, face_img)
-                                                self.last_recognition_time = current_time
-                                    else:
-                                        self.update_student_info(identity, confidence, face_img)
-                                        self.last_recognition_time = current_time
-                    
-                    except Exception as e:
-                        print(f"[LỖI] DeepFace recognition: {e}")
-                
-                pil_image = Image.fromarray(frame_rgb)
-                draw = ImageDraw.Draw(pil_image)
-                
-                for (x, y, w, h, identity, confidence) in last_results:
-                    color = (0, 255, 0) if identity != "Unknown" else (255, 0, 0)
-                    corner_length = 30
-                    thickness = 4
-                    
-                    draw.line([(x, y), (x + corner_length, y)], fill=color, width=thickness)
-                    draw.line([(x, y), (x, y + corner_length)], fill=color, width=thickness)
-                    draw.line([(x+w, y), (x+w - corner_length, y)], fill=color, width=thickness)
-                    draw.line([(x+w, y), (x+w, y + corner_length)], fill=color, width=thickness)
-                    draw.line([(x, y+h), (x + corner_length, y+h)], fill=color, width=thickness)
-                    draw.line([(x, y+h), (x, y+h - corner_length)], fill=color, width=thickness)
-                    draw.line([(x+w, y+h), (x+w - corner_length, y+h)], fill=color, width=thickness)
-                    draw.line([(x+w, y+h), (x+w, y+h - corner_length)], fill=color, width=thickness)
-                
-                if len(last_results) == 0:
-                    for (x, y, w, h) in faces:
-                        color = (255, 255, 0)
-                        corner_length = 30
-                        thickness = 4
-                        
-                        draw.line([(x, y), (x + corner_length, y)], fill=color, width=thickness)
-                        draw.line([(x, y), (x, y + corner_length)], fill=color, width=thickness)
-                        draw.line([(x+w, y), (x+w - corner_length, y)], fill=color, width=thickness)
-                        draw.line([(x+w, y), (x+w, y + corner_length)], fill=color, width=thickness)
-                        draw.line([(x, y+h), (x + corner_length, y+h)], fill=color, width=thickness)
-                        draw.line([(x, y+h), (x, y+h - corner_length)], fill=color, width=thickness)
-                        draw.line([(x+w, y+h), (x+w - corner_length, y+h)], fill=color, width=thickness)
-                        draw.line([(x+w, y+h), (x+w, y+h - corner_length)], fill=color, width=thickness)
-                
+            if self.recognized_person is not None:
+                if identity == self.recognized_person['name']:
+                    self.update_recognized_status()
+                else:
+                    if (self.last_recognition_time is None or 
+                        (current_time - self.last_recognition_time).total_seconds() > self.recognition_cooldown):
+                        self.update_student_info(identity, confidence, face_img)
+                        self.last_recognition_time = current_time
+            else:
+                self.update_student_info(identity, confidence, face_img)
+                self.last_recognition_time = current_time
+    
+    def render_frame(self, packet, results):
+        """Stage render: vẽ box các track (màu theo danh tính đã gán) và hiển thị lên canvas"""
+        frame = packet['frame']
+        tracks = [t for t in packet['faces'] if t['missed'] <= 2]
+        
+        if not any(t['missed'] == 0 for t in tracks) and self.recognized_person is not None:
+            current_time = datetime.now()
+            if self.last_recognition_time and \
+               (current_time - self.last_recognition_time).total_seconds() > self.recognition_cooldown:
+                self.reset_to_waiting_state()
+        
+        cpu_start = time.thread_time()
+        
+        # Kích thước canvas do main thread cập nhật (<Configure>), worker không gọi Tk
+        canvas_width, canvas_height = self.canvas_size
+        if canvas_width <= 1 or canvas_height <= 1:
+            canvas_height, canvas_width = frame.shape[:2]
+        
+        # Resize vào buffer cấp phát sẵn rồi vẽ overlay trực tiếp lên ảnh đã thu nhỏ
+        if self.render_buffer is None or self.render_buffer.shape[:2] != (canvas_height, canvas_width):
+            self.render_buffer = np.empty((canvas_height, canvas_width, 3), dtype=np.uint8)
+        cv2.resize(frame, (canvas_width, canvas_height), dst=self.render_buffer,
+                   interpolation=cv2.INTER_LINEAR)
+        
+        scale_x = canvas_width / frame.shape[1]
+        scale_y = canvas_height / frame.shape[0]
+        for track in tracks:
+            x, y, w, h = track['box']
+            if track['identity'] is None:
+                color = (0, 255, 255)
+            elif track['identity'] != "Unknown":
+                color = (0, 255, 0)
+            else:
+                color = (0, 0, 255)
+            self.draw_corners(self.render_buffer, int(x * scale_x), int(y * scale_y),
+                              int(w * scale_x), int(h * scale_y), color)
+        
+        # FPS preview + tần suất nhận diện do scheduler chọn
+        self.fps_count += 1
+        now = time.time()
+        if now - self.fps_start_time >= 1.0:
+            self.fps = self.fps_count / (now - self.fps_start_time)
+            self.fps_start_time = now
+            self.fps_count = 0
+        cv2.putText(self.render_buffer,
+                    f"FPS: {self.fps:.1f} | Nhan dien: {self.primary_camera.scheduler.current_rate():.1f}/s",
+                    (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        # Mảng RGB mới mỗi frame: main thread đọc nó trong khi worker đã vẽ frame sau
+        self.frame_mailbox.put(cv2.cvtColor(self.render_buffer, cv2.COLOR_BGR2RGB))
+        
+        cpu_time = time.thread_time() - cpu_start
+        self.render_cpu = cpu_time if self.render_cpu == 0 else 0.9 * self.render_cpu + 0.1 * cpu_time
+    
+    def schedule_ui_update(self):
+        """Main thread: lấy frame mới nhất + áp dụng các cập nhật giao diện, lặp lại bằng root.after"""
+        try:
+            frame_rgb = self.frame_mailbox.get(timeout=0)
+            if frame_rgb is not None:
+                self.show_frame(frame_rgb)
+            
+            while True:
                 try:
-                    if not self.canvas_camera.winfo_exists():
-                        break
-                    
-                    canvas_width = self.canvas_camera.winfo_width()
-                    canvas_height = self.canvas_camera.winfo_height()
-                    if canvas_width > 1 and canvas_height > 1:
-                        pil_image = pil_image.resize((canvas_width, canvas_height), Image.Resampling.LANCZOS)
-                    
-                    photo = ImageTk.PhotoImage(image=pil_image)
-                    self.canvas_camera.create_image(0, 0, image=photo, anchor='nw')
-                    self.canvas_camera.image = photo
-                except tk.TclError:
+                    widget_name, options = self.ui_queue.get_nowait()
+                except queue.Empty:
                     break
+                self.apply_widget_config(widget_name, options)
             
-            except Exception as e:
-                print(f"[LỖI] recognition_loop: {e}")
-            
-            try:
-                if self.root.winfo_exists():
-                    self.root.update_idletasks()
-            except:
-                break
-            
-            import time
-            time.sleep(0.03)
+            self.root.after(APP_CONFIG['ui_refresh_ms'], self.schedule_ui_update)
+        except tk.TclError:
+            self.stop_recognition()
+    
+    def show_frame(self, frame_rgb):
+        """Main thread: đẩy frame lên một PhotoImage + một canvas item dùng lại (paste)"""
+        height, width = frame_rgb.shape[:2]
+        image = Image.frombuffer('RGB', (width, height), frame_rgb, 'raw', 'RGB', 0, 1)
+        
+        if self.photo is None or (self.photo.width(), self.photo.height()) != (width, height):
+            self.photo = ImageTk.PhotoImage(image=image)
+            if self.canvas_image_id is None:
+                self.canvas_image_id = self.canvas_camera.create_image(0, 0, image=self.photo, anchor='nw')
+            else:
+                self.canvas_camera.itemconfig(self.canvas_image_id, image=self.photo)
+        else:
+            self.photo.paste(image)
+    
+    def on_canvas_resize(self, event):
+        self.canvas_size = (event.width, event.height)
+    
+    def set_widget(self, widget_name, **options):
+        """Yêu cầu cập nhật widget từ bất kỳ thread nào; main thread sẽ áp dụng (không chặn worker)"""
+        self.ui_queue.put((widget_name, options))
+    
+    def apply_widget_config(self, widget_name, options):
+        """Main thread: chỉ gọi config khi giá trị thực sự thay đổi"""
+        state = self.widget_state.setdefault(widget_name, {})
+        changed = {key: value for key, value in options.items() if state.get(key) != value}
+        if changed:
+            getattr(self, widget_name).config(**changed)
+            state.update(changed)
+    
+    @staticmethod
+    def draw_corners(image, x, y, w, h, color, corner_length=30, thickness=4):
+        """Vẽ 4 góc khung khuôn mặt bằng một lần cv2.polylines"""
+        corner_length = min(corner_length, w // 2, h // 2)
+        corners = np.array([
+            [(x + corner_length, y), (x, y), (x, y + corner_length)],
+            [(x + w - corner_length, y), (x + w, y), (x + w, y + corner_length)],
+            [(x + corner_length, y + h), (x, y + h), (x, y + h - corner_length)],
+            [(x + w - corner_length, y + h), (x + w, y + h), (x + w, y + h - corner_length)]
+        ], dtype=np.int32)
+        cv2.polylines(image, corners, False, color, thickness)
+    
+    def format_extra_stats(self):
+        """Thống kê in kèm pipeline: độ trễ detector theo scale + CPU của stage render"""
+        return f"{self.face_service.detector.format_stats()} | render CPU: {self.render_cpu * 1000:.1f}ms/frame"
+    
+    def stop_recognition(self):
+        """Dừng pipeline của mọi camera và hủy đăng ký camera"""
+        self.is_camera_running = False
+        if self.cameras is not None:
+            self.cameras.stop()
     
     def reset_to_waiting_state(self):
         """Reset về trạng thái chờ"""
         self.recognized_person = None
-        self.status_icon_label.config(text="👤", fg='#e0e0e0')
-        self.name_label.config(text="Chờ nhận diện...", fg='#2c3e50')
-        self.id_label.config(text="Mã: ------")
-        self.dept_label.config(text="Phòng: ------")
-        self.conf_label.config(text="Độ chính xác: ---%")
-        self.status_label.config(text="", fg='#999')
+        self.set_widget('status_icon_label', text="👤", fg='#e0e0e0')
+        self.set_widget('name_label', text="Chờ nhận diện...", fg='#2c3e50')
+        self.set_widget('id_label', text="Mã: ------")
+        self.set_widget('dept_label', text="Phòng: ------")
+        self.set_widget('conf_label', text="Độ chính xác: ---%")
+        self.set_widget('status_label', text="", fg='#999')
     
     def update_recognized_status(self):
         """Cập nhật trạng thái đã nhận diện"""
-        self.status_label.config(
+        self.set_widget('status_label',
             text="✓ Đã nhận diện - Vẫn trong khung hình",
             fg='#27ae60'
         )
@@ -523,8 +526,7 @@ class AttendanceRecognitionUI:
     def update_student_info(self, identity, confidence, face_img):
         """Cập nhật thông tin sinh viên"""
         try:
-            persons = self.db.get_all_persons()
-            person = next((p for p in persons if p['full_name'] == identity), None)
+            person = self.face_service.find_person(identity, self.embeddings)
             
             if person:
                 self.recognized_person = {
@@ -532,18 +534,18 @@ class AttendanceRecognitionUI:
                     'person_id': person['id']
                 }
                 
-                self.status_icon_label.config(text="✓", fg='#27ae60')
-                self.name_label.config(text=identity, fg='#27ae60')
+                self.set_widget('status_icon_label', text="✓", fg='#27ae60')
+                self.set_widget('name_label', text=identity, fg='#27ae60')
                 
                 emp_id = person.get('employee_id') or 'Chưa cập nhật'
-                self.id_label.config(text=f"Mã: {emp_id}")
+                self.set_widget('id_label', text=f"Mã: {emp_id}")
                 
                 dept = person.get('department') or 'Chưa cập nhật'
-                self.dept_label.config(text=f"Phòng: {dept}")
+                self.set_widget('dept_label', text=f"Phòng: {dept}")
                 
-                self.conf_label.config(text=f"Độ chính xác: {confidence*100:.1f}%")
+                self.set_widget('conf_label', text=f"Độ chính xác: {confidence*100:.1f}%")
                 
-                self.status_label.config(
+                self.set_widget('status_label',
                     text=f"✓ Đã xác nhận nhận diện thành công!",
                     fg='#27ae60'
                 )
@@ -561,9 +563,7 @@ class AttendanceRecognitionUI:
     
     def __del__(self):
         """Cleanup"""
-        self.is_camera_running = False
-        if self.cap:
-            self.cap.release()
+        self.stop_recognition()
 
 
 if __name__ == "__main__":
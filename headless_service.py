@@ -0,0 +1,132 @@
+"""
+Dịch vụ nhận diện chạy nền, không giao diện (máy chủ không có màn hình)
+Dùng chung FaceRecognitionService, DatabaseHelper và pipeline nhiều camera với gui_app
+nhưng không import tkinter, ghi kết quả vào recognition_logs và in thống kê định kỳ
+
+    python headless_service.py                      # các nguồn trong CAMERA_SOURCES
+    python headless_service.py --sources 0,rtsp://... --stats-interval 30
+
+Gửi SIGHUP để load lại gallery sau khi thêm người/tạo lại embeddings, Ctrl+C hoặc SIGTERM để dừng
+"""
+import time
+import signal
+import argparse
+import threading
+from config import APP_CONFIG
+from database_helper import DatabaseHelper
+from face_service import FaceRecognitionService
+from multi_camera import MultiCameraRecognizer
+
+
+class HeadlessRecognitionService:
+    """
+    Nhận diện trên nhiều camera và ghi log điểm danh, không có giao diện
+    Mỗi người chỉ được ghi log một lần trong cooldown giây (giống recognition_cooldown của GUI)
+    """
+    def __init__(self, sources, min_confidence=0.6, cooldown=30, stats_interval=30):
+        self.db = DatabaseHelper()
+        self.face_service = FaceRecognitionService()
+        self.min_confidence = min_confidence
+        self.cooldown = cooldown
+
+        self.gallery = self.face_service.load_gallery()
+        # identity -> person (cache, xóa khi reload gallery)
+        self.persons = {}
+        # identity -> thời điểm ghi log gần nhất
+        self.last_logged = {}
+        self.logs_written = 0
+        self._lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        self.cameras = MultiCameraRecognizer(
+            self.face_service,
+            sources,
+            get_gallery=lambda: self.gallery,
+            on_match=self.on_face_recognized,
+            stats_interval=stats_interval,
+            extra_stats=self.format_stats
+        )
+
+    def reload_gallery(self):
+        self.gallery = self.face_service.load_gallery()
+        with self._lock:
+            self.persons = {}
+        print(f"[INFO] Đã reload gallery: {len(self.gallery)} embeddings")
+
+    def find_person(self, identity):
+        """Tra person theo person_id trong gallery (xem FaceRecognitionService.find_person), có cache"""
+        with self._lock:
+            person = self.persons.get(identity)
+        if person is None:
+            person = self.face_service.find_person(identity, self.gallery)
+            if person is not None:
+                with self._lock:
+                    self.persons[identity] = person
+        return person
+
+    def on_face_recognized(self, camera, identity, confidence, face_img, track_id):
+        if identity == "Unknown" or confidence <= self.min_confidence:
+            return
+
+        now = time.time()
+        with self._lock:
+            last = self.last_logged.get(identity)
+            if last is not None and now - last < self.cooldown:
+                return
+            self.last_logged[identity] = now
+
+        person = self.find_person(identity)
+        if person is None:
+            print(f"[CẢNH BÁO] {camera.name}: không tìm thấy {identity} trong database")
+            return
+
+        self.db.add_recognition_log(
+            person_id=person['id'],
+            identified_name=identity,
+            confidence=confidence
+        )
+        with self._lock:
+            self.logs_written += 1
+        print(f"[INFO] {camera.name}: Attendance logged: {identity} - {confidence*100:.1f}%")
+
+    def format_stats(self):
+        return f"{self.face_service.detector.format_stats()} | log đã ghi: {self.logs_written}"
+
+    def run(self):
+        self.cameras.start()
+        try:
+            while not self.stop_event.is_set():
+                self.stop_event.wait(1.0)
+        finally:
+            self.cameras.stop()
+            print(f"[INFO] Đã dừng dịch vụ, {self.logs_written} log đã ghi")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ nhận diện khuôn mặt không giao diện")
+    parser.add_argument("--sources", default=",".join(APP_CONFIG['camera_sources']),
+                        help="danh sách nguồn cách nhau bằng dấu phẩy (chỉ số camera, file, URL)")
+    parser.add_argument("--min-confidence", type=float, default=0.6)
+    parser.add_argument("--cooldown", type=float, default=30, help="giây giữa hai log của cùng một người")
+    parser.add_argument("--stats-interval", type=float, default=30,
+                        help="giây giữa các lần in thống kê, 0 = không in")
+    args = parser.parse_args()
+
+    sources = [source.strip() for source in args.sources.split(",") if source.strip()]
+    service = HeadlessRecognitionService(sources, args.min_confidence, args.cooldown, args.stats_interval)
+
+    def handle_stop(signum, frame):
+        print("[INFO] Nhận tín hiệu dừng...")
+        service.stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGTERM, handle_stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=service.reload_gallery, daemon=True).start())
+
+    service.run()
+
+
+if __name__ == "__main__":
+    main()
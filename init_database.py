@@ -52,9 +52,14 @@ def create_tables():
                 person_id INTEGER NOT NULL REFERENCES persons(id) ON DELETE CASCADE,
                 image_path VARCHAR(500) NOT NULL,
                 image_quality FLOAT,
+                is_aligned BOOLEAN DEFAULT FALSE,
                 date_captured TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Database tao tu phien ban cu chua co cot is_aligned
+        cursor.execute("""
+            ALTER TABLE person_images ADD COLUMN IF NOT EXISTS is_aligned BOOLEAN DEFAULT FALSE
+        """)
         print("[OK] Da tao bang person_images")
         
         # 4. Bang recognition_logs
@@ -0,0 +1,303 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import cv2
+from config import APP_CONFIG
+from camera_broker import get_camera_broker
+from video_pipeline import RecognitionPipeline
+from face_tracker import FaceTracker
+from face_quality import FaceQualityGate
+from recognition_scheduler import RecognitionScheduler
+
+
+class FairInferenceGate:
+    """
+    Chia lượt dùng model (RetinaFace + ArcFace) giữa các camera theo thứ tự đến (FIFO)
+    Mỗi camera chỉ có tối đa một yêu cầu đang chờ (stage recognize chạy tuần tự)
+    nên FIFO tương đương round-robin: camera nhiều người không chiếm hết model của camera khác
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._busy = False
+        # tên camera -> {'turns', 'wait_ms', 'inference_ms'} (trung bình trượt)
+        self.stats = {}
+
+    @contextmanager
+    def turn(self, name):
+        start = time.time()
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            while self._busy or self._waiting[0] is not ticket:
+                self._cond.wait()
+            self._waiting.popleft()
+            self._busy = True
+
+        acquired = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            with self._cond:
+                self._busy = False
+                self._record(name, acquired - start, end - acquired)
+                self._cond.notify_all()
+
+    def _record(self, name, wait, inference, alpha=0.1):
+        stats = self.stats.setdefault(name, {'turns': 0, 'wait_ms': 0.0, 'inference_ms': 0.0})
+        stats['turns'] += 1
+        for key, value in (('wait_ms', wait * 1000), ('inference_ms', inference * 1000)):
+            stats[key] = value if stats['turns'] == 1 else (1 - alpha) * stats[key] + alpha * value
+
+    def snapshot(self, name):
+        with self._cond:
+            return dict(self.stats.get(name, {'turns': 0, 'wait_ms': 0.0, 'inference_ms': 0.0}))
+
+
+class CameraWorker:
+    """
+    Một camera (lối vào): subscription camera, tracker, scheduler và pipeline riêng
+    Model và gallery dùng chung qua face_service/get_gallery, lượt suy luận chia qua FairInferenceGate
+    - get_gallery() -> gallery hiện tại (gọi mỗi lần nhận diện để thấy gallery mới sau khi thêm người)
+    - on_match(worker, identity, confidence, face_img, track_id): gọi một lần cho mỗi track khi danh tính
+      được chốt (bỏ phiếu qua nhiều frame, xem FaceTracker.vote)
+    - render(packet, results): vẽ/hiển thị (chỉ camera có preview), None = không hiển thị
+    """
+    def __init__(self, name, source, face_service, get_gallery, gate, on_match=None, render=None):
+        self.name = name
+        self.source = source
+        self.face_service = face_service
+        self.get_gallery = get_gallery
+        self.gate = gate
+        self.on_match = on_match
+        self.camera = None
+        self.is_paused = False
+
+        # Mỗi camera một CascadeClassifier (detectMultiScale không an toàn khi gọi song song)
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.tracker = FaceTracker(
+            iou_threshold=APP_CONFIG['track_iou_threshold'],
+            max_missed=APP_CONFIG['track_max_missed'],
+            vote_window=APP_CONFIG['track_vote_window'],
+            min_votes=APP_CONFIG['track_min_votes'],
+            accept_confidence=APP_CONFIG['track_accept_confidence'],
+            accept_margin=APP_CONFIG['track_accept_margin'],
+            early_accept=APP_CONFIG['track_early_accept']
+        )
+        self.quality_gate = FaceQualityGate(
+            min_size=APP_CONFIG['quality_min_face_size'],
+            min_blur=APP_CONFIG['quality_min_blur'],
+            min_brightness=APP_CONFIG['quality_min_brightness'],
+            max_brightness=APP_CONFIG['quality_max_brightness'],
+            max_yaw=APP_CONFIG['quality_max_yaw']
+        )
+        self.scheduler = RecognitionScheduler(
+            target_latency=APP_CONFIG['recognition_target_latency'],
+            cpu_budget=APP_CONFIG['recognition_cpu_budget'],
+            max_interval=APP_CONFIG['recognition_max_interval']
+        )
+        self.pipeline = RecognitionPipeline(
+            read_frame=self.read_frame,
+            detect=self.detect_faces,
+            recognize=self.recognize_frame,
+            render=render or (lambda packet, results: None),
+            queue_size=APP_CONFIG['pipeline_queue_size']
+        )
+        self._started_at = None
+
+    def start(self):
+        if self._started_at is None:
+            self._started_at = time.time()
+        if self.camera is None:
+            self.camera = get_camera_broker(self.source).subscribe()
+        self.pipeline.start()
+
+    def stop(self):
+        self.pipeline.stop()
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+
+    def pause(self):
+        self.is_paused = True
+        self.tracker.reset()
+
+    def resume(self):
+        if self.camera is not None:
+            self.camera.clear()
+        self.is_paused = False
+
+    def read_frame(self):
+        """Stage capture: frame mới từ broker, None khi tạm dừng hoặc camera không khả dụng"""
+        camera = self.camera
+        if self.is_paused or camera is None:
+            return None
+        if not camera.is_opened():
+            time.sleep(0.4)
+            return None
+        return camera.read(timeout=0.5)
+
+    def detect_faces(self, frame):
+        """Stage detect: Haar cascade trên mọi frame rồi cập nhật tracker"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+        return self.tracker.update(faces)
+
+    def recognize_frame(self, packet):
+        """
+        Stage recognize: RetinaFace + ArcFace chỉ cho track chưa chốt danh tính,
+        chạy trong lượt của camera này trên FairInferenceGate
+        Embedding được cộng dồn theo track, so khớp embedding trung bình của K frame gần nhất
+        """
+        gallery = self.get_gallery()
+        if gallery is None or len(gallery) == 0:
+            return None
+
+        active = [t for t in packet['faces'] if t['missed'] == 0]
+        new_faces = any(t['new'] for t in active)
+        if not self.scheduler.should_run(len(active), new_faces):
+            return None
+
+        # Không có ai trong khung hình: vẫn chạy thưa để bắt khuôn mặt Haar bỏ sót
+        pending = set(self.tracker.pending(APP_CONFIG['track_retry_interval']))
+        if not pending and active:
+            # Vẫn báo cho scheduler để cảnh tĩnh giãn dần khoảng cách giữa các lượt
+            self.scheduler.record_skip(len(active), new_faces)
+            return None
+
+        frame = packet['frame']
+        start_time = time.time()
+        try:
+            with self.gate.turn(self.name):
+                inference_start = time.time()
+                boxes, face_imgs, landmarks = self.face_service.detector.detect(
+                    frame, hint_boxes=[t['box'] for t in active], return_landmarks=True)
+
+                track_ids = self.tracker.match(boxes)
+                selected = [i for i, track_id in enumerate(track_ids) if track_id is None or track_id in pending]
+                # Crop mờ/nhỏ/tối/nghiêng không chạy ArcFace; track vẫn chờ và được thử lại sau retry_interval
+                reasons = self.quality_gate.evaluate([face_imgs[i] for i in selected], [landmarks[i] for i in selected])
+                selected = [i for i, reason in zip(selected, reasons) if reason is None]
+                face_embs = self.face_service.represent_batch([face_imgs[i] for i in selected])
+                inference_time = time.time() - inference_start
+
+            observed = []
+            for i, face_emb in zip(selected, face_embs):
+                # Khuôn mặt Haar bỏ sót (chưa có track): tạo track để bỏ phiếu từ frame này
+                track_id = track_ids[i] if track_ids[i] is not None else self.tracker.add(boxes[i])
+                mean_emb, votes = self.tracker.observe(track_id, face_emb)
+                if mean_emb is not None:
+                    observed.append((i, track_id, mean_emb, votes))
+
+            # Một GEMM cho embedding trung bình của mọi track; top 2 để tính margin
+            all_matches = self.face_service.match_embeddings(
+                [mean_emb for _, _, mean_emb, _ in observed], gallery, top_k=2)
+            for (i, track_id, _, votes), matches in zip(observed, all_matches):
+                if self.tracker.vote(track_id, matches, votes) and self.on_match is not None:
+                    identity, confidence = matches[0]
+                    self.on_match(self, identity, confidence, face_imgs[i], track_id)
+        except Exception as e:
+            print(f"[LỖI] {self.name} nhận diện: {e}")
+            inference_time = time.time() - start_time
+
+        # Scheduler chỉ tính thời gian chạy model, không tính thời gian chờ lượt camera khác
+        self.scheduler.record(inference_time, len(active), new_faces)
+        return None
+
+    def stats(self):
+        """
+        Số frame đã xử lý, FPS trung bình từ lúc start, độ trễ từng stage và thời gian chờ/chạy model
+        Không giữ trạng thái giữa các lần gọi: FPS theo cửa sổ do người gọi tự tính từ 'processed'
+        """
+        pipeline_stats = self.pipeline.stats()
+        processed = pipeline_stats['capture']['processed']
+        elapsed = time.time() - self._started_at if self._started_at is not None else 0.0
+        camera = self.camera
+        return {
+            'processed': processed,
+            'fps': processed / elapsed if elapsed > 0 else 0.0,
+            'detect_ms': pipeline_stats['detect']['latency_ms'],
+            'recognize_ms': pipeline_stats['recognize']['latency_ms'],
+            'end_to_end_ms': pipeline_stats['end_to_end']['latency_ms'],
+            'dropped': pipeline_stats['recognize']['dropped'],
+            'recognition_rate': self.scheduler.current_rate(),
+            'gate': self.gate.snapshot(self.name),
+            'quality': self.quality_gate.stats(),
+            'frame_age_ms': camera.age_ms if camera is not None else 0.0,
+            'reconnects': camera.broker.reconnects if camera is not None else 0
+        }
+
+    def format_stats(self, fps=None):
+        """fps: FPS theo cửa sổ của người gọi, None = FPS trung bình từ lúc start"""
+        s = self.stats()
+        fps = s['fps'] if fps is None else fps
+        # Hàng đợi đầu vào và số frame bị bỏ của từng stage (giống RecognitionPipeline.format_stats)
+        queues = ", ".join(f"{name} q={stage['queue']} drop={stage['dropped']}"
+                           for name, stage in self.pipeline.stats().items() if name != 'end_to_end')
+        return (f"{self.name}: {fps:.1f} FPS, tuổi frame {s['frame_age_ms']:.1f}ms, "
+                f"kết nối lại {s['reconnects']}, detect {s['detect_ms']:.1f}ms, "
+                f"end_to_end {s['end_to_end_ms']:.1f}ms, nhận diện {s['recognition_rate']:.1f}/s "
+                f"({s['gate']['inference_ms']:.0f}ms, chờ model {s['gate']['wait_ms']:.0f}ms), "
+                f"{queues}, {self.quality_gate.format_stats()}")
+
+
+class MultiCameraRecognizer:
+    """
+    Chạy nhiều camera cùng lúc trên một face_service (một model) và một gallery
+    sources: danh sách nguồn (chỉ số thiết bị, file, URL); camera i tên "cam{i}"
+    renders: dict chỉ số camera -> hàm render (ví dụ preview của camera đầu tiên trên GUI)
+    stats_interval > 0: in thống kê từng camera định kỳ, kèm extra_stats() nếu có
+    """
+    def __init__(self, face_service, sources, get_gallery, on_match=None, renders=None,
+                 stats_interval=0, extra_stats=None):
+        self.gate = FairInferenceGate()
+        renders = renders or {}
+        self.workers = [
+            CameraWorker(f"cam{i}", source, face_service, get_gallery, self.gate,
+                         on_match=on_match, render=renders.get(i))
+            for i, source in enumerate(sources)
+        ]
+        self.stats_interval = stats_interval
+        self.extra_stats = extra_stats
+        self.is_running = False
+
+    def start(self):
+        self.is_running = True
+        for worker in self.workers:
+            worker.start()
+            print(f"[INFO] Đã bắt đầu {worker.name} ({worker.source})")
+        if self.stats_interval > 0:
+            threading.Thread(target=self._report_stats, daemon=True, name="camera-stats").start()
+
+    def stop(self):
+        self.is_running = False
+        for worker in self.workers:
+            worker.stop()
+
+    def format_stats(self, fps=None):
+        """fps: dict tên camera -> FPS (từ _report_stats), None = FPS trung bình từ lúc start"""
+        fps = fps or {}
+        parts = [worker.format_stats(fps.get(worker.name)) for worker in self.workers]
+        if self.extra_stats is not None:
+            extra = self.extra_stats()
+            if extra:
+                parts.append(extra)
+        return " | ".join(parts)
+
+    def _report_stats(self):
+        # FPS mỗi camera trong khoảng stats_interval; cửa sổ chỉ thuộc thread này
+        # nên các lần gọi stats()/format_stats() khác không làm lệch số liệu
+        last = {worker.name: (time.time(), worker.stats()['processed']) for worker in self.workers}
+        while self.is_running:
+            time.sleep(self.stats_interval)
+            if not self.is_running:
+                break
+            fps = {}
+            for worker in self.workers:
+                now, processed = time.time(), worker.stats()['processed']
+                last_time, last_processed = last[worker.name]
+                fps[worker.name] = (processed - last_processed) / max(now - last_time, 1e-6)
+                last[worker.name] = (now, processed)
+            print(f"[INFO] Camera {self.format_stats(fps)}")
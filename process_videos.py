@@ -0,0 +1,314 @@
+"""
+Xử lý video ghi hình (CCTV) thành log điểm danh, nhanh nhất CPU cho phép (không chờ theo thời gian thực)
+Decode frame trên thread riêng, Haar + tracker trên mọi frame được chọn, RetinaFace chỉ cho track cần nhận diện,
+ArcFace chạy theo batch gom từ nhiều frame. Log ghi với thời điểm gốc trong video, mỗi người một log trong cooldown
+
+    python process_videos.py cam1.mp4 cam2.mp4 --stride 2
+    python process_videos.py loi_vao.avi --start-time "2026-10-18 07:30:00" --dry-run
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime
+import cv2
+from config import APP_CONFIG
+from database_helper import DatabaseHelper
+from face_service import FaceRecognitionService
+from face_tracker import FaceTracker
+from face_quality import FaceQualityGate
+
+
+class VideoFrameReader:
+    """
+    Decode video trên thread riêng vào hàng đợi giới hạn
+    Khác camera trực tiếp: hàng đợi đầy thì chặn (không bỏ frame) vì xử lý offline cần mọi frame được chọn
+    stride: chỉ decode 1 trong stride frame, các frame bỏ qua chỉ grab (không decode)
+    Mỗi phần tử: (chỉ số frame, thời điểm trong video (giây), frame BGR)
+    """
+    def __init__(self, path, stride=1, queue_size=32):
+        self.path = path
+        self.stride = max(1, stride)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self.decode_time = 0.0
+
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Không mở được video: {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.duration = self.frame_count / self.fps if self.fps > 0 else 0.0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True, name="video-reader")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        # Giải phóng chỗ trong hàng đợi để thread đọc không bị chặn mãi
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.cap.release()
+
+    def _read_loop(self):
+        index = 0
+        try:
+            while self._running:
+                if index % self.stride:
+                    if not self.cap.grab():
+                        break
+                    self.frames_read += 1
+                    index += 1
+                    continue
+
+                start = time.time()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                self.decode_time += time.time() - start
+                self.frames_read += 1
+                self.frames_decoded += 1
+
+                if self.fps > 0:
+                    position = index / self.fps
+                else:
+                    position = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                self.queue.put((index, position, frame))
+                index += 1
+        finally:
+            self.queue.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            yield item
+
+
+class VideoAttendanceProcessor:
+    """
+    Nhận diện trên video ghi hình và ghi recognition_logs với thời điểm gốc
+    - Tracker giữ danh tính theo track, chỉ track chưa chốt danh tính mới chạy RetinaFace
+    - Danh tính được bỏ phiếu qua nhiều frame (embedding trung bình), log khi track chốt danh tính
+    - Khuôn mặt cần embed được gom thành batch (batch_size) qua nhiều frame rồi chạy ArcFace một lần
+    - Mỗi người một log trong cooldown giây (tính theo thời gian trong video)
+    """
+    def __init__(self, face_service, db, batch_size=32, min_confidence=0.6, cooldown=30,
+                 detect_interval=1.0, dry_run=False):
+        self.face_service = face_service
+        self.db = db
+        self.batch_size = batch_size
+        self.min_confidence = min_confidence
+        self.cooldown = cooldown
+        # Không có khuôn mặt Haar nào: vẫn chạy detector mỗi detect_interval giây video (bắt khuôn mặt Haar bỏ sót)
+        self.detect_interval = detect_interval
+        self.dry_run = dry_run
+
+        self.quality_gate = FaceQualityGate(
+            min_size=APP_CONFIG['quality_min_face_size'],
+            min_blur=APP_CONFIG['quality_min_blur'],
+            min_brightness=APP_CONFIG['quality_min_brightness'],
+            max_brightness=APP_CONFIG['quality_max_brightness'],
+            max_yaw=APP_CONFIG['quality_max_yaw']
+        )
+        self.gallery = face_service.load_gallery()
+        # identity -> person, tra khi cần (FaceRecognitionService.find_person)
+        self.persons = {}
+        self.last_logged = {}
+        self.logs = []
+
+    def process(self, path, start_time, stride=1):
+        """
+        Xử lý một video. start_time: datetime của frame đầu tiên
+        Returns: dict thống kê (frame, khuôn mặt, log, thời gian)
+        """
+        reader = VideoFrameReader(path, stride).start()
+        tracker = FaceTracker(
+            iou_threshold=APP_CONFIG['track_iou_threshold'],
+            max_missed=APP_CONFIG['track_max_missed'],
+            vote_window=APP_CONFIG['track_vote_window'],
+            min_votes=APP_CONFIG['track_min_votes'],
+            accept_confidence=APP_CONFIG['track_accept_confidence'],
+            accept_margin=APP_CONFIG['track_accept_margin'],
+            early_accept=APP_CONFIG['track_early_accept'],
+            # Crop chờ đủ batch có thể thuộc track đã rời khung hình trước khi chạy ArcFace
+            keep_expired=True
+        )
+        base = start_time.timestamp()
+        batch = []
+        stats = {'frames': 0, 'detector_runs': 0, 'faces': 0, 'logs': 0}
+        last_detect = None
+        started = time.time()
+
+        try:
+            for index, position, frame in reader:
+                now = base + position
+                stats['frames'] += 1
+
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                tracks = tracker.update(self.face_service.face_cascade.detectMultiScale(gray, 1.3, 5))
+                active = [t for t in tracks if t['missed'] == 0]
+                pending = set(tracker.pending(APP_CONFIG['track_retry_interval'], now=now))
+
+                idle = not active and (last_detect is None or now - last_detect >= self.detect_interval)
+                if not pending and not idle:
+                    continue
+
+                last_detect = now
+                stats['detector_runs'] += 1
+                boxes, face_imgs, landmarks = self.face_service.detector.detect(
+                    frame, hint_boxes=[t['box'] for t in active], return_landmarks=True)
+                track_ids = tracker.match(boxes)
+                # Chỉ chấm chất lượng khuôn mặt sẽ được nhận diện (track mới hoặc đang chờ), như multi_camera
+                selected = [i for i, track_id in enumerate(track_ids) if track_id is None or track_id in pending]
+                reasons = self.quality_gate.evaluate([face_imgs[i] for i in selected], [landmarks[i] for i in selected])
+                for i, reason in zip(selected, reasons):
+                    track_id = track_ids[i] if track_ids[i] is not None else tracker.add(boxes[i], now=now)
+                    # Crop kém: bỏ qua, track được thử lại ở frame sau (sau retry_interval)
+                    if reason is not None:
+                        continue
+                    # Crop là view của frame; copy để frame được giải phóng khi chờ đủ batch
+                    batch.append((track_id, now, face_imgs[i].copy()))
+
+                if len(batch) >= self.batch_size:
+                    stats['faces'] += len(batch)
+                    stats['logs'] += self._flush(batch, tracker)
+                    batch = []
+
+            if batch:
+                stats['faces'] += len(batch)
+                stats['logs'] += self._flush(batch, tracker)
+        finally:
+            reader.stop()
+
+        stats['elapsed'] = time.time() - started
+        stats['frames_read'] = reader.frames_read
+        stats['decode_time'] = reader.decode_time
+        return stats
+
+    def _flush(self, batch, tracker):
+        """
+        Chạy ArcFace một lần cho cả batch, bỏ phiếu theo track (theo thứ tự frame)
+        và ghi log cho track vừa chốt danh tính, kể cả track đã rời khung hình khi chờ batch
+        Returns: số log đã ghi
+        """
+        face_embs = self.face_service.represent_batch([face_img for _, _, face_img in batch])
+        observed = []
+        for (track_id, timestamp, _), face_emb in zip(batch, face_embs):
+            mean_emb, votes = tracker.observe(track_id, face_emb)
+            if mean_emb is not None:
+                observed.append((track_id, timestamp, mean_emb, votes))
+
+        all_matches = self.face_service.match_embeddings(
+            [mean_emb for _, _, mean_emb, _ in observed], self.gallery, top_k=2)
+        logged = 0
+        for (track_id, timestamp, _, votes), matches in zip(observed, all_matches):
+            if tracker.vote(track_id, matches, votes):
+                identity, confidence = matches[0]
+                if self._log(identity, confidence, timestamp):
+                    logged += 1
+        # Mọi crop đã chờ của track đã rời khung hình vừa được bỏ phiếu
+        tracker.clear_expired()
+        return logged
+
+    def _log(self, identity, confidence, timestamp):
+        if identity == "Unknown" or confidence <= self.min_confidence:
+            return False
+
+        last = self.last_logged.get(identity)
+        if last is not None and timestamp - last < self.cooldown:
+            return False
+        self.last_logged[identity] = timestamp
+
+        person = self.persons.get(identity)
+        if person is None:
+            person = self.face_service.find_person(identity, self.gallery)
+            self.persons[identity] = person
+        if person is None:
+            print(f"[CẢNH BÁO] Không tìm thấy {identity} trong database")
+            return False
+
+        recognition_time = datetime.fromtimestamp(timestamp)
+        if not self.dry_run:
+            self.db.add_recognition_log(
+                person_id=person['id'],
+                identified_name=identity,
+                confidence=confidence,
+                recognition_time=recognition_time
+            )
+        self.logs.append((recognition_time, identity, confidence))
+        print(f"[INFO] {recognition_time:%Y-%m-%d %H:%M:%S} {identity} - {confidence*100:.1f}%")
+        return True
+
+
+def video_start_time(path, start_time=None):
+    """Thời điểm bắt đầu ghi: --start-time nếu có, không thì mtime của file (lúc ghi xong) trừ độ dài video"""
+    if start_time:
+        return datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    cap.release()
+    duration = frame_count / fps if fps > 0 else 0.0
+    return datetime.fromtimestamp(os.path.getmtime(path) - duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xử lý video ghi hình thành log điểm danh")
+    parser.add_argument("videos", nargs="+", help="các file video")
+    parser.add_argument("--stride", type=int, default=1, help="chỉ xử lý 1 trong N frame")
+    parser.add_argument("--start-time", help="thời điểm frame đầu tiên, dạng 'YYYY-mm-dd HH:MM:SS' "
+                                             "(mặc định: mtime của file trừ độ dài video)")
+    parser.add_argument("--batch-size", type=int, default=APP_CONFIG['embedding_batch_size'])
+    parser.add_argument("--min-confidence", type=float, default=0.6)
+    parser.add_argument("--cooldown", type=float, default=30, help="giây (trong video) giữa hai log của cùng một người")
+    parser.add_argument("--dry-run", action="store_true", help="chỉ in kết quả, không ghi database")
+    args = parser.parse_args()
+
+    processor = VideoAttendanceProcessor(
+        FaceRecognitionService(), DatabaseHelper(),
+        batch_size=args.batch_size,
+        min_confidence=args.min_confidence,
+        cooldown=args.cooldown,
+        dry_run=args.dry_run
+    )
+    if len(processor.gallery) == 0:
+        print("[LỖI] Gallery trống, hãy tạo embeddings trước")
+        return
+
+    total = {'frames': 0, 'faces': 0, 'logs': 0, 'elapsed': 0.0}
+    for path in args.videos:
+        try:
+            start_time = video_start_time(path, args.start_time)
+            print(f"[INFO] Xử lý {path} (bắt đầu {start_time:%Y-%m-%d %H:%M:%S}, stride {args.stride})")
+            stats = processor.process(path, start_time, args.stride)
+        except Exception as e:
+            print(f"[LỖI] {path}: {e}")
+            continue
+
+        elapsed = max(stats['elapsed'], 1e-6)
+        print(f"[INFO] {path}: {stats['frames']}/{stats['frames_read']} frame, {stats['faces']} khuôn mặt, "
+              f"{stats['logs']} log | {stats['frames'] / elapsed:.1f} frame/s, {stats['faces'] / elapsed:.1f} khuôn mặt/s "
+              f"(decode {stats['decode_time']:.1f}s, detector {stats['detector_runs']} lần, {elapsed:.1f}s)")
+        print(f"[INFO] {path}: {processor.quality_gate.format_stats()}")
+        for key in total:
+            total[key] += stats[key]
+
+    elapsed = max(total['elapsed'], 1e-6)
+    print(f"[INFO] Tổng: {total['frames']} frame, {total['faces']} khuôn mặt, {total['logs']} log trong {elapsed:.1f}s "
+          f"| {total['frames'] / elapsed:.1f} frame/s, {total['faces'] / elapsed:.1f} khuôn mặt/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import time
+import threading
+
+
+class RecognitionScheduler:
+    """
+    Quyết định khi nào chạy nhận diện (RetinaFace + ArcFace) thay cho "mỗi 10 frame" cố định
+    - Giới hạn CPU: thời gian suy luận / khoảng cách giữa hai lần chạy <= cpu_budget
+    - Có khuôn mặt mới (hoặc số khuôn mặt thay đổi): chạy sớm để nhận diện trong target_latency giây
+    - Cảnh tĩnh (số khuôn mặt không đổi): giãn dần khoảng cách, tối đa max_interval
+    - Không có ai: chạy thưa với idle_interval (bắt các khuôn mặt detector nhanh bỏ sót)
+    """
+    def __init__(self, target_latency=0.3, cpu_budget=0.5, min_interval=0.05,
+                 max_interval=2.0, idle_interval=1.0, backoff=1.5):
+        self.target_latency = target_latency
+        self.cpu_budget = max(cpu_budget, 1e-3)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.backoff = backoff
+
+        self.inference_time = 0.0
+        self.face_count = 0
+        self.interval = min_interval
+        self.last_run = 0.0
+        # Lần quyết định gần nhất (chạy model hoặc bỏ qua vì mọi track đã chốt), dùng cho should_run
+        self.last_cycle = 0.0
+        self.rate = 0.0
+        self._static_factor = 1.0
+        self._lock = threading.Lock()
+
+    def next_interval(self, face_count, new_faces=False):
+        """Khoảng cách (giây) tới lần nhận diện tiếp theo theo trạng thái cảnh hiện tại"""
+        budget_interval = self.inference_time / self.cpu_budget
+
+        if new_faces or face_count != self.face_count:
+            # Ưu tiên độ trễ: khuôn mặt mới phải có kết quả trong target_latency
+            interval = min(budget_interval, max(self.target_latency - self.inference_time, 0.0))
+        elif face_count == 0:
+            interval = max(budget_interval, self.idle_interval)
+        else:
+            interval = budget_interval * self._static_factor
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def should_run(self, face_count, new_faces=False, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.interval = self.next_interval(face_count, new_faces)
+            return now - self.last_cycle >= self.interval
+
+    def _update_scene(self, face_count, new_faces):
+        if new_faces or face_count != self.face_count:
+            self._static_factor = 1.0
+        else:
+            self._static_factor = min(self._static_factor * self.backoff, self.max_interval / self.min_interval)
+        self.face_count = face_count
+
+    def record(self, inference_time, face_count, new_faces=False, now=None, alpha=0.3):
+        """Ghi nhận một lần nhận diện vừa chạy xong (thời gian suy luận, số khuôn mặt)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.inference_time == 0:
+                self.inference_time = inference_time
+            else:
+                self.inference_time = (1 - alpha) * self.inference_time + alpha * inference_time
+
+            self._update_scene(face_count, new_faces)
+
+            if self.last_run > 0:
+                elapsed = max(now - self.last_run, 1e-6)
+                self.rate = (1 - alpha) * self.rate + alpha / elapsed if self.rate else 1.0 / elapsed
+            self.last_run = now
+            self.last_cycle = now
+
+    def record_skip(self, face_count, new_faces=False, now=None):
+        """
+        Ghi nhận một lượt should_run cho phép nhưng không cần chạy model (mọi khuôn mặt đã có danh tính)
+        Cảnh tĩnh vẫn giãn khoảng cách như một lần chạy; không tính vào tần suất nhận diện
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._update_scene(face_count, new_faces)
+            self.last_cycle = now
+
+    def current_rate(self, now=None):
+        """Số lần nhận diện mỗi giây gần đây (giảm dần về 0 nếu lâu không chạy)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.last_run == 0:
+                return 0.0
+            return min(self.rate, 1.0 / max(now - self.last_run, 1e-6))
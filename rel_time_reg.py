@@ -5,11 +5,15 @@ import pickle
 import time
 from deepface import DeepFace
 from numpy.linalg import norm
+from face_gallery import FaceGallery
+from embedding_builder import list_dataset_images, build_embeddings_parallel
+from recognition_scheduler import RecognitionScheduler
+from face_detector import FaceDetector
 
 # ========================
 # Build or update embeddings
 # ========================
-def build_or_update_embeddings(dataset_folder, embed_file, model_name="ArcFace", detector_backend="retinaface"):
+def build_or_update_embeddings(dataset_folder, embed_file, model_name="ArcFace", detector_backend="retinaface", workers=0, batch_size=32):
     embeddings = []
 
     if os.path.exists(embed_file):
@@ -19,30 +23,18 @@ def build_or_update_embeddings(dataset_folder, embed_file, model_name="ArcFace",
     existing_identities = set(e["identity"] for e in embeddings)
     print(f"[INFO] Đã có {len(existing_identities)} nhãn trong embeddings")
 
-    for root, dirs, files in os.walk(dataset_folder):
-        label = os.path.basename(root)
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                if label in existing_identities:
-                    continue
-                img_path = os.path.join(root, file)
-                try:
-                    embedding = DeepFace.represent(
-                        img_path=img_path,
-                        model_name=model_name,
-                        detector_backend=detector_backend,
-                        enforce_detection=True
-                    )[0]["embedding"]
-
-                    embeddings.append({
-                        "identity": label,
-                        "embedding": np.array(embedding, dtype=np.float32)
-                    })
-
-                    print(f"[INFO] Thêm embedding cho {label} ({file})")
+    items = list_dataset_images(dataset_folder, skip_labels=existing_identities)
+    for label, img_path, embedding, error in build_embeddings_parallel(
+            items, model_name, detector_backend, workers=workers, enforce_detection=True,
+            batch_size=batch_size):
+        if embedding is None:
+            print(f"[CẢNH BÁO] Không trích xuất được embedding cho {img_path}: {error}")
+            continue
 
-                except Exception as e:
-                    print(f"[CẢNH BÁO] Không trích xuất được embedding cho {img_path}: {e}")
+        embeddings.append({
+            "identity": label,
+            "embedding": embedding
+        })
 
     with open(embed_file, "wb") as f:
         pickle.dump(embeddings, f)
@@ -59,21 +51,9 @@ def cosine_distance(a, b):
 
 
 def find_best_match(face_emb, embeddings, threshold=0.55):
-    min_dist = float("inf")
-    identity = "Unknown"
-
-    for e in embeddings:
-        dist = cosine_distance(face_emb, e["embedding"])
-        if dist < min_dist:
-            min_dist = dist
-            identity = e["identity"]
-
-    confidence = max(0, 1 - min_dist)
-
-    if min_dist > threshold:
-        identity = "Unknown"
-
-    return identity, confidence
+    if not isinstance(embeddings, FaceGallery):
+        embeddings = FaceGallery.from_embeddings(embeddings)
+    return embeddings.find_best_match(face_emb, threshold)
 
 
 # ========================
@@ -95,8 +75,10 @@ if __name__ == "__main__":
     EMBED_FILE = "embeddings.pkl"
     MODEL_NAME = "ArcFace"
     DETECTOR = "retinaface"
+    DETECTION_SCALE = 1.0  # ví dụ 0.5 cho camera 1080p
 
     embeddings = build_or_update_embeddings(DATASET_FOLDER, EMBED_FILE, MODEL_NAME, DETECTOR)
+    gallery = FaceGallery.from_embeddings(embeddings)
 
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
@@ -105,8 +87,9 @@ if __name__ == "__main__":
 
     print("[INFO] Nhấn phím 'q' để thoát")
 
-    frame_count = 0
     last_results = []  # lưu kết quả ở frame trước
+    scheduler = RecognitionScheduler()
+    detector = FaceDetector(DETECTOR, scale=DETECTION_SCALE)
 
     # Biến tính FPS
     fps = 0
@@ -118,29 +101,28 @@ if __name__ == "__main__":
         if not ret:
             break
 
-        frame_count += 1
         fps_count += 1
 
         try:
-            if frame_count % 10 == 0:
+            if scheduler.should_run(len(last_results)):
+                start_time = time.time()
                 last_results = []
-                results = DeepFace.extract_faces(frame, detector_backend=DETECTOR, enforce_detection=False)
-
-                for r in results:
-                    fa = r["facial_area"]
-                    x, y, w, h = fa["x"], fa["y"], fa["w"], fa["h"]
+                boxes, face_imgs = detector.detect(frame)
 
+                for (x, y, w, h), face_img in zip(boxes, face_imgs):
                     emb = DeepFace.represent(
-                        frame[y:y+h, x:x+w],
+                        face_img,
                         model_name=MODEL_NAME,
                         detector_backend="skip",
                         enforce_detection=False
                     )[0]["embedding"]
 
-                    identity, confidence = find_best_match(np.array(emb, dtype=np.float32), embeddings)
+                    identity, confidence = find_best_match(np.array(emb, dtype=np.float32), gallery)
 
                     last_results.append((x, y, w, h, identity, confidence))
 
+                scheduler.record(time.time() - start_time, len(last_results))
+
             # Vẽ lại kết quả gần nhất
             for (x, y, w, h, identity, confidence) in last_results:
                 draw_face(frame, (x, y, w, h), identity, confidence)
@@ -157,7 +139,7 @@ if __name__ == "__main__":
             fps_start_time = end_time
             fps_count = 0
 
-        cv2.putText(frame, f"FPS: {fps:.2f}", (20, 40),
+        cv2.putText(frame, f"FPS: {fps:.2f} | Rec: {scheduler.current_rate():.1f}/s", (20, 40),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
 
         cv2.imshow("Face Recognition", frame)
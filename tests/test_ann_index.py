@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+from ann_index import IVFIndex
+
+
+def _normalized(n, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _recall(index, matrix, queries):
+    exact = np.argmax(queries @ matrix.T, axis=1)
+    ids, _ = index.search(matrix, queries, k=1)
+    return np.mean(ids[:, 0] == exact)
+
+
+def test_recall_improves_with_nprobe_and_is_exact_when_probing_all():
+    matrix = _normalized(2000)
+    queries = matrix[::20] + np.random.default_rng(1).normal(scale=0.05, size=(100, 32)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    index = IVFIndex(nlist=32, nprobe=8).train(matrix)
+
+    assert len(index) == len(matrix)
+    assert sum(len(ids) for ids in index.lists) == len(matrix)
+    assert _recall(index, matrix, queries) >= 0.9
+    index.nprobe = index.nlist
+    assert _recall(index, matrix, queries) == 1.0
+
+
+def test_add_and_remove_keep_row_ids_consistent():
+    matrix = _normalized(500)
+    index = IVFIndex(nlist=8, nprobe=8).train(matrix[:400])
+    index.add(matrix[400:], start_id=400)
+    assert len(index) == 500
+    assert sorted(np.concatenate(index.lists).tolist()) == list(range(500))
+
+    keep_mask = np.ones(500, dtype=bool)
+    keep_mask[::3] = False
+    index.remove(keep_mask)
+    kept = matrix[keep_mask]
+    assert len(index) == len(kept)
+    assert sorted(np.concatenate(index.lists).tolist()) == list(range(len(kept)))
+
+    # Mỗi vector còn lại tìm thấy chính nó ở row id mới
+    ids, similarities = index.search(kept, kept, k=1)
+    assert (ids[:, 0] == np.arange(len(kept))).all()
+    np.testing.assert_allclose(similarities[:, 0], 1.0, atol=1e-5)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    matrix = _normalized(300)
+    index = IVFIndex(nlist=8, nprobe=3).train(matrix)
+    path = str(tmp_path / "index.ivf.npz")
+    index.save(path)
+
+    loaded = IVFIndex.load(path)
+    assert loaded.nprobe == 3
+    assert len(loaded) == len(index)
+    assert np.array_equal(loaded.search(matrix, matrix[:20], k=5)[0], index.search(matrix, matrix[:20], k=5)[0])
+
+
+def test_broken_index_file_is_dropped_for_rebuild(tmp_path, monkeypatch):
+    pytest.importorskip("deepface")
+    pytest.importorskip("psycopg2")
+    import face_service
+    from gallery_store import GalleryStore
+
+    service = face_service.FaceRecognitionService.__new__(face_service.FaceRecognitionService)
+    service.ann_index_file = str(tmp_path / "embeddings.ivf.npz")
+    service.gallery_store = GalleryStore(str(tmp_path / "gallery"))
+    with open(service.ann_index_file, "wb") as f:
+        f.write(b"not an index")
+
+    with service.gallery_store.write_lock():
+        service.update_ann_index(new_vectors=_normalized(2), start_id=0)
+    assert not os.path.exists(service.ann_index_file)
+
+    # Tiến trình khác xóa file giữa lúc đọc: không được ném lỗi ra ngoài
+    with open(service.ann_index_file, "wb") as f:
+        f.write(b"x")
+
+    def vanish(path, nprobe=None):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(face_service.IVFIndex, "load", vanish)
+    service.update_ann_index(new_vectors=_normalized(2), start_id=0)
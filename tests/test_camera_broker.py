@@ -0,0 +1,48 @@
+import time
+import cv2
+import numpy as np
+import pytest
+from camera_broker import CameraBroker
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    """File MJPG ngắn (5 frame, 100 FPS) để broker phát lại nhiều lượt trong vài chục ms"""
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 100, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("OpenCV không có encoder MJPG")
+    for i in range(5):
+        writer.write(np.full((48, 64, 3), i * 40, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_file_source_loops_without_counting_failures(video_file):
+    broker = CameraBroker(video_file)
+    subscription = broker.subscribe()
+    try:
+        deadline = time.time() + 5.0
+        while broker.file_loops < 2 and time.time() < deadline:
+            subscription.read(timeout=0.2)
+    finally:
+        subscription.close()
+
+    stats = broker.stats()
+    assert stats['file_loops'] >= 2
+    assert stats['frames_read'] >= 10
+    assert stats['read_failures'] == 0
+    assert stats['reconnects'] == 0
+
+
+def test_last_unsubscribe_releases_capture(video_file):
+    broker = CameraBroker(video_file)
+    first = broker.subscribe()
+    second = broker.subscribe()
+    assert first.read(timeout=1.0) is not None
+
+    first.close()
+    assert broker.is_opened()
+    second.close()
+    assert broker.cap is None
+    assert second.read(timeout=0.1) is None
@@ -0,0 +1,131 @@
+import os
+import hashlib
+import numpy as np
+import pytest
+from embedding_cache import EmbeddingCache
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_key_depends_on_content_model_and_detector(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.npz"), "ArcFace", "retinaface")
+    a = _write(str(tmp_path / "a.jpg"), b"face-1")
+    b = _write(str(tmp_path / "b.jpg"), b"face-1")
+    c = _write(str(tmp_path / "c.jpg"), b"face-2")
+
+    assert cache.key_for(a) == cache.key_for(b)
+    assert cache.key_for(a) != cache.key_for(c)
+    assert cache.key_for(a) != cache.key_for(a, "skip")
+    assert cache.key_for(a) != EmbeddingCache(str(tmp_path / "other.npz"), "Facenet", "retinaface").key_for(a)
+
+
+def test_save_and_load_round_trip_with_manifest(tmp_path):
+    path = str(tmp_path / "cache.npz")
+    cache = EmbeddingCache(path, "ArcFace", "retinaface")
+    img = _write(str(tmp_path / "a.jpg"), b"face")
+    key = cache.key_for(img)
+    cache.put(key, np.arange(4, dtype=np.float32))
+    cache.put("ArcFace|retinaface|missing", None, "no face")
+    cache.manifest = {"An": [key]}
+    cache.save()
+
+    loaded = EmbeddingCache(path, "ArcFace", "retinaface")
+    np.testing.assert_array_equal(loaded.get(key), np.arange(4, dtype=np.float32))
+    assert "ArcFace|retinaface|missing" in loaded
+    assert loaded.get("ArcFace|retinaface|missing") is None
+    assert loaded.manifest == {"An": [key]}
+
+    loaded.prune([img], [key])
+    assert "ArcFace|retinaface|missing" not in loaded
+
+
+def test_changed_image_changes_manifest_entry(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.npz"), "ArcFace", "retinaface")
+    img = _write(str(tmp_path / "An" / "1.jpg"), b"old")
+    before = cache.key_for(img)
+
+    _write(img, b"new content")
+    assert cache.key_for(img) != before
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """FaceRecognitionService thật (không build model/DB) với embedder giả theo nội dung ảnh"""
+    pytest.importorskip("deepface")
+    pytest.importorskip("psycopg2")
+    import face_service
+    from gallery_store import GalleryStore
+
+    embedded = []
+
+    def fake_build(items, model_name, detector_backend, **kwargs):
+        for label, img_path in items:
+            embedded.append(img_path)
+            with open(img_path, "rb") as f:
+                seed = int(hashlib.sha1(f.read()).hexdigest()[:8], 16)
+            yield label, img_path, np.random.default_rng(seed).normal(size=8).astype(np.float32), None
+
+    class FakeDB:
+        def get_aligned_image_paths(self):
+            return []
+
+        def get_all_persons(self):
+            return [{'id': 1, 'full_name': 'An'}, {'id': 2, 'full_name': 'Binh'}]
+
+    monkeypatch.setattr(face_service, "build_embeddings_parallel", fake_build)
+    service = face_service.FaceRecognitionService.__new__(face_service.FaceRecognitionService)
+    service.dataset_folder = str(tmp_path / "dataset")
+    service.embedding_cache_file = str(tmp_path / "cache.npz")
+    service.ann_index_file = str(tmp_path / "embeddings.ivf.npz")
+    service.model_name = "ArcFace"
+    service.detector_backend = "retinaface"
+    service.gallery_store = GalleryStore(str(tmp_path / "gallery"), max_tombstone_ratio=1.0)
+    service.db = FakeDB()
+    service.embedded = embedded
+    return service
+
+
+def test_generate_embeddings_only_updates_changed_people(service):
+    dataset = service.dataset_folder
+    _write(os.path.join(dataset, "An", "1.jpg"), b"an-1")
+    _write(os.path.join(dataset, "An", "2.jpg"), b"an-2")
+    _write(os.path.join(dataset, "Binh", "1.jpg"), b"binh-1")
+    service._generate_embeddings()
+    assert len(service.embedded) == 3
+    assert sorted(service.gallery_store.load()[1]) == ["An", "An", "Binh"]
+    assert service.gallery_store.load_gallery().person_id("Binh") == 2
+
+    # Không đổi gì: không embed lại, không ghi gallery
+    service.embedded.clear()
+    generation = service.gallery_store.read_header()
+    service._generate_embeddings()
+    assert service.embedded == []
+    assert service.gallery_store.read_header() == generation
+
+    # Bình thêm một ảnh, An bị xóa một ảnh: chỉ embed ảnh mới, cả hai người được thay trong gallery
+    _write(os.path.join(dataset, "Binh", "2.jpg"), b"binh-2")
+    os.remove(os.path.join(dataset, "An", "2.jpg"))
+    service._generate_embeddings()
+    assert service.embedded == [os.path.join(dataset, "Binh", "2.jpg")]
+    assert sorted(service.gallery_store.load()[1]) == ["An", "Binh", "Binh"]
+
+
+def test_replaced_people_keep_their_person_id(service):
+    dataset = service.dataset_folder
+    _write(os.path.join(dataset, "An", "1.jpg"), b"an-1")
+    _write(os.path.join(dataset, "Chi", "1.jpg"), b"chi-1")
+    service._generate_embeddings()
+    gallery = service.gallery_store.load_gallery()
+    assert (gallery.person_id("An"), gallery.person_id("Chi")) == (1, -1)
+
+    # person_id đã có trên các hàng cũ được giữ lại, không tra lại database theo tên
+    service.db.get_all_persons = lambda: []
+    _write(os.path.join(dataset, "An", "2.jpg"), b"an-2")
+    service._generate_embeddings()
+    gallery = service.gallery_store.load_gallery()
+    assert gallery.person_ids[gallery.identities == "An"].tolist() == [1, 1]
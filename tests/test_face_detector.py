@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("deepface")
+import face_detector
+from face_detector import FaceDetector
+
+
+def _fake_extract_faces(results):
+    def extract_faces(image, **kwargs):
+        return [dict(r, face=None) for r in results(image)]
+    return extract_faces
+
+
+def test_downscaled_boxes_map_back_to_full_frame(monkeypatch):
+    monkeypatch.setattr(face_detector.DeepFace, "extract_faces", _fake_extract_faces(lambda image: [
+        {"facial_area": {"x": 10, "y": 20, "w": 30, "h": 40}, "confidence": 0.99}]))
+    frame = np.zeros((200, 300, 3), dtype=np.uint8)
+
+    boxes, face_imgs = FaceDetector("retinaface", scale=0.5).detect(frame)
+    assert boxes == [(20, 40, 60, 80)]
+    assert face_imgs[0].shape == (80, 60, 3)
+
+
+def test_zero_confidence_full_frame_box_is_not_a_face(monkeypatch):
+    # Không có khuôn mặt: DeepFace (enforce_detection=False) trả về cả ảnh với confidence 0
+    monkeypatch.setattr(face_detector.DeepFace, "extract_faces", _fake_extract_faces(lambda image: [
+        {"facial_area": {"x": 0, "y": 0, "w": image.shape[1], "h": image.shape[0]}, "confidence": 0}]))
+    frame = np.zeros((200, 300, 3), dtype=np.uint8)
+
+    assert FaceDetector("retinaface", scale=0.5).detect(frame) == ([], [])
+    assert FaceDetector("retinaface", mode="cascade").detect(frame, hint_boxes=[(50, 50, 40, 40)]) == ([], [])
+
+
+def test_roi_regions_pad_and_clip_to_frame():
+    detector = FaceDetector("retinaface", mode="cascade", roi_padding=0.5)
+    assert detector.roi_regions([(10, 10, 40, 40)], (100, 200, 3)) == [[0, 0, 70, 70]]
+    assert detector.roi_regions([(180, 80, 20, 20)], (100, 200, 3)) == [[170, 70, 200, 100]]
+
+
+def test_roi_regions_merge_overlapping_boxes():
+    detector = FaceDetector("retinaface", mode="cascade", roi_padding=0.5)
+    regions = detector.roi_regions([(100, 100, 40, 40), (150, 100, 40, 40), (400, 300, 20, 20)], (480, 640, 3))
+    assert sorted(regions) == [[80, 80, 210, 160], [390, 290, 430, 330]]
+
+
+def test_roi_regions_merge_chains():
+    # a chồng b, b chồng c nhưng a không chồng c: gộp thành một vùng
+    detector = FaceDetector("retinaface", mode="cascade", roi_padding=0.0)
+    regions = detector.roi_regions([(0, 0, 30, 30), (25, 0, 30, 30), (50, 0, 30, 30)], (100, 100, 3))
+    assert regions == [[0, 0, 80, 30]]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+
+class FakeModel:
+    """Model giả: batch thứ fail_call bị lỗi khi forward"""
+    input_shape = (None, 4, 4, 3)
+    output_shape = (None, 2)
+
+    def __init__(self, fail_call):
+        self.fail_call = fail_call
+        self.calls = 0
+
+    def predict_on_batch(self, batch):
+        self.calls += 1
+        if self.calls == self.fail_call:
+            raise RuntimeError("OOM")
+        return batch.reshape(len(batch), -1)[:, :2]
+
+
+def test_failed_batch_only_marks_its_images():
+    pytest.importorskip("deepface")
+    from face_embedder import FaceEmbedder
+
+    embedder = FaceEmbedder("ArcFace", "skip", batch_size=2)
+    embedder._model = FakeModel(fail_call=2)
+    images = [np.full((4, 4, 3), 255 * (i + 1) // 5, dtype=np.uint8) for i in range(5)]
+
+    embeddings, errors = embedder.represent(images)
+    assert [e is None for e in embeddings] == [False, False, True, True, False]
+    assert errors[:2] == [None, None] and errors[4] is None
+    assert "OOM" in errors[2] and "OOM" in errors[3]
+
+
+def test_embed_chunk_reports_errors_instead_of_raising(monkeypatch):
+    import embedding_builder
+
+    class BrokenEmbedder:
+        def represent(self, images, **kwargs):
+            raise RuntimeError("model lỗi")
+
+    monkeypatch.setitem(embedding_builder._worker_config, 'embedder', BrokenEmbedder())
+    monkeypatch.setitem(embedding_builder._worker_config, 'enforce_detection', False)
+
+    results = embedding_builder._embed_chunk(([("An", "a.jpg"), ("Binh", "b.jpg")], "skip"))
+    assert results == [("An", "a.jpg", None, "model lỗi"), ("Binh", "b.jpg", None, "model lỗi")]
@@ -0,0 +1,131 @@
+import numpy as np
+from face_gallery import FaceGallery, SegmentedRows
+from ann_index import IVFIndex
+
+
+def _gallery(n_persons=20, per_person=3, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_persons, dim))
+    matrix = np.concatenate([center + rng.normal(scale=0.3, size=(per_person, dim)) for center in centers])
+    identities = [f"p{i}" for i in range(n_persons) for _ in range(per_person)]
+    queries = centers[rng.choice(n_persons, 10)] + rng.normal(scale=0.3, size=(10, dim))
+    return matrix.astype(np.float32), identities, queries.astype(np.float32)
+
+
+def _brute_force(matrix, identities, query, threshold, top_k):
+    """Vòng lặp tham chiếu: similarity lớn nhất của mỗi người, sắp giảm dần"""
+    query = query / np.linalg.norm(query)
+    best = {}
+    for vector, identity in zip(matrix, identities):
+        score = float(vector @ query / np.linalg.norm(vector))
+        best[identity] = max(best.get(identity, -np.inf), score)
+    ranked = sorted(best.items(), key=lambda item: -item[1])[:top_k]
+    matches = [(identity, max(0, score)) for identity, score in ranked if 1 - score <= threshold]
+    return matches or [("Unknown", max(0, ranked[0][1]))]
+
+
+def test_find_best_match_equals_brute_force():
+    matrix, identities, queries = _gallery()
+    gallery = FaceGallery(matrix, identities)
+
+    for threshold in (0.3, 0.6, 2.0):
+        for query in queries:
+            (expected_identity, expected_confidence), = _brute_force(matrix, identities, query, threshold, 1)
+            identity, confidence = gallery.find_best_match(query, threshold)
+            assert identity == expected_identity
+            assert abs(confidence - expected_confidence) < 1e-5
+
+
+def test_find_best_match_on_empty_gallery():
+    assert FaceGallery().find_best_match(np.ones(4), 0.6) == ("Unknown", 0.0)
+    assert len(FaceGallery.from_embeddings([])) == 0
+
+
+def _assert_same_matches(results, expected):
+    for matches, expected_matches in zip(results, expected):
+        assert [identity for identity, _ in matches] == [identity for identity, _ in expected_matches]
+        np.testing.assert_allclose([c for _, c in matches], [c for _, c in expected_matches], atol=1e-5)
+
+
+def test_find_best_matches_equals_brute_force():
+    matrix, identities, queries = _gallery()
+    gallery = FaceGallery(matrix, identities)
+
+    for threshold in (0.3, 0.6, 2.0):
+        expected = [_brute_force(matrix, identities, query, threshold, 3) for query in queries]
+        _assert_same_matches(gallery.find_best_matches(queries, threshold, top_k=3), expected)
+
+
+def test_find_best_matches_first_result_equals_find_best_match():
+    matrix, identities, queries = _gallery()
+    gallery = FaceGallery(matrix, identities)
+
+    results = gallery.find_best_matches(queries, 0.6, top_k=2)
+    for query, matches in zip(queries, results):
+        identity, confidence = gallery.find_best_match(query, 0.6)
+        assert matches[0][0] == identity
+        assert abs(matches[0][1] - confidence) < 1e-5
+
+
+def test_find_best_matches_on_empty_input_and_gallery():
+    assert FaceGallery().find_best_matches(np.ones((2, 4)), 0.6) == [[("Unknown", 0.0)]] * 2
+    matrix, identities, _ = _gallery()
+    assert FaceGallery(matrix, identities).find_best_matches(np.zeros((0, 16)), 0.6) == []
+
+
+def test_person_id_comes_from_the_person_ids_column():
+    matrix, _, _ = _gallery(n_persons=3, per_person=2)
+    gallery = FaceGallery(matrix, ["a", "a", "b", "b", "c", "c"], person_ids=[-1, 7, 8, 8, -1, -1])
+
+    assert gallery.person_id("a") == 7
+    assert gallery.person_id("b") == 8
+    assert gallery.person_id("c") == -1
+    assert gallery.person_id("missing") == -1
+    assert gallery.extended(matrix[:1], ["c"], [9]).person_id("c") == 9
+
+
+def test_compressed_scan_keeps_top_match():
+    matrix, identities, queries = _gallery()
+    exact = FaceGallery(matrix, identities).find_best_matches(queries, 0.6)
+
+    for dtype in ("float16", "int8"):
+        gallery = FaceGallery(matrix, identities).compress(dtype, rerank_candidates=16)
+        _assert_same_matches(gallery.find_best_matches(queries, 0.6), exact)
+        assert gallery.memory_footprint()['scan_bytes'] < gallery.memory_footprint()['float32_bytes']
+
+
+def test_segmented_rows_index_like_the_joined_matrix():
+    matrix = FaceGallery.l2_normalize(_gallery()[0])
+    rows = SegmentedRows([matrix[:10], matrix[10:10], matrix[10:40], matrix[40:]],
+                         [None, None, np.array([0, 2, 5, 29]), None])
+    joined = np.concatenate([matrix[:10], matrix[[10, 12, 15, 39]], matrix[40:]])
+
+    assert rows.shape == joined.shape
+    np.testing.assert_array_equal(np.asarray(rows), joined)
+    np.testing.assert_array_equal(rows[3:30:4], joined[3:30:4])
+    ids = np.array([[13, 0], [11, len(joined) - 1]])
+    np.testing.assert_array_equal(rows[ids], joined[ids])
+
+
+def test_extended_compressed_gallery_does_not_copy_the_matrix():
+    matrix, identities, queries = _gallery()
+    base = FaceGallery(matrix[:30], identities[:30]).compress("int8")
+
+    extended = base.extended(matrix[30:], identities[30:])
+    assert isinstance(extended.matrix, SegmentedRows)
+    assert extended.matrix.blocks[0] is base.matrix
+    _assert_same_matches(extended.find_best_matches(queries, 0.6),
+                         FaceGallery(matrix, identities).compress("int8").find_best_matches(queries, 0.6))
+
+
+def test_extended_matches_rebuilt_gallery():
+    matrix, identities, queries = _gallery()
+    base = FaceGallery(matrix[:30], identities[:30])
+    base.index = IVFIndex(nlist=4, nprobe=4).train(base.matrix)
+
+    extended = base.extended(matrix[30:], identities[30:])
+    assert len(base) == 30
+    assert len(extended) == len(matrix)
+    assert len(extended.index) == len(matrix)
+    _assert_same_matches(extended.find_best_matches(queries, 0.6),
+                         FaceGallery(matrix, identities).find_best_matches(queries, 0.6))
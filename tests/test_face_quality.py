@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+from face_quality import FaceQualityGate
+
+
+def _face(size=100, brightness=128, sharp=True, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.clip(rng.normal(brightness, 40 if sharp else 0, (size, size, 3)), 0, 255).astype(np.uint8)
+    return img if sharp else cv2.GaussianBlur(img, (15, 15), 5)
+
+
+def test_rejection_reasons():
+    gate = FaceQualityGate(min_size=40, min_blur=50.0, min_brightness=40.0, max_brightness=220.0, max_yaw=0.2)
+    faces = [_face(), _face(size=30), _face(brightness=15), _face(brightness=245), _face(sharp=False), _face()]
+    landmarks = [None, None, None, None, None, {'left_eye': (75, 40), 'right_eye': (95, 40)}]
+
+    assert gate.evaluate(faces, landmarks) == [None, 'size', 'brightness', 'brightness', 'blur', 'pose']
+    assert gate.stats() == {'passed': 1, 'size': 1, 'blur': 1, 'brightness': 2, 'pose': 1}
+
+
+def test_frontal_landmarks_pass_and_yaw_can_be_disabled():
+    frontal = {'left_eye': (35, 40), 'right_eye': (65, 40)}
+    turned = {'left_eye': (75, 40), 'right_eye': (95, 40)}
+    assert FaceQualityGate().evaluate([_face(), _face()], [frontal, turned]) == [None, 'pose']
+    assert FaceQualityGate(max_yaw=0).evaluate([_face()], [turned]) == [None]
+
+
+def test_batch_laplacian_matches_opencv():
+    face = _face(size=160)
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    expected = cv2.Laplacian(gray, cv2.CV_64F)[1:-1, 1:-1].var()
+
+    threshold_below = FaceQualityGate(min_blur=expected * 0.99, min_brightness=0, max_brightness=255)
+    threshold_above = FaceQualityGate(min_blur=expected * 1.01, min_brightness=0, max_brightness=255)
+    assert threshold_below.evaluate([face]) == [None]
+    assert threshold_above.evaluate([face]) == ['blur']
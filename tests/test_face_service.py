@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("deepface")
+pytest.importorskip("psycopg2")
+import face_service
+from face_gallery import FaceGallery
+
+
+class FakeDB:
+    def __init__(self, persons):
+        self.persons = persons
+
+    def get_person_by_id(self, person_id):
+        return next((p for p in self.persons if p['id'] == person_id), None)
+
+    def get_all_persons(self):
+        return list(self.persons)
+
+
+def _service(db):
+    service = face_service.FaceRecognitionService.__new__(face_service.FaceRecognitionService)
+    service.db = db
+    service.gallery = None
+    return service
+
+
+def test_find_person_uses_gallery_person_id_even_after_rename():
+    db = FakeDB([{'id': 5, 'full_name': 'Nguyễn Văn B'}])
+    gallery = FaceGallery(np.eye(2, dtype=np.float32), ["Nguyễn Văn A", "Nguyễn Văn A"], person_ids=[5, 5])
+    assert _service(db).find_person("Nguyễn Văn A", gallery)['id'] == 5
+
+
+def test_find_person_falls_back_to_name_for_rows_without_person_id():
+    db = FakeDB([{'id': 3, 'full_name': 'A/B'}])
+    gallery = FaceGallery(np.eye(2, dtype=np.float32), ["A_B", "C"])
+    service = _service(db)
+    # Tên thư mục đã chuẩn hóa (ký tự không hợp lệ -> '_')
+    assert service.find_person("A_B", gallery)['id'] == 3
+    assert service.find_person("C", gallery) is None
@@ -0,0 +1,101 @@
+import numpy as np
+from face_tracker import FaceTracker, box_iou
+
+
+def test_box_iou():
+    iou = box_iou([(0, 0, 10, 10)], [(0, 0, 10, 10), (5, 0, 10, 10), (20, 20, 5, 5)])
+    np.testing.assert_allclose(iou, [[1.0, 50 / 150, 0.0]], atol=1e-6)
+
+
+def test_tracks_keep_ids_across_frames():
+    tracker = FaceTracker(max_missed=2)
+    first = tracker.update([(0, 0, 50, 50), (200, 0, 50, 50)])
+    ids = {t['box']: t['id'] for t in first}
+
+    # Cả hai di chuyển một chút (và đổi thứ tự): vẫn giữ id
+    second = tracker.update([(205, 2, 50, 50), (4, 3, 50, 50)])
+    assert {t['id'] for t in second} == set(ids.values())
+    moved = {t['box']: t['id'] for t in second}
+    assert moved[(4, 3, 50, 50)] == ids[(0, 0, 50, 50)]
+    assert moved[(205, 2, 50, 50)] == ids[(200, 0, 50, 50)]
+
+
+def test_fast_motion_falls_back_to_centroid_distance():
+    tracker = FaceTracker(iou_threshold=0.3, max_centroid_distance=0.5)
+    track_id = tracker.update([(0, 0, 40, 40)])[0]['id']
+    # IoU = 0 nhưng tâm chỉ lệch 0.45 lần kích thước box
+    tracks = tracker.update([(18, 0, 40, 40)])
+    assert [t['id'] for t in tracks] == [track_id]
+
+
+def test_missed_tracks_expire():
+    tracker = FaceTracker(max_missed=2)
+    tracker.update([(0, 0, 50, 50)])
+    for _ in range(2):
+        assert len(tracker.update([])) == 1
+    assert tracker.update([]) == []
+
+
+def test_pending_retries_after_interval_and_skips_committed():
+    tracker = FaceTracker()
+    track_id = tracker.update([(0, 0, 50, 50)])[0]['id']
+
+    assert tracker.pending(retry_interval=1.0, now=10.0) == [track_id]
+    assert tracker.pending(retry_interval=1.0, now=10.5) == []
+    assert tracker.pending(retry_interval=1.0, now=11.0) == [track_id]
+
+    tracker.observe(track_id, np.ones(4))
+    assert tracker.vote(track_id, [("An", 0.9), ("Binh", 0.3)], votes=1)
+    assert tracker.pending(retry_interval=1.0, now=20.0) == []
+
+
+def test_match_and_add():
+    tracker = FaceTracker()
+    track_id = tracker.update([(0, 0, 50, 50)])[0]['id']
+    assert tracker.match([(2, 2, 50, 50), (300, 300, 40, 40)]) == [track_id, None]
+
+    added = tracker.add((300, 300, 40, 40), now=5.0)
+    assert added != track_id
+    assert tracker.match([(300, 300, 40, 40)]) == [added]
+    # Track do add tạo đã được thử ở now=5.0
+    assert tracker.pending(retry_interval=1.0, now=5.5) == [track_id]
+
+
+def test_vote_needs_enough_observations_and_margin():
+    tracker = FaceTracker(min_votes=2, accept_confidence=0.6, accept_margin=0.1, early_accept=0.8)
+    track_id = tracker.update([(0, 0, 50, 50)])[0]['id']
+
+    mean, votes = tracker.observe(track_id, np.array([1.0, 0.0]))
+    assert votes == 1
+    assert not tracker.vote(track_id, [("An", 0.7), ("Binh", 0.2)], votes)
+
+    mean, votes = tracker.observe(track_id, np.array([0.0, 2.0]))
+    np.testing.assert_allclose(mean, [0.5, 0.5])
+    assert votes == 2
+    # Hai người quá giống nhau: chưa chốt
+    assert not tracker.vote(track_id, [("An", 0.7), ("Binh", 0.65)], votes)
+    assert not tracker.vote(track_id, [("Unknown", 0.9)], votes)
+    assert tracker.vote(track_id, [("An", 0.7), ("Binh", 0.5)], votes)
+    # Chỉ báo một lần
+    assert not tracker.vote(track_id, [("An", 0.9)], votes)
+
+
+def test_empty_embedding_is_not_a_vote():
+    tracker = FaceTracker()
+    track_id = tracker.update([(0, 0, 50, 50)])[0]['id']
+    assert tracker.observe(track_id, np.zeros(4)) == (None, 0)
+
+
+def test_expired_track_can_still_vote_when_kept():
+    tracker = FaceTracker(max_missed=1, keep_expired=True)
+    track_id = tracker.update([(0, 0, 50, 50)])[0]['id']
+    tracker.update([])
+    tracker.update([])
+    assert tracker.tracks == []
+
+    mean, votes = tracker.observe(track_id, np.ones(4))
+    assert votes == 1
+    assert tracker.vote(track_id, [("An", 0.9)], votes)
+
+    tracker.clear_expired()
+    assert tracker.observe(track_id, np.ones(4)) == (None, 0)
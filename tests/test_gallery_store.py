@@ -0,0 +1,158 @@
+import os
+import multiprocessing
+import numpy as np
+from face_gallery import FaceGallery
+from gallery_store import GalleryStore
+
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _append_many(folder, worker, count):
+    store = GalleryStore(folder, max_segments=4, max_tombstone_ratio=1.0)
+    for i in range(count):
+        store.append(_vectors(1, seed=worker * 1000 + i), [f"w{worker}-{i}"])
+    if store._compaction_thread is not None:
+        store._compaction_thread.join()
+
+
+def test_compaction_does_not_delete_segments_of_concurrent_write(tmp_path):
+    folder = str(tmp_path / "gallery")
+    store = GalleryStore(folder, max_tombstone_ratio=1.0)
+    store.write(_vectors(3), ["a", "b", "c"])
+    store.delete(["a"])
+
+    # Tiến trình khác ghi đè gallery trong lúc compaction đang gộp (cùng generation mới, seq 1)
+    other = GalleryStore(folder)
+    load_snapshot = store._load_snapshot
+
+    def snapshot_then_rewrite(header):
+        result = load_snapshot(header)
+        other.write(_vectors(2, seed=1), ["x", "y"])
+        return result
+
+    store._load_snapshot = snapshot_then_rewrite
+    store.compact()
+
+    matrix, identities, _ = GalleryStore(folder).load()
+    assert identities == ["x", "y"]
+    np.testing.assert_allclose(matrix, FaceGallery.l2_normalize(_vectors(2, seed=1)), rtol=1e-6)
+
+
+def test_appends_from_several_processes_are_all_kept(tmp_path):
+    folder = str(tmp_path / "gallery")
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    workers = [context.Process(target=_append_many, args=(folder, worker, 10)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    _, identities, _ = GalleryStore(folder).load()
+    assert sorted(identities) == sorted(f"w{w}-{i}" for w in range(4) for i in range(10))
+
+
+def test_replace_swaps_rows_in_one_header_write(tmp_path):
+    store = GalleryStore(str(tmp_path / "gallery"), max_tombstone_ratio=1.0)
+    store.write(_vectors(3), ["a", "b", "a"])
+
+    headers = []
+    write_header = store._write_header
+    store._write_header = lambda header: (headers.append(header), write_header(header))
+
+    keep_mask, start_id = store.replace(["a"], _vectors(2, seed=2), ["a", "a"], [7, 7])
+
+    assert len(headers) == 1
+    assert keep_mask.tolist() == [False, True, False]
+    assert start_id == 1
+    matrix, identities, person_ids = store.load()
+    assert identities == ["b", "a", "a"]
+    assert person_ids.tolist() == [-1, 7, 7]
+    np.testing.assert_allclose(matrix[1:], FaceGallery.l2_normalize(_vectors(2, seed=2)), rtol=1e-6)
+
+
+def test_append_delete_and_compaction_round_trip(tmp_path):
+    folder = str(tmp_path / "gallery")
+    store = GalleryStore(folder, max_segments=100, max_tombstone_ratio=1.0)
+    vectors = _vectors(6)
+
+    assert store.append(vectors[:2], ["a", "b"], [1, 2]) == 0
+    assert store.append(vectors[2:4], ["c", "a"], [3, 1]) == 2
+    keep_mask = store.delete(["a"])
+    assert keep_mask.tolist() == [False, True, True, False]
+    # Thêm lại sau khi xóa: tombstone không áp dụng cho segment mới hơn
+    assert store.append(vectors[4:], ["a", "d"], [1, 4]) == 2
+
+    expected = store.load()
+    assert expected[1] == ["b", "c", "a", "d"]
+    assert expected[2].tolist() == [2, 3, 1, 4]
+
+    store.compact()
+    header = store.read_header()
+    assert len(header["segments"]) == 1
+    assert header["deleted"] == 0
+    matrix, identities, person_ids = GalleryStore(folder).load()
+    assert identities == expected[1]
+    assert person_ids.tolist() == expected[2].tolist()
+    np.testing.assert_allclose(matrix, expected[0])
+    np.testing.assert_allclose(matrix, FaceGallery.l2_normalize(vectors[[1, 2, 4, 5]]), rtol=1e-6)
+
+    # Chỉ còn file của header hiện tại
+    referenced = {header["tombstones"]} | {s["vectors"] for s in header["segments"]} | \
+        {s["table"] for s in header["segments"]}
+    assert {name for name in os.listdir(folder) if name.startswith(("seg-", "tombstones-"))} <= referenced
+
+
+def test_background_compaction_after_too_many_segments(tmp_path):
+    store = GalleryStore(str(tmp_path / "gallery"), max_segments=3)
+    for i in range(5):
+        store.append(_vectors(1, seed=i), [f"p{i}"])
+        if store._compaction_thread is not None:
+            store._compaction_thread.join()
+
+    assert len(store.read_header()["segments"]) <= 3
+    assert store.load()[1] == [f"p{i}" for i in range(5)]
+
+
+def test_write_replaces_everything(tmp_path):
+    store = GalleryStore(str(tmp_path / "gallery"))
+    store.append(_vectors(2), ["a", "b"])
+    store.write(_vectors(1, seed=3), ["z"])
+    assert store.load()[1] == ["z"]
+    assert store.read_header()["generation"] == 2
+
+
+def test_compaction_keeps_merged_segment_of_newer_generation(tmp_path):
+    folder = str(tmp_path / "gallery")
+    store = GalleryStore(folder, max_tombstone_ratio=1.0)
+    store.write(_vectors(3), ["a", "b", "c"])
+    store.delete(["a"])
+
+    # Tiến trình khác đã đọc header mới và đang gộp ngoài khóa: segment gộp của nó chưa có trong header
+    pending = store._write_segment(1, 3, _vectors(1), ["x"], [-1], tag="pending")
+    store.compact()
+
+    assert os.path.exists(os.path.join(folder, pending["vectors"]))
+    assert store.load()[1] == ["b", "c"]
+
+
+def test_segmented_load_keeps_every_segment_on_disk(tmp_path):
+    folder = str(tmp_path / "gallery")
+    store = GalleryStore(folder, max_segments=100, max_tombstone_ratio=1.0)
+    vectors = _vectors(40, seed=3)
+    store.append(vectors[:20], [f"p{i % 10}" for i in range(20)])
+    store.append(vectors[20:], [f"q{i % 10}" for i in range(20)])
+    store.delete(["p3", "q7"])
+
+    gallery = store.load_gallery(segmented=True).compress("int8")
+    expected = FaceGallery(*store.load()[:2], normalized=True)
+    np.testing.assert_array_equal(np.asarray(gallery.matrix), expected.matrix)
+    assert list(gallery.identities) == list(expected.identities)
+    assert gallery.memory_footprint()['resident_float32_bytes'] == 0
+    assert expected.memory_footprint()['resident_float32_bytes'] == expected.matrix.nbytes
+
+    queries = vectors[::3] + 0.01
+    assert [m[0][0] for m in gallery.find_best_matches(queries, 0.6)] == \
+        [m[0][0] for m in expected.find_best_matches(queries, 0.6)]
@@ -0,0 +1,14 @@
+import pytest
+
+pytest.importorskip("deepface")
+from multi_camera import CameraWorker, FairInferenceGate
+
+
+def test_camera_stats_line_includes_stage_queues_and_drops():
+    worker = CameraWorker("cam0", 0, face_service=None, get_gallery=lambda: None, gate=FairInferenceGate())
+    worker.pipeline.stages['recognize'].queue.dropped = 7
+
+    line = worker.format_stats(fps=12.0)
+    assert line.startswith("cam0: 12.0 FPS")
+    assert "recognize q=0 drop=7" in line
+    assert "detect q=0 drop=0" in line
@@ -0,0 +1,104 @@
+from datetime import datetime
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("deepface")
+pytest.importorskip("psycopg2")
+from process_videos import VideoAttendanceProcessor
+
+
+class FakeCascade:
+    """
+    Haar thấy khuôn mặt trong visible_frames frame đầu rồi người đó rời khung hình
+    second_from: từ frame này có thêm người thứ hai (None = không có)
+    """
+    def __init__(self, visible_frames, second_from=None):
+        self.visible_frames = visible_frames
+        self.second_from = second_from
+        self.calls = 0
+
+    def detectMultiScale(self, gray, scale_factor, min_neighbors):
+        self.calls += 1
+        boxes = [(40, 40, 100, 100)] if self.calls <= self.visible_frames else []
+        if self.second_from is not None and self.calls >= self.second_from:
+            boxes.append((150, 150, 40, 40))
+        return boxes
+
+
+class FakeDetector:
+    def detect(self, frame, hint_boxes=None, return_landmarks=False):
+        rng = np.random.default_rng(0)
+        crops = [rng.integers(60, 200, (100, 100, 3), dtype=np.uint8) for _ in hint_boxes]
+        return list(hint_boxes), crops, [None] * len(crops)
+
+
+class FakeFaceService:
+    def __init__(self, visible_frames, second_from=None):
+        self.face_cascade = FakeCascade(visible_frames, second_from)
+        self.detector = FakeDetector()
+        self.embedded = 0
+
+    def load_gallery(self):
+        return ["Alice"]
+
+    def represent_batch(self, face_imgs):
+        self.embedded += len(face_imgs)
+        return [np.ones(8, dtype=np.float32) for _ in face_imgs]
+
+    def match_embeddings(self, face_embs, gallery, top_k=1):
+        return [[("Alice", 0.9), ("Unknown", 0.1)] for _ in face_embs]
+
+    def find_person(self, identity, gallery=None):
+        return {'id': 1, 'full_name': 'Alice'} if identity == "Alice" else None
+
+
+class FakeDB:
+    def __init__(self):
+        self.logs = []
+
+    def add_recognition_log(self, person_id, identified_name, confidence, recognition_time=None):
+        self.logs.append((person_id, identified_name, recognition_time))
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    path = str(tmp_path / "entrance.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (200, 200))
+    if not writer.isOpened():
+        pytest.skip("OpenCV không có encoder MJPG")
+    for _ in range(40):
+        writer.write(np.full((200, 200, 3), 128, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_short_track_is_logged_after_it_leaves(video_file):
+    # Track chỉ sống vài frame rồi bị xóa (max_missed) rất lâu trước khi batch đầy
+    face_service = FakeFaceService(visible_frames=3)
+    db = FakeDB()
+    processor = VideoAttendanceProcessor(face_service, db, batch_size=32)
+
+    stats = processor.process(video_file, datetime(2026, 10, 18, 7, 30))
+
+    assert face_service.embedded == 1
+    assert stats['logs'] == 1
+    assert db.logs == [(1, 'Alice', datetime(2026, 10, 18, 7, 30))]
+
+
+def test_quality_gate_only_scores_faces_that_will_be_recognised(video_file):
+    # Người thứ hai xuất hiện khi track của người đầu chưa tới lượt thử lại: chỉ crop mới được chấm
+    face_service = FakeFaceService(visible_frames=40, second_from=5)
+    processor = VideoAttendanceProcessor(face_service, FakeDB(), batch_size=32)
+    evaluate = processor.quality_gate.evaluate
+    scored = []
+
+    def spy(face_imgs, landmarks=None):
+        scored.append(len(face_imgs))
+        return evaluate(face_imgs, landmarks)
+
+    processor.quality_gate.evaluate = spy
+    processor.process(video_file, datetime(2026, 10, 18, 7, 30))
+
+    assert scored[:2] == [1, 1]
+    assert sum(scored) == face_service.embedded
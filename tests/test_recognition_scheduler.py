@@ -0,0 +1,55 @@
+from recognition_scheduler import RecognitionScheduler
+
+
+def _run(scheduler, face_count, seconds, fps=30, start=100.0, inference_time=0.05, skip=False):
+    """Giả lập camera fps frame/giây với số khuôn mặt không đổi. Returns: (số lần chạy, thời điểm cuối)"""
+    runs = 0
+    now = start
+    for _ in range(int(seconds * fps)):
+        now += 1.0 / fps
+        if scheduler.should_run(face_count, now=now):
+            if skip:
+                scheduler.record_skip(face_count, now=now)
+            else:
+                scheduler.record(inference_time, face_count, now=now)
+            runs += 1
+    return runs, now
+
+
+def test_new_face_runs_within_target_latency_despite_cpu_budget():
+    scheduler = RecognitionScheduler(target_latency=0.3, cpu_budget=0.25)
+    scheduler.record(0.2, 1, new_faces=True, now=100.0)
+
+    # Cảnh không đổi: 0.2s suy luận / 25% CPU -> chờ ít nhất 0.8s
+    assert not scheduler.should_run(1, now=100.5)
+    # Có người mới: chạy trong target_latency
+    assert scheduler.should_run(2, new_faces=True, now=100.15)
+
+
+def test_static_scene_backs_off_to_max_interval():
+    scheduler = RecognitionScheduler(cpu_budget=0.5, max_interval=2.0)
+    scheduler.record(0.05, 1, new_faces=True, now=100.0)
+
+    early, now = _run(scheduler, 1, seconds=2)
+    late, _ = _run(scheduler, 1, seconds=10, start=now)
+    assert late <= 10 / 2.0 + 1
+    # Tần suất giảm rõ rệt khi cảnh đứng yên
+    assert early / 2 > 3 * late / 10
+    assert scheduler.interval == 2.0
+
+
+def test_empty_scene_uses_idle_interval():
+    scheduler = RecognitionScheduler(idle_interval=1.0)
+    scheduler.record(0.01, 0, now=100.0)
+    runs, _ = _run(scheduler, 0, seconds=10, inference_time=0.01)
+    assert 8 <= runs <= 11
+
+
+def test_skipped_cycles_back_off_without_counting_as_runs():
+    scheduler = RecognitionScheduler(max_interval=2.0)
+    scheduler.record(0.05, 1, new_faces=True, now=100.0)
+
+    runs, now = _run(scheduler, 1, seconds=10, skip=True)
+    assert runs <= 15
+    assert scheduler.interval == 2.0
+    assert scheduler.current_rate(now=now) == 0.0
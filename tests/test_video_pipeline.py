@@ -0,0 +1,34 @@
+import threading
+import time
+from video_pipeline import DropOldestQueue
+
+
+def test_full_queue_drops_oldest_instead_of_blocking():
+    queue = DropOldestQueue(maxsize=2)
+    for item in range(5):
+        queue.put(item)
+
+    assert len(queue) == 2
+    assert queue.dropped == 3
+    assert queue.get(timeout=0) == 3
+    assert queue.get(timeout=0) == 4
+    assert queue.get(timeout=0) is None
+
+
+def test_get_waits_for_a_late_put():
+    queue = DropOldestQueue(maxsize=1)
+    threading.Timer(0.05, queue.put, args=("frame",)).start()
+
+    start = time.time()
+    assert queue.get(timeout=2.0) == "frame"
+    assert time.time() - start < 1.0
+
+
+def test_get_times_out_and_clear_empties():
+    queue = DropOldestQueue(maxsize=3)
+    assert queue.get(timeout=0.01) is None
+    queue.put(1)
+    queue.put(2)
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.dropped == 0
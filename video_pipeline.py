@@ -0,0 +1,219 @@
+import time
+import threading
+from collections import deque
+
+
+class DropOldestQueue:
+    """
+    Hàng đợi giới hạn kích thước, khi đầy thì bỏ phần tử cũ nhất thay vì chặn người ghi
+    Stage chậm vì thế chỉ bỏ lỡ frame cũ, không bao giờ làm stage trước bị đứng
+    """
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Lấy phần tử cũ nhất; hết timeout mà hàng đợi rỗng thì trả về None"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+
+
+class StageStats:
+    """Thống kê của một stage: số frame đã xử lý, độ trễ xử lý (trung bình trượt) và lớn nhất"""
+    def __init__(self, name, queue=None):
+        self.name = name
+        self.queue = queue
+        self.processed = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, alpha=0.1):
+        with self._lock:
+            self.processed += 1
+            self.latency = latency if self.processed == 1 else (1 - alpha) * self.latency + alpha * latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'processed': self.processed,
+                'latency_ms': self.latency * 1000,
+                'max_latency_ms': self.max_latency * 1000,
+                'queue': len(self.queue) if self.queue is not None else 0,
+                'dropped': self.queue.dropped if self.queue is not None else 0
+            }
+
+
+class RecognitionPipeline:
+    """
+    Pipeline camera nhiều stage, mỗi stage một thread, nối với nhau bằng DropOldestQueue:
+
+        capture -> detect -> render           (mỗi frame, giữ preview đúng FPS camera)
+                         \\-> recognize        (chỉ frame mới nhất, chạy nhanh nhất CPU cho phép)
+
+    Các stage là hàm do người dùng truyền vào:
+    - read_frame() -> frame BGR hoặc None (camera tạm dừng/chưa sẵn sàng)
+    - detect(frame) -> danh sách box phát hiện nhanh (Haar)
+    - recognize(packet) -> kết quả nhận diện; kết quả mới nhất được đưa cho render
+    - render(packet, results) -> vẽ/hiển thị frame
+    packet: dict {'id', 'time', 'frame', 'faces'}
+    extra_stats: hàm trả về chuỗi thống kê thêm, in kèm thống kê pipeline (ví dụ độ trễ detector theo scale)
+    """
+    def __init__(self, read_frame, detect, recognize, render, queue_size=2, stats_interval=0, extra_stats=None):
+        self.read_frame = read_frame
+        self.detect = detect
+        self.recognize = recognize
+        self.render = render
+        self.stats_interval = stats_interval
+        self.extra_stats = extra_stats
+
+        self.detect_queue = DropOldestQueue(queue_size)
+        self.render_queue = DropOldestQueue(queue_size)
+        # Nhận diện luôn làm việc trên frame mới nhất
+        self.recognize_queue = DropOldestQueue(1)
+
+        self.stages = {
+            'capture': StageStats('capture'),
+            'detect': StageStats('detect', self.detect_queue),
+            'recognize': StageStats('recognize', self.recognize_queue),
+            'render': StageStats('render', self.render_queue)
+        }
+        # Độ trễ từ lúc đọc frame tới lúc hiển thị xong
+        self.end_to_end = StageStats('end_to_end')
+
+        self.results = []
+        self.results_frame_id = -1
+        self.is_running = False
+        self._threads = []
+        self._frame_id = 0
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._threads = [
+            threading.Thread(target=self._run_stage, args=(name, target), daemon=True, name=f"pipeline-{name}")
+            for name, target in (('capture', self._capture_step), ('detect', self._detect_step),
+                                 ('recognize', self._recognize_step), ('render', self._render_step))
+        ]
+        if self.stats_interval > 0:
+            self._threads.append(threading.Thread(target=self._report_stats, daemon=True, name="pipeline-stats"))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=1.0):
+        self.is_running = False
+        current = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current:
+                thread.join(timeout)
+        self._threads = []
+
+    def reset(self):
+        """Bỏ các frame đang chờ và kết quả cũ (ví dụ khi tạm dừng camera)"""
+        for queue in (self.detect_queue, self.render_queue, self.recognize_queue):
+            queue.clear()
+        self.results = []
+        self.results_frame_id = -1
+
+    def _run_stage(self, name, step):
+        while self.is_running:
+            try:
+                step()
+            except Exception as e:
+                print(f"[LỖI] pipeline {name}: {e}")
+                time.sleep(0.1)
+
+    def _capture_step(self):
+        start = time.time()
+        frame = self.read_frame()
+        if frame is None:
+            self.reset()
+            time.sleep(0.1)
+            return
+
+        self._frame_id += 1
+        self.stages['capture'].record(time.time() - start)
+        self.detect_queue.put({'id': self._frame_id, 'time': start, 'frame': frame, 'faces': []})
+
+    def _detect_step(self):
+        packet = self.detect_queue.get(timeout=0.1)
+        if packet is None:
+            return
+
+        start = time.time()
+        packet['faces'] = self.detect(packet['frame'])
+        self.stages['detect'].record(time.time() - start)
+
+        self.render_queue.put(packet)
+        self.recognize_queue.put(packet)
+
+    def _recognize_step(self):
+        packet = self.recognize_queue.get(timeout=0.1)
+        if packet is None:
+            return
+
+        start = time.time()
+        results = self.recognize(packet)
+        self.stages['recognize'].record(time.time() - start)
+
+        if results is not None:
+            self.results = results
+            self.results_frame_id = packet['id']
+
+    def _render_step(self):
+        packet = self.render_queue.get(timeout=0.1)
+        if packet is None:
+            return
+
+        start = time.time()
+        self.render(packet, self.results)
+        end = time.time()
+        self.stages['render'].record(end - start)
+        self.end_to_end.record(end - packet['time'])
+
+    def stats(self):
+        """Thống kê từng stage: số frame, độ trễ (ms), độ sâu hàng đợi đầu vào, số frame bị bỏ"""
+        stats = {name: stage.snapshot() for name, stage in self.stages.items()}
+        stats['end_to_end'] = self.end_to_end.snapshot()
+        return stats
+
+    def format_stats(self):
+        stats = self.stats()
+        parts = [f"{name}: {s['latency_ms']:.1f}ms q={s['queue']} drop={s['dropped']}"
+                 for name, s in stats.items() if name != 'end_to_end']
+        parts.append(f"end_to_end: {stats['end_to_end']['latency_ms']:.1f}ms")
+        if self.extra_stats is not None:
+            extra = self.extra_stats()
+            if extra:
+                parts.append(extra)
+        return " | ".join(parts)
+
+    def _report_stats(self):
+        while self.is_running:
+            time.sleep(self.stats_interval)
+            if self.is_running:
+                print(f"[INFO] Pipeline {self.format_stats()}")